@@ -4,8 +4,9 @@ from .models import User
 
 
 class AdminUser(admin.ModelAdmin):
-    readonly_fields = ['password']
+    readonly_fields = ['password', 'digest_sent_at']
     list_display = ['username', 'name', 'email', 'is_active']
+    list_filter = ['announcement_delivery']
     search_fields = ['name', 'username', 'email']
 
 
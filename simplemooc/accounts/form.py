@@ -1,5 +1,9 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 
 from .models import PasswordReset
 from ..core.utils import generate_hash_key
@@ -70,22 +74,32 @@ class PasswordResetForm(forms.Form):
 
     def clean_email(self):
         email = self.cleaned_data['email']
-        # Verifica se tem um usuário com esse email
-        if User.objects.filter(email=email).exists():
+        # Verifica se tem um usuário com esse email (e já guarda o usuário para o save)
+        self.user = User.objects.filter(email=email).first()
+        if self.user:
             return email
 
         raise forms.ValidationError('Nenhum usuário encontrado com este email')
 
     def save(self):
-        # Salvando hash novo de senha
-        user = User.objects.get(email=self.cleaned_data['email'])
-        key = generate_hash_key(user.username)
-        reset = PasswordReset(key=key, user=user)
-        reset.save()
+        user = self.user
+        if settings.PASSWORD_RESET_SIGNED_TOKENS:
+            # Link assinado: o token é calculado a partir da senha atual e do último login,
+            # então não precisa ser gravado e deixa de valer assim que a senha muda
+            context = {
+                'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+                'token': default_token_generator.make_token(user),
+            }
+        else:
+            # Salvando hash novo de senha
+            key = generate_hash_key(user.username)
+            reset = PasswordReset(key=key, user=user)
+            reset.save()
+            context = {'reset': reset}
 
         # Enviando email
         subject = 'Criar nova senha no Simple Mooc'
-        send_mail_template(subject, 'accounts/password_reset_mail.html', {'reset': reset}, [user.email])
+        send_mail_template(subject, 'accounts/password_reset_mail.html', context, [user.email])
 
 
 class EditAccountForm(forms.ModelForm):
@@ -110,4 +124,4 @@ class EditAccountForm(forms.ModelForm):
         # Define qual o modelo a ser usado
         model = User
         # Quais campos podem ser alterados?
-        fields = ['username', 'email', 'name']
+        fields = ['username', 'email', 'name', 'announcement_delivery']
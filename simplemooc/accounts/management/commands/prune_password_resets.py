@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from simplemooc.accounts.models import PasswordReset
+
+
+class Command(BaseCommand):
+    """
+    Limpa a tabela de chaves de nova senha (PasswordReset), que só recebe linhas com PASSWORD_RESET_SIGNED_TOKENS desligado
+    ou de antes dos links assinados. Apaga em lotes para não segurar a tabela por muito tempo. Exemplo no cron:
+        30 3 * * * python manage.py prune_password_resets
+    """
+    help = 'Apaga as chaves de nova senha vencidas ou já usadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.PASSWORD_RESET_TIMEOUT_DAYS,
+            help='Apaga as chaves mais antigas que esse número de dias'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Linhas apagadas por vez')
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - timedelta(days=options['days'])
+        queryset = PasswordReset.objects.filter(created_at__lt=expired) | PasswordReset.objects.filter(confirmed=True)
+        total = 0
+        while True:
+            pks = list(queryset.order_by().values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            total += PasswordReset.objects.filter(pk__in=pks).delete()[0]
+
+        self.stdout.write(f'{total} chaves de nova senha apagadas')
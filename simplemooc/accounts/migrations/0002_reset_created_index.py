@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='passwordreset',
+            index=models.Index(fields=['user', '-created_at'], name='accounts_reset_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_reset_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='announcement_delivery',
+            field=models.IntegerField(choices=[(0, 'Um email por anúncio'), (1, 'Resumo diário')], default=0, verbose_name='Receber Anúncios'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='digest_sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último Resumo Até'),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.db import models
 from django.core import validators
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, UserManager
 from django.conf import settings
+from django.utils import timezone
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -24,6 +25,21 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Não obrigatório
     name = models.CharField('Nome', max_length=100, blank=True)
 
+    # Como os anúncios dos cursos chegam por email: um email a cada anúncio ou um resumo por dia
+    DELIVERY_IMMEDIATE = 0
+    DELIVERY_DIGEST = 1
+    DELIVERY_CHOICES = (
+        (DELIVERY_IMMEDIATE, 'Um email por anúncio'),
+        (DELIVERY_DIGEST, 'Resumo diário'),
+    )
+    announcement_delivery = models.IntegerField(
+        'Receber Anúncios',
+        choices=DELIVERY_CHOICES,
+        default=DELIVERY_IMMEDIATE
+    )
+    # Até quando os anúncios já entraram num resumo (ver courses.models.send_announcement_digests)
+    digest_sent_at = models.DateTimeField('Último Resumo Até', null=True, blank=True)
+
     # ## Campos necessários para o funcionamento de User
     # Não é obrigatório, mas terá como valor padrão True
     is_active = models.BooleanField('Está Ativo?', blank=True, default=True)
@@ -40,6 +56,29 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Campos obrigatórios para superusuário
     REQUIRED_FIELDS = ['email']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Preferência lida do BD, para saber em save() se ela mudou
+        instance._loaded_delivery = instance.__dict__.get('announcement_delivery')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Ao passar para o resumo diário (pela conta, pelo admin ou por código), os anúncios já enviados um a um
+        não entram no primeiro resumo
+        """
+        # __dict__: se o campo não foi carregado (only/defer), não há o que verificar
+        if self.__dict__.get('announcement_delivery') == self.DELIVERY_DIGEST and (
+                self._state.adding or getattr(self, '_loaded_delivery', None) != self.DELIVERY_DIGEST
+        ):
+            self.digest_sent_at = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'announcement_delivery' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'digest_sent_at'}
+        super().save(*args, **kwargs)
+        self._loaded_delivery = self.__dict__.get('announcement_delivery')
+
     def __str__(self):
         return self.name or self.username
 
@@ -87,3 +126,6 @@ class PasswordReset(models.Model):
         verbose_name_plural = 'Novas Senhas'
         # Ordenando de modo decrescente pela data
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='accounts_reset_created_idx'),
+        ]
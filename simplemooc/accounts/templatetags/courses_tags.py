@@ -3,13 +3,42 @@ Criando TAGs de Templates para Cursos
 """
 from django import template
 from simplemooc.courses.models import Enrollment
+from simplemooc.courses.access import get_enrollment_version, dashboard_menu_version as menu_version
 
 register = template.Library()
 
 
-@register.simple_tag
-def my_courses(user):
+@register.simple_tag(takes_context=True)
+def my_courses(context, user):
     """
     Pegando todos os cursos inscritos do usuário informado
+    Os cursos vêm na mesma consulta (JOIN), só com os campos usados nos templates,
+    e o resultado é guardado no request para ser reaproveitado durante a requisição
+    (as views do painel podem já tê-lo carregado, ver courses.views.load_dashboard)
+    """
+    request = context.get('request')
+    cached = getattr(request, '_my_courses', None)
+    if cached is not None and cached[0] == user.pk:
+        return cached[1]
+
+    enrollments = Enrollment.objects.dashboard(user)
+    if request is not None:
+        request._my_courses = (user.pk, enrollments)
+
+    return enrollments
+
+
+@register.simple_tag
+def enrollment_version(user):
+    """
+    Versão das inscrições do usuário, para usar na chave do {% cache %} de trechos que dependem delas
+    """
+    return get_enrollment_version(user.pk)
+
+
+@register.simple_tag
+def dashboard_menu_version(user, course=None):
+    """
+    Parte variável da chave do {% cache %} do menu do painel (ver courses.access.dashboard_menu_key)
     """
-    return Enrollment.objects.filter(user=user)
+    return menu_version(user.pk, course)
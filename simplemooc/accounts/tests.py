@@ -1,3 +1,149 @@
-from django.test import TestCase
+import re
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test.client import Client
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+from simplemooc.courses.models import Course, Enrollment
+from simplemooc.courses.access import dashboard_menu_key
+from simplemooc.courses.views import fragment_cache
+
+from .models import PasswordReset
+
+User = get_user_model()
+
+
+class DashboardTestCase(TestCase):
+    """
+    Testa o painel do aluno
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.client = Client()
+        self.client.login(username='aluno', password='123')
+
+    def enroll(self, total):
+        for i in range(total):
+            course = Course.objects.create(name=f'Curso {i}', slug=f'curso-{i}', description='Descrição')
+            Enrollment.objects.create(user=self.user, course=course, status=1)
+
+    def test_dashboard_lists_courses(self):
+        self.enroll(2)
+        response = self.client.get(reverse('accounts:dashboard'))
+        self.assertContains(response, 'Curso 0')
+        self.assertContains(response, reverse('courses:undo_enrollment', args=['curso-1']))
+
+    def test_dashboard_queries_do_not_grow_with_courses(self):
+        """
+        Sessão + usuário + inscrições (com os cursos no mesmo JOIN), não importa quantos cursos o aluno tem
+        """
+        self.enroll(1)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('accounts:dashboard'))
+
+        self.enroll(10)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('accounts:dashboard'))
+
+
+class PasswordResetTestCase(TestCase):
+    """
+    Testa os links de nova senha
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.client = Client()
+
+    def reset_link(self):
+        self.client.post(reverse('accounts:reset'), {'email': 'aluno@teste.com'})
+        call_command('send_queued_mail', stdout=StringIO())
+        return re.search(r'localhost:8000(\S+)"', mail.outbox[-1].alternatives[0][0]).group(1)
+
+    def test_signed_link_does_not_write_resets(self):
+        url = self.reset_link()
+        self.assertFalse(PasswordReset.objects.exists())
+        response = self.client.post(url, {'new_password1': 'nova-senha-123', 'new_password2': 'nova-senha-123'})
+        self.assertTrue(response.context['success'])
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('nova-senha-123'))
+        # Com a senha trocada, o mesmo link não vale mais
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalid_token(self):
+        url = reverse('accounts:reset_confirm_token', args=['MQ', 'abc-123'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(PASSWORD_RESET_SIGNED_TOKENS=False)
+    def test_legacy_key(self):
+        url = self.reset_link()
+        reset = PasswordReset.objects.get()
+        self.assertEqual(url, reverse('accounts:reset_confirm', args=[reset.key]))
+        self.client.post(url, {'new_password1': 'nova-senha-123', 'new_password2': 'nova-senha-123'})
+        self.assertFalse(PasswordReset.objects.exists())
+
+    def test_prune(self):
+        PasswordReset.objects.create(user=self.user, key='nova')
+        old = PasswordReset.objects.create(user=self.user, key='velha')
+        PasswordReset.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+        PasswordReset.objects.create(user=self.user, key='usada', confirmed=True)
+        out = StringIO()
+        call_command('prune_password_resets', '--batch-size=1', stdout=out)
+        self.assertIn('2 chaves', out.getvalue())
+        self.assertEqual(list(PasswordReset.objects.values_list('key', flat=True)), ['nova'])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class DashboardFragmentCacheTestCase(TestCase):
+    """
+    Testa o menu do painel guardado no cache de trechos de templates
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.course = Course.objects.create(name='Django', slug='django')
+        Enrollment.objects.create(user=self.user, course=self.course, status=1)
+        self.client.login(username='aluno', password='123')
+        self.url = reverse('courses:announcements', args=['django'])
+
+    def test_menu_is_cached(self):
+        def menu_queries(queries):
+            # A consulta do my_courses (inscrições em ordem de nome do curso)
+            return [query for query in queries if 'ORDER BY "courses_course"."name"' in query['sql']]
+
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(self.url)
+        self.assertEqual(len(menu_queries(first)), 1)
+        self.assertEqual(menu_queries(second), [])
+        self.assertContains(response, reverse('courses:announcements', args=['django']))
+
+    def test_view_and_template_share_the_menu_key(self):
+        """
+        load_dashboard só pula a consulta do menu se a chave dele for a mesma que a tag {% cache %} usou
+        """
+        self.client.get(self.url)
+        self.assertIsNotNone(fragment_cache().get(dashboard_menu_key(self.user.pk, self.course)))
+        with mock.patch('simplemooc.courses.views.gather') as gather:
+            self.client.get(self.url)
+        gather.assert_not_called()
+
+    def test_menu_changes_with_enrollments(self):
+        self.client.get(self.url)
+        other = Course.objects.create(name='Python', slug='python')
+        Enrollment.objects.create(user=self.user, course=other, status=1)
+        self.assertContains(self.client.get(self.url), reverse('courses:announcements', args=['python']))
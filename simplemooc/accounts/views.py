@@ -1,8 +1,15 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, get_user_model
+from django.contrib.auth import login, get_user_model
 from django.contrib.auth.forms import PasswordChangeForm, SetPasswordForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.tokens import default_token_generator
 from django.contrib import messages
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_decode
 
 from .form import RegisterForm, EditAccountForm, PasswordResetForm
 from .models import PasswordReset
@@ -21,12 +28,9 @@ def register(request):
         # Salva os dados do form
         user = form.save()
 
-        # Logando o usuário automaticamente
-        user = authenticate(
-            username=user.username,
-            password=form.cleaned_data['password1']
-        )
-        login(request, user)
+        # Logando o usuário automaticamente. A senha acabou de ser gravada, então não precisa passar pelo authenticate
+        # (que calcularia o hash da senha uma segunda vez)
+        login(request, user, backend='django.contrib.auth.backends.ModelBackend')
 
         # Redireciona para tela inicial
         return redirect('core:home')
@@ -55,15 +59,43 @@ def password_reset(request):
 
 def password_reset_confirm(request, key):
     """
-    View de confirmação de nova senha
+    View de confirmação de nova senha (links antigos, com a chave gravada em PasswordReset)
     :param request:
     :param key: Chave para se localizar a senha nova
     """
     context = {}
-    # Localiza usuário conforme chave passada. Se não encontrar, devolve 404
-    reset = get_object_or_404(PasswordReset, key=key)
+    # Localiza usuário conforme chave passada. Se não encontrar (ou se a chave já venceu), devolve 404
+    expired = timezone.now() - timedelta(days=settings.PASSWORD_RESET_TIMEOUT_DAYS)
+    reset = get_object_or_404(PasswordReset.objects.select_related('user'), key=key, created_at__gte=expired)
     # Formulário padrão do Django para reset de senha, passando o usuário localizado em reset
     form = SetPasswordForm(user=reset.user, data=request.POST or None)
+    if form.is_valid():
+        form.save()
+        # A chave só serve uma vez
+        reset.user.resets.all().delete()
+        context['success'] = True
+
+    context['form'] = form
+    return render(request, 'accounts/password_reset_confirm.html', context)
+
+
+def password_reset_confirm_token(request, uidb64, token):
+    """
+    View de confirmação de nova senha com link assinado. Não lê nem grava nada além do próprio usuário
+    :param request:
+    :param uidb64: ID do usuário em base64
+    :param token: Token assinado (vence em PASSWORD_RESET_TIMEOUT_DAYS ou quando a senha muda)
+    """
+    context = {}
+    try:
+        user = User.objects.get(pk=urlsafe_base64_decode(uidb64).decode())
+    except (TypeError, ValueError, OverflowError, User.DoesNotExist):
+        user = None
+    if user is None or not default_token_generator.check_token(user, token):
+        raise Http404('Link inválido ou vencido')
+
+    # Formulário padrão do Django para reset de senha
+    form = SetPasswordForm(user=user, data=request.POST or None)
     if form.is_valid():
         form.save()
         context['success'] = True
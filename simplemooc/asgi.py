@@ -0,0 +1,26 @@
+"""
+ASGI config for simplemooc project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Ex.: uvicorn simplemooc.asgi:application --workers 4
+
+No Django 2.2 a aplicação WSGI é servida pelo adaptador do asgiref (pip install -r requirements.txt), com cada
+requisição numa thread do pool do event loop (ver simplemooc/core/asgi.py). Com o Django 3.0 ou mais novo,
+é usado o handler do próprio Django
+"""
+
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simplemooc.settings')
+
+from simplemooc.core.asgi import get_asgi_application  # noqa: E402
+
+application = get_asgi_application()
+
+# Aquece o worker antes da primeira requisição (ver simplemooc/warmup.py)
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_START:
+    from simplemooc.warmup import warm_up
+
+    warm_up(close_connections=settings.WARMUP_CLOSE_CONNECTIONS)
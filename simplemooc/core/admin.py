@@ -1,3 +1,53 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
 
-# Register your models here.
+from .models import OutboxMessage
+from .paginator import EstimatedCountPaginator
+
+# Parâmetro da listagem com o último id visto (paginação por chave)
+KEYSET_VAR = 'id__lt'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Listagem com "próximos registros" pela chave (WHERE id < último id da página), em vez de OFFSET.
+    O custo de cada página é o mesmo, seja a primeira ou a milésima
+    """
+
+    def next_keyset_url(self):
+        """
+        Link para os registros seguintes, ou None se a página não está na ordem padrão (-id) ou é a última
+        """
+        if ORDER_VAR in self.params or len(self.result_list) < self.list_per_page:
+            return None
+        return self.get_query_string({KEYSET_VAR: self.result_list[len(self.result_list) - 1].pk}, [PAGE_VAR])
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[KEYSET_VAR, PAGE_VAR])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin para tabelas com milhões de linhas:
+    - contagem limitada (EstimatedCountPaginator) e sem o total da tabela sem filtros (show_full_result_count)
+    - ordem pela chave primária e navegação por chave quando o total é estimado (KeysetChangeList)
+    Nas subclasses, use list_select_related nas colunas de outras tabelas, raw_id_fields/autocomplete_fields
+    nas chaves estrangeiras e list_filter apenas em campos com índice
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+    change_list_template = 'admin/large_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = ['dedupe_key', 'claimed_by', 'claimed_until', 'last_error', 'created_at', 'sent_at']
+
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
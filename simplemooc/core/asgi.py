@@ -0,0 +1,78 @@
+"""
+Aplicação ASGI do projeto (ver simplemooc/asgi.py).
+
+O Django 2.2 ainda não tem o handler ASGI (ele chegou no Django 3.0). Até lá, a aplicação WSGI é servida pelo
+adaptador do asgiref. O WsgiToAsgi do asgiref 3.3 ou mais novo executa a aplicação com thread_sensitive=True: todas
+as requisições de um worker passam por uma mesma thread, uma de cada vez. ThreadedWsgiToAsgi executa cada requisição
+numa thread do pool do event loop, como um servidor WSGI com threads, e as requisições de um worker andam em paralelo
+(cada thread com a sua conexão com o BD).
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError:
+    WsgiToAsgi = WsgiToAsgiInstance = None
+
+
+if WsgiToAsgi is not None:
+    class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+        """
+        Uma requisição: a aplicação WSGI roda numa thread do pool, sem esperar as demais requisições.
+        O __call__ do asgiref lê o corpo e chama run_wsgi_app(body). O laço abaixo é o mesmo do asgiref,
+        só que é nosso: não depende de como o asgiref decora o dele
+        """
+
+        def run_wsgi_app_in_thread(self, body):
+            """
+            Executa a aplicação WSGI e envia a resposta (start_response é chamado nesta mesma thread)
+            """
+            environ = self.build_environ(self.scope, body)
+            bytes_sent = 0
+            for output in self.wsgi_application(environ, self.start_response):
+                # O cabeçalho vai junto com a primeira parte do corpo
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # Não envia mais bytes que o Content-Length informado pela aplicação
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - bytes_sent]
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+                bytes_sent += len(output)
+                if bytes_sent == self.response_content_length:
+                    break
+            # Resposta sem corpo
+            if not self.response_started:
+                self.response_started = True
+                self.sync_send(self.response_start)
+            self.sync_send({'type': 'http.response.body'})
+
+        run_wsgi_app = sync_to_async(run_wsgi_app_in_thread, thread_sensitive=False)
+
+    class ThreadedWsgiToAsgi(WsgiToAsgi):
+        """
+        Aplicação WSGI servida por ASGI, com as requisições em paralelo (ver ThreadedWsgiToAsgiInstance)
+        """
+
+        async def __call__(self, scope, receive, send):
+            await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+def get_asgi_application():
+    """
+    Com o Django 3.0 ou mais novo, o handler do próprio Django. No Django 2.2, a aplicação WSGI com ThreadedWsgiToAsgi
+    """
+    try:
+        from django.core.asgi import get_asgi_application as get_django_application
+    except ImportError:
+        pass
+    else:
+        return get_django_application()
+
+    if WsgiToAsgi is None:
+        raise ImproperlyConfigured('Para servir o projeto por ASGI com o Django 2.2, instale o asgiref')
+
+    from django.core.wsgi import get_wsgi_application
+
+    return ThreadedWsgiToAsgi(get_wsgi_application())
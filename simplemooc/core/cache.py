@@ -0,0 +1,135 @@
+"""
+Cache de páginas inteiras para visitantes anônimos, invalidado por tags.
+
+Cada página guardada leva as tags de que depende (ex.: 'catalog', 'course:<id>') e a versão de cada tag
+no momento em que foi gerada. Invalidar uma tag apenas troca a sua versão: as páginas que dependem dela
+deixam de ser válidas, e todas as outras continuam no cache.
+"""
+import hashlib
+import re
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+# Marcador que substitui o token CSRF na página guardada. Cada visitante recebe o seu próprio token
+CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+HITS_KEY = 'pagecache:hits'
+MISSES_KEY = 'pagecache:misses'
+
+
+def tag_key(tag):
+    return f'cache:tag:{tag}'
+
+
+def get_tag_versions(tags):
+    """
+    Versão atual de cada tag. Tags que não estão no cache (nunca usadas ou descartadas) recebem uma versão nova,
+    o que invalida qualquer página guardada com a versão anterior
+    """
+    keys = {tag_key(tag): tag for tag in tags}
+    versions = {keys[key]: version for key, version in cache.get_many(list(keys)).items()}
+    missing = {key: uuid.uuid4().hex for key, tag in keys.items() if tag not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update({keys[key]: version for key, version in missing.items()})
+
+    return versions
+
+
+def invalidate_tags(*tags):
+    """
+    Invalida todas as páginas que dependem de alguma das tags informadas
+    """
+    cache.set_many({tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def add_cache_tags(request, *tags):
+    """
+    Permite que a view informe tags que só conhece depois de rodar (ex.: o id do curso pego pelo slug)
+    """
+    request.cache_tags = getattr(request, 'cache_tags', set()) | set(tags)
+
+
+def count(key):
+    """
+    Incrementa um contador no cache (criando-o se necessário)
+    """
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # O contador foi descartado entre o add e o incr
+            cache.add(key, 1, None)
+
+
+def page_cache_stats():
+    """
+    Acertos e erros do cache de páginas
+    """
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': stats.get(HITS_KEY, 0), 'misses': stats.get(MISSES_KEY, 0)}
+
+
+def is_cacheable_request(request):
+    """
+    Só GET/HEAD de visitantes anônimos, sem mensagens pendentes para exibir
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def cache_anonymous_page(*tags):
+    """
+    Decorador de views. Guarda a resposta inteira para visitantes anônimos, com a url (incluindo parâmetros)
+    como chave. As tags informadas aqui e as adicionadas pela view com add_cache_tags() invalidam a página.
+    POSTs e usuários logados nunca passam pelo cache
+
+    Exemplo:
+        @cache_anonymous_page('catalog')
+        def index(request): ...
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            key = 'pagecache:page:' + hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+            entry = cache.get(key)
+            if entry and get_tag_versions(entry['versions']) == entry['versions']:
+                count(HITS_KEY)
+                content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request))
+                response = HttpResponse(content, content_type=entry['content_type'])
+                response['X-Cache'] = 'HIT'
+                return response
+
+            count(MISSES_KEY)
+            # Versões lidas antes de gerar a página: se uma tag for invalidada durante a geração,
+            # a página guardada já nasce inválida
+            versions = get_tag_versions(tags)
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                versions.update(get_tag_versions(getattr(request, 'cache_tags', set()) - set(tags)))
+                content = CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+                cache.set(key, {
+                    'content': content,
+                    'content_type': response['Content-Type'],
+                    'versions': versions,
+                }, settings.PAGE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+
+    return decorator
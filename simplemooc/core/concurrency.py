@@ -0,0 +1,93 @@
+"""
+Consultas independentes em paralelo, dentro de uma mesma requisição.
+
+O Django 2.2 não tem views assíncronas: cada requisição roda inteira numa thread do worker, e as consultas de uma
+página (ex.: o mapa de acesso e o curso, ou a lista de aulas e o menu do painel) são feitas uma depois da outra.
+gather() executa funções independentes ao mesmo tempo num pool de threads compartilhado pelo processo, e a requisição
+espera apenas pela mais lenta. O driver do BD libera o GIL enquanto espera a resposta do servidor, então o ganho
+aparece quando o BD está em outra máquina (cada ida e volta passa a se sobrepor às demais).
+
+- Cada thread do pool tem a sua própria conexão com o BD, mantida entre as tarefas (CONN_MAX_AGE) e descartada
+  quando fica velha ou com erro, como o Django faz ao final de cada requisição.
+- Dentro de uma transação as funções rodam em sequência, na thread da requisição: as outras conexões não enxergariam
+  o que ainda não foi confirmado.
+- A réplica escolhida pela view (@read_from_replica) vale também para as funções executadas no pool.
+- Os execute_wrappers das conexões da requisição (ex.: as métricas de consultas do MetricsMiddleware) também são
+  aplicados às conexões da thread do pool enquanto a função roda.
+- Com CONCURRENT_READS_WORKERS = 0 tudo roda em sequência, como antes.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from .routers import current_replica, use_replica
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Pool de threads do processo, criado na primeira utilização
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.CONCURRENT_READS_WORKERS, thread_name_prefix='reads')
+
+    return _executor
+
+
+def is_enabled():
+    return settings.CONCURRENT_READS_WORKERS > 0 and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def current_wrappers():
+    """
+    execute_wrappers das conexões da thread atual, por alias
+    """
+    return {connection.alias: list(connection.execute_wrappers) for connection in connections.all()}
+
+
+def run_task(replica, wrappers, func):
+    """
+    Executa a função numa thread do pool, lendo da mesma réplica da requisição e com os mesmos execute_wrappers
+    """
+    try:
+        with ExitStack() as stack, use_replica(replica):
+            for alias, funcs in wrappers.items():
+                connection = connections[alias]
+                # Os que a conexão da thread já tem (ex.: instalados no connection_created) não são repetidos
+                for wrapper in funcs:
+                    if wrapper not in connection.execute_wrappers:
+                        stack.enter_context(connection.execute_wrapper(wrapper))
+            return func()
+    finally:
+        for connection in connections.all():
+            connection.close_if_unusable_or_obsolete()
+
+
+def gather(*funcs):
+    """
+    Executa as funções (sem parâmetros) ao mesmo tempo e devolve os resultados na mesma ordem.
+    A primeira roda na própria thread da requisição. Se alguma falhar, a exceção é relançada aqui
+    (depois que todas terminarem, para nenhuma ficar rodando sozinha)
+    :return: Lista com o retorno de cada função
+    """
+    if len(funcs) < 2 or not is_enabled():
+        return [func() for func in funcs]
+
+    replica = current_replica()
+    wrappers = current_wrappers()
+    futures = [get_executor().submit(run_task, replica, wrappers, func) for func in funcs[1:]]
+    try:
+        first = funcs[0]()
+    finally:
+        # Espera as demais mesmo se a primeira falhar
+        for future in futures:
+            future.exception()
+
+    return [first] + [future.result() for future in futures]
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+
+def fragment_cache(request):
+    """
+    Deixa o tempo do cache de trechos de templates disponível para a tag {% cache %}
+    """
+    return {'FRAGMENT_CACHE_TIMEOUT': settings.FRAGMENT_CACHE_TIMEOUT}
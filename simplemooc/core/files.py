@@ -0,0 +1,157 @@
+"""
+Entrega de arquivos protegidos (que não podem ficar públicos em MEDIA_URL)
+
+Os arquivos ficam em PROTECTED_MEDIA_ROOT (ProtectedStorage), fora do MEDIA_ROOT: nem o static() do modo DEBUG nem
+um servidor web que sirva o MEDIA_ROOT conseguem entregá-los sem passar pela view que verifica a permissão.
+
+Se PROTECTED_MEDIA_HEADER estiver configurado, a view só autoriza e o servidor web (nginx/apache) envia os bytes,
+através de um redirecionamento interno. Senão, o próprio Django envia o arquivo em partes, com suporte a
+requisições condicionais (ETag/If-None-Match, Last-Modified/If-Modified-Since) e parciais (Range)
+"""
+import mimetypes
+import os
+import re
+import unicodedata
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
+
+
+class ProtectedStorage(FileSystemStorage):
+    """
+    Armazenamento em PROTECTED_MEDIA_ROOT. As urls apontam para PROTECTED_MEDIA_PREFIX, que no servidor web
+    é uma location interna (só responde aos redirecionamentos internos de serve_protected_file)
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PROTECTED_MEDIA_ROOT)
+
+    @cached_property
+    def base_url(self):
+        return self._value_or_setting(self._base_url, settings.PROTECTED_MEDIA_PREFIX)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PROTECTED_MEDIA_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+        elif setting == 'PROTECTED_MEDIA_PREFIX':
+            self.__dict__.pop('base_url', None)
+
+
+protected_storage = ProtectedStorage()
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Tamanho de cada parte lida do arquivo
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Interpreta o cabeçalho Range. Só um intervalo é suportado (múltiplos intervalos recebem o arquivo inteiro)
+    :return: Tupla (início, fim) inclusiva, None se não houver um intervalo válido
+             ou False se o intervalo estiver fora do arquivo
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+    if start == '':
+        # bytes=-500: os últimos 500 bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    if start >= size or start > end:
+        return False
+
+    return start, end
+
+
+def read_range(file, start, length):
+    """
+    Lê apenas o intervalo pedido, em partes, e fecha o arquivo ao terminar
+    """
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def content_disposition(filename):
+    """
+    Valor do Content-Disposition (inline), como o do FileResponse: nomes com acentos vão em filename*
+    (RFC 6266), com uma versão só em ASCII em filename para navegadores antigos
+    """
+    fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    fallback = fallback.replace('\\', '_').replace('"', '_')
+    if fallback == filename:
+        return f'inline; filename="{filename}"'
+    return f"inline; filename=\"{fallback}\"; filename*=utf-8''{quote(filename)}"
+
+
+def serve_protected_file(request, field_file):
+    """
+    Resposta com o arquivo de um FileField, depois que a view já verificou a permissão de acesso
+    """
+    name = field_file.name
+    filename = os.path.basename(name)
+
+    # Redirecionamento interno: o servidor web envia o arquivo (e cuida de Range e cache)
+    if settings.PROTECTED_MEDIA_HEADER:
+        response = HttpResponse(content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        # Cabeçalhos só aceitam latin-1: o caminho vai codificado, e o servidor web o decodifica
+        response[settings.PROTECTED_MEDIA_HEADER] = quote(settings.PROTECTED_MEDIA_PREFIX + name)
+        response['Content-Disposition'] = content_disposition(filename)
+        return response
+
+    storage = field_file.storage
+    size = field_file.size
+    last_modified = storage.get_modified_time(name).timestamp()
+    etag = quote_etag(f'{size:x}-{int(last_modified):x}')
+
+    # 304 (If-None-Match / If-Modified-Since) ou 412 (If-Match / If-Unmodified-Since)
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # Com If-Range, o intervalo só vale se o arquivo não mudou desde a primeira parte baixada
+        if 'HTTP_RANGE' in request.META and (not if_range or if_range in (etag, http_date(last_modified))):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_range(storage.open(name, 'rb'), start, end - start + 1),
+                status=206,
+                content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Disposition'] = content_disposition(filename)
+        else:
+            response = FileResponse(storage.open(name, 'rb'), filename=filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Arquivo de uso privado: o navegador pode guardar, mas proxies não
+    response['Cache-Control'] = 'private'
+    return response
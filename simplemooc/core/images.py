@@ -0,0 +1,137 @@
+"""
+Versões reduzidas (renditions) das imagens enviadas pelos ImageFields
+
+As versões são geradas em WebP, nas larguras de IMAGE_RENDITION_WIDTHS, e gravadas ao lado do original:
+    courses/images/foto.jpg
+    courses/images/foto.renditions/320.webp
+    courses/images/foto.renditions/640.webp
+    courses/images/foto.renditions/manifest.json
+O manifesto guarda a assinatura do original (tamanho e data de modificação): as versões só são
+geradas de novo quando o original muda
+"""
+import json
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+from .cache import invalidate_tags
+
+logger = logging.getLogger(__name__)
+
+# Imagem ainda sem manifesto. Passado esse tempo, o storage é consultado de novo (e a geração, agendada de novo)
+PENDING = 'pending'
+PENDING_TIMEOUT = 60 * 5
+
+
+def renditions_dir(name):
+    return os.path.splitext(name)[0] + '.renditions'
+
+
+def manifest_name(name):
+    return f'{renditions_dir(name)}/manifest.json'
+
+
+def manifest_key(name):
+    return f'images:manifest:{name}'
+
+
+def source_signature(field_file):
+    storage = field_file.storage
+    return {
+        'size': storage.size(field_file.name),
+        'modified': storage.get_modified_time(field_file.name).timestamp(),
+    }
+
+
+def read_manifest(field_file):
+    """
+    Manifesto gravado ao lado do original, ou None se ainda não existir
+    """
+    storage = field_file.storage
+    name = manifest_name(field_file.name)
+    if not storage.exists(name):
+        return None
+    with storage.open(name, 'rb') as file:
+        return json.loads(file.read().decode('utf-8'))
+
+
+def generate_renditions(field_file, force=False):
+    """
+    Gera as versões reduzidas da imagem e o manifesto. Se o original não mudou, não faz nada
+    :return: O manifesto
+    """
+    from PIL import Image
+
+    storage = field_file.storage
+    signature = source_signature(field_file)
+    manifest = read_manifest(field_file)
+    if manifest and manifest['source'] == signature and not force:
+        cache.set(manifest_key(field_file.name), manifest, None)
+        return manifest
+
+    with storage.open(field_file.name, 'rb') as file:
+        image = Image.open(file)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    renditions = {}
+    for width in settings.IMAGE_RENDITION_WIDTHS:
+        # Não amplia imagens menores do que a largura pedida
+        if width > image.width:
+            continue
+        height = round(image.height * width / image.width)
+        buffer = BytesIO()
+        image.resize((width, height), Image.LANCZOS).save(
+            buffer, 'WEBP', quality=settings.IMAGE_RENDITION_QUALITY, method=6
+        )
+        name = f'{renditions_dir(field_file.name)}/{width}.webp'
+        if storage.exists(name):
+            storage.delete(name)
+        renditions[str(width)] = storage.save(name, ContentFile(buffer.getvalue()))
+
+    manifest = {'source': signature, 'width': image.width, 'renditions': renditions}
+    name = manifest_name(field_file.name)
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(json.dumps(manifest).encode('utf-8')))
+    cache.set(manifest_key(field_file.name), manifest, None)
+    logger.info('%d versões geradas para %s', len(renditions), field_file.name)
+    return manifest
+
+
+def page_tag(name):
+    """
+    Tag (do core.cache) das páginas que mostram a imagem sem as versões reduzidas. Invalidada quando elas ficam prontas
+    """
+    return f'image:{name}'
+
+
+def get_manifest(field_file):
+    """
+    Manifesto da imagem (do cache, ou lido do storage). None se as versões ainda não foram geradas.
+    A falta do manifesto também fica no cache (PENDING, por PENDING_TIMEOUT segundos): enquanto a geração não termina,
+    as páginas não procuram o manifesto no storage a cada renderização
+    """
+    key = manifest_key(field_file.name)
+    manifest = cache.get(key)
+    if manifest is None:
+        manifest = read_manifest(field_file)
+        if manifest is None:
+            cache.set(key, PENDING, PENDING_TIMEOUT)
+        else:
+            cache.set(key, manifest, None)
+
+    return None if manifest == PENDING else manifest
+
+
+def generate_for_pages(field_file):
+    """
+    Gera as versões e invalida as páginas em cache que ainda mostram só o original
+    """
+    generate_renditions(field_file)
+    invalidate_tags(page_tag(field_file.name))
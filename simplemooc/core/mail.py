@@ -1,7 +1,60 @@
+import hashlib
+import logging
+import time
+from datetime import timedelta
+
 from django.template.loader import render_to_string
 from django.template.defaultfilters import strip_tags
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.utils import timezone
+
+from .models import OutboxMessage
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+
+def render_mail_template(template_name, context):
+    """
+    Renderiza o tema do email, retornando a versão HTML e a versão texto
+    """
+    message_html = render_to_string(template_name, context)
+    return message_html, strip_tags(message_html)
+
+
+def make_dedupe_key(subject, from_email, recipients, message_html):
+    """
+    Identifica mensagens idênticas (mesmo assunto, remetente, destinatários e conteúdo)
+    """
+    text = '\n'.join([subject, from_email, recipients, message_html])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def enqueue_mail(subject, message_txt, message_html, recipient_list, from_email, individual=False):
+    """
+    Grava o email na fila (outbox) para ser enviado depois pelo comando send_queued_mail.
+    Se uma mensagem idêntica já foi enfileirada há pouco tempo (MAIL_OUTBOX_DEDUPE_SECONDS), não grava de novo
+
+    :return: A mensagem na fila
+    """
+    recipients = '\n'.join(recipient_list)
+    dedupe_key = make_dedupe_key(subject, from_email, recipients, message_html)
+
+    since = timezone.now() - timedelta(seconds=settings.MAIL_OUTBOX_DEDUPE_SECONDS)
+    duplicated = OutboxMessage.objects.filter(dedupe_key=dedupe_key, created_at__gte=since).first()
+    if duplicated:
+        return duplicated
+
+    return OutboxMessage.objects.create(
+        subject=subject,
+        body_txt=message_txt,
+        body_html=message_html,
+        from_email=from_email,
+        recipients=recipients,
+        individual=individual,
+        dedupe_key=dedupe_key
+    )
 
 
 def send_mail_template(
@@ -14,12 +67,16 @@ def send_mail_template(
 ):
     """
     Centraliza aqui o envio de email usando templates
+    Com MAIL_OUTBOX_ENABLED, o email apenas entra na fila e o envio fica por conta do worker
     """
 
-    # Renderiza o tema
-    message_html = render_to_string(template_name, context)
-    # Converte para um formato de texto
-    message_txt = strip_tags(message_html)
+    # Renderiza o tema e converte para um formato de texto
+    message_html, message_txt = render_mail_template(template_name, context)
+
+    if settings.MAIL_OUTBOX_ENABLED:
+        enqueue_mail(subject, message_txt, message_html, recipient_list, from_email)
+        return
+
     # Configura o email primeiro como texto
     email = EmailMultiAlternatives(
         subject=subject,
@@ -31,3 +88,187 @@ def send_mail_template(
     email.attach_alternative(message_html, 'text/html')
     # Envia o email
     email.send(fail_silently=fail_silently)
+
+
+def build_messages(subject, message_txt, message_html, recipient_list, from_email, individual, connection):
+    """
+    Monta os emails (texto + HTML). Se individual, um email por destinatário
+    """
+    groups = [[recipient] for recipient in recipient_list] if individual else [recipient_list]
+    messages = []
+    for to in groups:
+        email = EmailMultiAlternatives(
+            subject=subject,
+            body=message_txt,
+            from_email=from_email,
+            to=to,
+            connection=connection
+        )
+        email.attach_alternative(message_html, 'text/html')
+        messages.append(email)
+
+    return messages
+
+
+def send_mass_mail_template(
+        subject,
+        template_name,
+        context,
+        recipients,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        batch_size=None
+):
+    """
+    Envia a mesma mensagem para muitos destinatários, cada um recebendo o seu próprio email.
+    O tema é renderizado uma única vez e os emails são enviados em lotes, reaproveitando a mesma conexão.
+    Com MAIL_OUTBOX_ENABLED, cada lote vira uma única mensagem na fila (com envio individual)
+
+    :param recipients: Qualquer iterável de emails (pode ser um queryset com iterator())
+    :param batch_size: Quantidade de emails por lote. Se não informado, usa MAIL_BATCH_SIZE
+    :return: Lista com as estatísticas de cada lote (enviados, falhas e emails por segundo)
+    """
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    message_html, message_txt = render_mail_template(template_name, context)
+
+    if settings.MAIL_OUTBOX_ENABLED:
+        for batch in chunked(recipients, batch_size):
+            enqueue_mail(subject, message_txt, message_html, batch, from_email, individual=True)
+        return []
+
+    stats = []
+    # fail_silently para que um destinatário com problema não interrompa os demais lotes
+    connection = get_connection(fail_silently=True)
+    connection.open()
+    try:
+        for number, batch in enumerate(chunked(recipients, batch_size), start=1):
+            start = time.monotonic()
+            messages = build_messages(subject, message_txt, message_html, batch, from_email, True, connection)
+            sent = connection.send_messages(messages) or 0
+            elapsed = time.monotonic() - start
+            batch_stats = {
+                'batch': number,
+                'sent': sent,
+                'failed': len(messages) - sent,
+                'rate': sent / elapsed if elapsed else float(sent),
+            }
+            stats.append(batch_stats)
+            logger.info(
+                '[%s] lote %d: %d enviados, %d falhas (%.1f emails/s)',
+                subject, number, batch_stats['sent'], batch_stats['failed'], batch_stats['rate']
+            )
+    finally:
+        connection.close()
+
+    return stats
+
+
+def send_personal_mails(mails, from_email=settings.DEFAULT_FROM_EMAIL, batch_size=None):
+    """
+    Envia emails já renderizados, cada um com o seu conteúdo e o seu destinatário (ex.: os resumos diários).
+    Os emails são enviados em lotes, reaproveitando a mesma conexão.
+    Com MAIL_OUTBOX_ENABLED, cada lote entra na fila com um único INSERT
+
+    :param mails: Qualquer iterável de (assunto, html, texto, email do destinatário)
+    :param batch_size: Quantidade de emails por lote. Se não informado, usa MAIL_BATCH_SIZE
+    :return: Total de emails enviados (ou enfileirados)
+    """
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+
+    if settings.MAIL_OUTBOX_ENABLED:
+        total = 0
+        for batch in chunked(mails, batch_size):
+            OutboxMessage.objects.bulk_create([
+                OutboxMessage(
+                    subject=subject,
+                    body_txt=message_txt,
+                    body_html=message_html,
+                    from_email=from_email,
+                    recipients=recipient,
+                    dedupe_key=make_dedupe_key(subject, from_email, recipient, message_html)
+                ) for subject, message_html, message_txt, recipient in batch
+            ])
+            total += len(batch)
+        return total
+
+    total = 0
+    # fail_silently para que um destinatário com problema não interrompa os demais lotes
+    connection = get_connection(fail_silently=True)
+    connection.open()
+    try:
+        for batch in chunked(mails, batch_size):
+            messages = []
+            for subject, message_html, message_txt, recipient in batch:
+                messages.extend(
+                    build_messages(subject, message_txt, message_html, [recipient], from_email, True, connection)
+                )
+            total += connection.send_messages(messages) or 0
+    finally:
+        connection.close()
+
+    return total
+
+
+def process_outbox(worker, batch_size=None):
+    """
+    Envia um lote da fila de emails usando uma única conexão.
+    Em caso de erro, a mensagem volta para a fila com espera exponencial (MAIL_OUTBOX_RETRY_DELAY * 2^tentativas)
+    até atingir MAIL_OUTBOX_MAX_ATTEMPTS, quando é marcada como falha
+
+    :param worker: Identificação de quem está processando
+    :param batch_size: Quantidade de mensagens reservadas por vez
+    :return: dicionário com a quantidade de mensagens enviadas, reagendadas e com falha definitiva
+    """
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    result = {'sent': 0, 'retried': 0, 'failed': 0}
+    outbox = OutboxMessage.objects.claim(worker, batch_size, settings.MAIL_OUTBOX_LEASE_SECONDS)
+    if not outbox:
+        return result
+
+    connection = get_connection()
+    try:
+        for message in outbox:
+            messages = build_messages(
+                message.subject,
+                message.body_txt,
+                message.body_html,
+                message.recipient_list(),
+                message.from_email,
+                message.individual,
+                connection
+            )
+            sent = 0
+            try:
+                connection.open()
+                # Envia um a um para saber exatamente quem já recebeu, caso a conexão caia no meio do lote
+                for email in messages:
+                    connection.send_messages([email])
+                    sent += 1
+            except Exception as e:
+                message.attempts += 1
+                message.last_error = repr(e)
+                message.claimed_until = None
+                # Quem já recebeu não entra na nova tentativa
+                message.recipients = '\n'.join(recipient for email in messages[sent:] for recipient in email.to)
+                if message.attempts >= settings.MAIL_OUTBOX_MAX_ATTEMPTS:
+                    message.status = OutboxMessage.STATUS_FAILED
+                    result['failed'] += 1
+                else:
+                    delay = settings.MAIL_OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+                    message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                    result['retried'] += 1
+                logger.warning('Falha ao enviar "%s" (tentativa %d): %r', message, message.attempts, e)
+                # Descarta a conexão com problema. Ela será reaberta na próxima mensagem
+                connection.close()
+            else:
+                message.status = OutboxMessage.STATUS_SENT
+                message.sent_at = timezone.now()
+                message.claimed_until = None
+                result['sent'] += 1
+
+            message.save(update_fields=[
+                'recipients', 'status', 'attempts', 'last_error', 'next_attempt_at', 'claimed_until', 'sent_at'
+            ])
+    finally:
+        connection.close()
+
+    return result
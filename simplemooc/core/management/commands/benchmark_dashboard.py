@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from simplemooc.core.asgi import get_asgi_application
+from simplemooc.courses.access import invalidate_all_access
+from simplemooc.courses.models import Enrollment
+
+from .benchmark_routes import Command as RoutesCommand, percentile
+
+MODES = ['serial', 'concurrent']
+SERVERS = ['wsgi', 'asgi']
+
+
+class Command(BaseCommand):
+    """
+    Carga nas páginas do painel (aulas e anúncios do maior curso, como aluno inscrito), com o mesmo número de
+    workers simulados (threads fazendo requisições sem parar), nos dois modos:
+        serial       as consultas uma depois da outra (CONCURRENT_READS_WORKERS = 0), como antes
+        concurrent   as consultas independentes em paralelo (core.concurrency)
+
+    Rode com o BD de verdade (gere os dados antes com: python manage.py seed_data). Num BD local as consultas
+    respondem rápido demais para haver o que sobrepor: --db-latency soma uma espera a cada consulta, simulando
+    a ida e volta até um servidor de BD em outra máquina. --cold invalida os caches antes de cada requisição
+    (mapa de acesso, curso e menu), que é quando as consultas do painel acontecem.
+
+    --server asgi (ou both) mede também as mesmas requisições pela aplicação ASGI (simplemooc.asgi), com os workers
+    como tarefas de um único event loop, como num worker do uvicorn. É preciso ter o asgiref instalado
+    """
+    help = 'Compara a vazão das páginas do painel com as consultas em sequência e em paralelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Requisições simultâneas')
+        parser.add_argument('--requests', type=int, default=50, help='Requisições por worker')
+        parser.add_argument('--db-latency', type=float, default=0, help='Espera (ms) somada a cada consulta')
+        parser.add_argument('--cold', action='store_true', help='Invalida os caches antes de cada requisição')
+        parser.add_argument(
+            '--server', choices=SERVERS + ['both'], default='wsgi', help='Interface: WSGI (threads), ASGI ou as duas'
+        )
+
+    def handle(self, *args, **options):
+        targets = RoutesCommand().targets()
+        enrollment = Enrollment.objects.filter(
+            course=targets['course'], status=Enrollment.STATUS_APPROVED
+        ).select_related('user').first()
+        if enrollment is None:
+            raise CommandError(f"O curso {targets['course_slug']} não tem alunos inscritos")
+        urls = [
+            reverse('courses:lessons', args=[targets['course_slug']]),
+            reverse('courses:announcements', args=[targets['course_slug']]),
+        ]
+
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        if latency:
+            connection_created.connect(add_delay)
+            for connection in connections.all():
+                add_delay(None, connection)
+
+        servers = SERVERS if options['server'] == 'both' else [options['server']]
+        runners = {'wsgi': self.run, 'asgi': self.run_asgi}
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                workers = settings.CONCURRENT_READS_WORKERS or 4
+                for server in servers:
+                    for mode in MODES:
+                        with override_settings(CONCURRENT_READS_WORKERS=workers if mode == 'concurrent' else 0):
+                            results[f'{server} {mode}'] = runners[server](enrollment.user, urls, options)
+        finally:
+            connection_created.disconnect(add_delay)
+            for connection in connections.all():
+                if delay in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(delay)
+
+        self.stdout.write(
+            f"{options['workers']} workers, {options['requests']} requisições cada, "
+            f"{options['db_latency']:g} ms por consulta{', caches frios' if options['cold'] else ''}"
+        )
+        self.stdout.write(f"{'modo':<18}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'erros':>7}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<18}{result['rate']:>9.1f}{result['p50']:>9.2f}{result['p95']:>9.2f}"
+                f"{result['p99']:>9.2f}{result['errors']:>7}"
+            )
+        for server in servers:
+            self.compare(f'{server} concurrent', f'{server} serial', results)
+        if len(servers) > 1:
+            for mode in MODES:
+                self.compare(f'asgi {mode}', f'wsgi {mode}', results)
+
+    def compare(self, name, base, results):
+        result, other = results[name], results[base]
+        self.stdout.write(
+            f"{name} / {base}: vazão {result['rate'] / other['rate']:.2f}x, p50 {result['p50'] / other['p50']:.2f}x"
+        )
+
+    @staticmethod
+    def run(user, urls, options):
+        """
+        Cada worker é uma thread com o seu cliente (e a sua conexão com o BD), como num servidor com threads
+        """
+        timings = []
+        errors = []
+
+        def worker():
+            client = Client()
+            client.force_login(user)
+            for i in range(options['requests']):
+                if options['cold']:
+                    invalidate_all_access()
+                start = time.perf_counter()
+                response = client.get(urls[i % len(urls)])
+                timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker) for i in range(options['workers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return summarize(timings, errors, elapsed)
+
+    @staticmethod
+    def run_asgi(user, urls, options):
+        """
+        Cada worker é uma tarefa do mesmo event loop, e as requisições passam pela aplicação ASGI do projeto
+        """
+        application = get_asgi_application()
+        client = Client()
+        client.force_login(user)
+        cookie = '; '.join(f'{key}={morsel.value}' for key, morsel in client.cookies.items()).encode()
+        timings = []
+        errors = []
+
+        async def request(path):
+            status = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await application({
+                'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie)], 'server': ('testserver', 80),
+                'http_version': '1.1',
+            }, receive, send)
+            return status[0]
+
+        async def worker():
+            for i in range(options['requests']):
+                if options['cold']:
+                    invalidate_all_access()
+                start = time.perf_counter()
+                status = await request(urls[i % len(urls)])
+                timings.append((time.perf_counter() - start) * 1000)
+                if status != 200:
+                    errors.append(status)
+
+        async def main():
+            await asyncio.gather(*[worker() for i in range(options['workers'])])
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - start
+        connections.close_all()
+
+        return summarize(timings, errors, elapsed)
+
+
+def summarize(timings, errors, elapsed):
+    return {
+        'rate': len(timings) / elapsed,
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'errors': len(errors),
+    }
@@ -0,0 +1,171 @@
+import json
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from simplemooc.courses.models import Course, Enrollment
+
+User = get_user_model()
+
+NAMESPACES = ['core', 'accounts', 'courses']
+
+# Rotas que alteram dados ou a sessão mesmo no GET
+EXCLUDED = {'accounts:logout', 'courses:enrollments'}
+
+ROLES = ['anonymous', 'enrolled', 'staff']
+
+
+def percentile(values, percent):
+    """
+    Percentil pelo método nearest-rank
+    """
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """
+    Mede todas as rotas nomeadas dos apps (GET pelo cliente de testes do Django) como visitante, aluno inscrito
+    e equipe, usando o maior curso do BD (gere os dados antes com: python manage.py seed_data).
+    Tudo roda dentro de uma transação desfeita ao final.
+
+    Com --baseline, compara o p95 e o número de consultas com os de uma execução anterior, e falha se alguma rota
+    piorou mais que --threshold. --save-baseline grava o resultado atual como a nova referência
+    """
+    help = 'Benchmark de todas as rotas: latência (p50/p95/p99) e número de consultas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Requisições por rota e perfil')
+        parser.add_argument('--cold', action='store_true', help='Limpa o cache antes de cada requisição')
+        parser.add_argument('--baseline', help='Arquivo JSON com a referência')
+        parser.add_argument('--save-baseline', action='store_true', help='Grava o resultado em --baseline')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Piora aceita no p95 (0.2 = 20%%)')
+        parser.add_argument('--min-delta', type=float, default=2, help='Diferença mínima no p95 (ms) para acusar piora')
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('Informe o arquivo em --baseline')
+
+        # Sem os avisos de 404/403 de cada requisição no meio da tabela
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']), transaction.atomic():
+            targets = self.targets()
+            clients = self.clients(targets)
+            results = {}
+            self.stdout.write(f"{'rota':<36}{'perfil':<11}{'status':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'consultas':>11}")
+            for name, url in self.routes(targets):
+                for role in ROLES:
+                    result = self.measure(clients[role], url, options['repeat'], options['cold'])
+                    results[f'{name}|{role}'] = result
+                    self.stdout.write(
+                        f"{name:<36}{role:<11}{result['status']:>7}{result['p50']:>9.2f}{result['p95']:>9.2f}"
+                        f"{result['p99']:>9.2f}{result['queries']:>11}"
+                    )
+            transaction.set_rollback(True)
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            self.stdout.write(f"Referência gravada em {options['baseline']}")
+        elif options['baseline']:
+            self.compare(results, options)
+
+    def targets(self):
+        """
+        O maior curso (em inscrições) e os seus primeiros anúncio, aula liberada e material
+        """
+        course = Course.objects.annotate(total=models.Count('enrollments')).order_by('-total', 'pk').first()
+        if course is None:
+            raise CommandError('Nenhum curso no BD. Rode antes: python manage.py seed_data')
+
+        lesson = course.lessons.filter(release_date__lte=timezone.localdate()).order_by('number').first()
+        material = lesson.materials.order_by('pk').first() if lesson else None
+        announcement = course.announcements.order_by('-comments_count', 'pk').first()
+        return {
+            'course': course,
+            'course_slug': course.slug,
+            'lesson_id': lesson and lesson.pk,
+            'material_id': material and material.pk,
+            'announcement_id': announcement and announcement.pk,
+        }
+
+    def clients(self, targets):
+        enrolled = Client()
+        enrollment = Enrollment.objects.filter(course=targets['course'], status=Enrollment.STATUS_APPROVED).first()
+        if enrollment is None:
+            raise CommandError(f"O curso {targets['course_slug']} não tem alunos inscritos")
+        enrolled.force_login(enrollment.user)
+
+        staff = Client()
+        staff.force_login(User.objects.create_user(
+            'benchmark-staff', 'benchmark-staff@exemplo.com', is_staff=True, is_superuser=True
+        ))
+
+        return {'anonymous': Client(), 'enrolled': enrolled, 'staff': staff}
+
+    def routes(self, targets):
+        """
+        (nome, url) de cada rota dos apps que dá para montar com os dados do BD
+        """
+        resolver = get_resolver()
+        for namespace in NAMESPACES:
+            for pattern in resolver.namespace_dict[namespace][1].url_patterns:
+                name = f'{namespace}:{pattern.name}'
+                if name in EXCLUDED:
+                    continue
+                params = list(pattern.pattern.converters)
+                if any(targets.get(param) is None for param in params):
+                    self.stdout.write(self.style.WARNING(f'{name}: ignorada (sem dados para {", ".join(params)})'))
+                    continue
+                yield name, reverse(name, kwargs={param: targets[param] for param in params})
+
+    @staticmethod
+    def measure(client, url, repeat, cold):
+        timings = []
+        queries = []
+        for i in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context))
+
+        return {
+            'status': response.status_code,
+            'p50': percentile(timings, 50),
+            'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+            # Maior número de consultas: a primeira requisição (cache vazio) costuma ser a mais cara
+            'queries': max(queries),
+        }
+
+    def compare(self, results, options):
+        with open(options['baseline']) as file:
+            baseline = json.load(file)
+
+        regressions = []
+        for key, result in results.items():
+            reference = baseline.get(key)
+            if reference is None:
+                continue
+            limit = max(reference['p95'] * (1 + options['threshold']), reference['p95'] + options['min_delta'])
+            if result['p95'] > limit:
+                regressions.append(f"{key}: p95 {result['p95']:.2f}ms (referência {reference['p95']:.2f}ms)")
+            if result['queries'] > reference['queries']:
+                regressions.append(f"{key}: {result['queries']} consultas (referência {reference['queries']})")
+
+        if regressions:
+            raise CommandError('Rotas mais lentas que a referência:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Nenhuma rota piorou em relação à referência'))
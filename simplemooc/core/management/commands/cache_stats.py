@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from simplemooc.core.cache import page_cache_stats
+from simplemooc.core.ratelimit import ratelimit_stats
+
+
+class Command(BaseCommand):
+    help = 'Mostra os acertos e erros do cache de páginas anônimas e as requisições recusadas pelo limite'
+
+    def handle(self, *args, **options):
+        stats = page_cache_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total * 100 if total else 0
+        self.stdout.write(f"Cache de páginas: {stats['hits']} acertos, {stats['misses']} erros ({ratio:.1f}% de acerto)")
+        for name, rejected in ratelimit_stats().items():
+            self.stdout.write(f'Limite de requisições em {name}: {rejected} recusadas')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from simplemooc.core.images import generate_renditions
+from simplemooc.courses.models import Course
+
+
+class Command(BaseCommand):
+    """
+    Gera as versões reduzidas das imagens dos cursos. Imagens cujo original não mudou são puladas
+    """
+    help = 'Gera as versões reduzidas (WebP) das imagens dos cursos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Gera de novo mesmo se o original não mudou')
+
+    def handle(self, *args, **options):
+        total = 0
+        for course in Course.objects.exclude(image='').exclude(image__isnull=True).only('image').iterator():
+            manifest = generate_renditions(course.image, force=options['force'])
+            total += 1
+            self.stdout.write(f"{course.image.name}: {', '.join(manifest['renditions']) or 'nenhuma'}")
+
+        self.stdout.write(f'{total} imagens verificadas')
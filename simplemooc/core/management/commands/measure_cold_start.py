@@ -0,0 +1,97 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Roda num processo Python novo: carrega o wsgi.py (com ou sem aquecimento) e faz duas requisições ao caminho informado
+SCRIPT = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+from simplemooc.wsgi import application
+loaded = time.perf_counter()
+
+
+def first_byte(path, host):
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host}
+    setup_testing_defaults(environ)
+    status = []
+    request_start = time.perf_counter()
+    response = application(environ, lambda value, headers, exc_info=None: status.append(value))
+    next(iter(response), b'')
+    elapsed = time.perf_counter() - request_start
+    response.close()
+    return status[0], elapsed
+
+
+status, first = first_byte(sys.argv[1], sys.argv[2])
+second = first_byte(sys.argv[1], sys.argv[2])[1]
+print(json.dumps({
+    'status': status,
+    'load': loaded - start,
+    'first_request': first,
+    'second_request': second,
+    'cold_start': loaded - start + first,
+}))
+'''
+
+FIELDS = ['load', 'first_request', 'second_request', 'cold_start', 'process']
+
+
+class Command(BaseCommand):
+    """
+    Mede o tempo da partida a frio de um worker até o primeiro byte da primeira resposta, em processos novos.
+    Para comparar versões, grave o resultado de uma com --output e rode a outra com --compare:
+        python manage.py measure_cold_start --output antes.json
+        (troca de versão)
+        python manage.py measure_cold_start --compare antes.json
+    """
+    help = 'Mede a partida a frio do worker (carga do wsgi + primeira requisição)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/', help='Caminho da requisição')
+        parser.add_argument('--host', default='localhost', help='Cabeçalho Host da requisição')
+        parser.add_argument('--runs', type=int, default=5, help='Quantidade de processos')
+        parser.add_argument('--no-warmup', action='store_true', help='Desliga o aquecimento (SIMPLEMOOC_WARMUP=0)')
+        parser.add_argument('--output', help='Grava as medianas num arquivo JSON')
+        parser.add_argument('--compare', help='Compara com as medianas gravadas antes com --output')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, SIMPLEMOOC_WARMUP='0' if options['no_warmup'] else '1')
+        runs = []
+        for i in range(options['runs']):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-c', SCRIPT, options['path'], options['host']],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+            )
+            if result.returncode:
+                raise CommandError(result.stderr)
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run['process'] = time.perf_counter() - start
+            runs.append(run)
+
+        medians = {field: statistics.median(run[field] for run in runs) for field in FIELDS}
+        self.stdout.write(f"{options['path']} ({runs[0]['status']}), mediana de {len(runs)} processos:")
+        reference = self.load(options['compare']) if options['compare'] else {}
+        for field in FIELDS:
+            line = f'{field:<16}{medians[field] * 1000:>10.1f} ms'
+            if field in reference:
+                line += f'  (antes {reference[field] * 1000:.1f} ms, {(medians[field] / reference[field] - 1) * 100:+.0f}%)'
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(medians, file, indent=2)
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            return json.load(file)
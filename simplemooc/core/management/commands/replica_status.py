@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simplemooc.core.routers import replica_status
+
+
+class Command(BaseCommand):
+    help = 'Mostra o atraso de cada réplica de leitura e se ela está recebendo leituras'
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            self.stdout.write('Nenhuma réplica configurada (DATABASE_REPLICAS): todas as leituras vão para o primário')
+            return
+
+        for status in replica_status():
+            lag = 'indisponível' if status['lag'] is None else f"{status['lag']}s de atraso"
+            situation = 'em uso' if status['healthy'] else f'fora de uso (limite: {settings.REPLICA_MAX_LAG}s)'
+            self.stdout.write(f"{status['alias']}: {lag}, {situation}")
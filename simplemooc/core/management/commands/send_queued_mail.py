@@ -0,0 +1,57 @@
+import os
+import socket
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from simplemooc.core.mail import process_outbox
+from simplemooc.core.models import OutboxMessage
+
+
+class Command(BaseCommand):
+    """
+    Worker da fila de emails.
+    Uso:
+        python manage.py send_queued_mail              envia tudo o que está pronto e termina
+        python manage.py send_queued_mail --loop       fica rodando, verificando a fila a cada --interval segundos
+        python manage.py send_queued_mail --stats      apenas mostra a profundidade e a idade da fila
+    """
+    help = 'Envia os emails gravados na fila (outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Mensagens reservadas por vez')
+        parser.add_argument('--loop', action='store_true', help='Não termina quando a fila esvazia')
+        parser.add_argument('--interval', type=float, default=5, help='Espera (segundos) com a fila vazia')
+        parser.add_argument('--stats', action='store_true', help='Mostra apenas as estatísticas da fila')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        while True:
+            result = process_outbox(worker, options['batch_size'])
+            if any(result.values()):
+                self.stdout.write(
+                    f"{result['sent']} enviados, {result['retried']} reagendados, {result['failed']} com falha"
+                )
+                continue
+
+            if not options['loop']:
+                break
+
+            # Fila vazia. Libera a conexão com o BD enquanto espera
+            close_old_connections()
+            time.sleep(options['interval'])
+
+        self.print_stats()
+
+    def print_stats(self):
+        stats = OutboxMessage.objects.stats()
+        self.stdout.write(
+            f"Fila: {stats['pending']} pendentes, {stats['failed']} com falha, "
+            f"mais antigo há {stats['oldest_age']:.0f}s"
+        )
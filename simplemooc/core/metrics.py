@@ -0,0 +1,258 @@
+"""
+Métricas por view (nome da url): histograma do tempo de resposta, número e tempo das consultas SQL
+e tempo de renderização dos templates.
+
+Os números ficam em memória, em cada processo, somados por todas as threads. De tempos em tempos
+(METRICS_FLUSH_SECONDS) cada processo grava uma cópia no cache, e o endpoint de métricas soma as cópias
+de todos os processos. O formato de saída é o texto do Prometheus.
+"""
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from .cache import page_cache_stats
+from .ratelimit import ratelimit_stats
+
+WORKERS_KEY = 'metrics:workers'
+
+# Medições da requisição em andamento em cada thread (consultas e templates)
+_current = threading.local()
+
+
+def worker_id():
+    """
+    Identifica o processo: o pid sozinho se repete em containers ou máquinas que usam o mesmo cache
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def worker_key(worker):
+    return f'metrics:worker:{worker}'
+
+
+class RequestStats:
+    """
+    Medições de uma requisição. Também é o execute_wrapper que conta as consultas SQL, inclusive as feitas
+    em paralelo nas threads do core.concurrency
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # Templates renderizados dentro de outros (ex.: render_to_string numa tag) não são contados duas vezes
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.queries += 1
+                self.db_time += elapsed
+
+
+class Registry:
+    """
+    Métricas acumuladas do processo
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.flushed_at = 0
+
+    def record(self, view, duration, stats):
+        buckets = settings.METRICS_BUCKETS
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = {
+                    'buckets': [0] * (len(buckets) + 1), 'count': 0, 'sum': 0.0,
+                    'queries': 0, 'db_time': 0.0, 'template_time': 0.0,
+                }
+            # O último balde é o +Inf
+            metrics['buckets'][bisect_left(buckets, duration)] += 1
+            metrics['count'] += 1
+            metrics['sum'] += duration
+            metrics['queries'] += stats.queries
+            metrics['db_time'] += stats.db_time
+            metrics['template_time'] += stats.template_time
+
+    def snapshot(self):
+        with self.lock:
+            return {view: dict(metrics, buckets=list(metrics['buckets'])) for view, metrics in self.views.items()}
+
+    def flush(self, force=False):
+        """
+        Grava a cópia deste processo no cache, no máximo uma vez a cada METRICS_FLUSH_SECONDS
+        """
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS_FLUSH_SECONDS:
+            return
+        self.flushed_at = now
+        worker = worker_id()
+        cache.set(worker_key(worker), self.snapshot(), settings.METRICS_WORKER_TIMEOUT)
+        workers = cache.get(WORKERS_KEY) or []
+        if worker not in workers:
+            cache.set(WORKERS_KEY, workers + [worker], None)
+
+    def clear(self):
+        with self.lock:
+            self.views = {}
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """
+    Soma as métricas de vários processos
+    """
+    total = {}
+    for snapshot in snapshots:
+        for view, metrics in snapshot.items():
+            if view not in total:
+                total[view] = dict(metrics, buckets=list(metrics['buckets']))
+                continue
+            current = total[view]
+            current['buckets'] = [a + b for a, b in zip(current['buckets'], metrics['buckets'])]
+            for field in ('count', 'sum', 'queries', 'db_time', 'template_time'):
+                current[field] += metrics[field]
+
+    return total
+
+
+def collect():
+    """
+    Métricas de todos os processos: a cópia atual deste e as últimas gravadas no cache pelos demais
+    """
+    current = worker_id()
+    workers = [worker for worker in cache.get(WORKERS_KEY) or [] if worker != current]
+    snapshots = cache.get_many([worker_key(worker) for worker in workers])
+    alive = [worker for worker in workers if worker_key(worker) in snapshots]
+    if len(alive) != len(workers):
+        # Processos que não gravam há mais de METRICS_WORKER_TIMEOUT saem da lista
+        cache.set(WORKERS_KEY, alive + [current], None)
+
+    return merge([registry.snapshot()] + list(snapshots.values()))
+
+
+def render_prometheus(views):
+    """
+    Texto no formato do Prometheus
+    """
+    lines = [
+        '# HELP simplemooc_request_duration_seconds Tempo de resposta por view',
+        '# TYPE simplemooc_request_duration_seconds histogram',
+    ]
+    bounds = [str(bound) for bound in settings.METRICS_BUCKETS] + ['+Inf']
+    for view, metrics in sorted(views.items()):
+        cumulative = 0
+        for bound, amount in zip(bounds, metrics['buckets']):
+            cumulative += amount
+            lines.append(f'simplemooc_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+        lines.append(f'simplemooc_request_duration_seconds_sum{{view="{view}"}} {metrics["sum"]:.6f}')
+        lines.append(f'simplemooc_request_duration_seconds_count{{view="{view}"}} {metrics["count"]}')
+
+    for name, field, kind, help_text in (
+        ('simplemooc_db_queries_total', 'queries', 'counter', 'Consultas SQL por view'),
+        ('simplemooc_db_duration_seconds_total', 'db_time', 'counter', 'Tempo das consultas SQL por view'),
+        ('simplemooc_template_duration_seconds_total', 'template_time', 'counter', 'Tempo dos templates por view'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for view, metrics in sorted(views.items()):
+            lines.append(f'{name}{{view="{view}"}} {round(metrics[field], 6)}')
+
+    stats = page_cache_stats()
+    lines += [
+        '# HELP simplemooc_page_cache_hits_total Acertos do cache de páginas',
+        '# TYPE simplemooc_page_cache_hits_total counter',
+        f"simplemooc_page_cache_hits_total {stats['hits']}",
+        '# HELP simplemooc_page_cache_misses_total Erros do cache de páginas',
+        '# TYPE simplemooc_page_cache_misses_total counter',
+        f"simplemooc_page_cache_misses_total {stats['misses']}",
+        '# HELP simplemooc_ratelimit_rejected_total Requisições recusadas pelo limite de requisições',
+        '# TYPE simplemooc_ratelimit_rejected_total counter',
+    ]
+    lines += [f'simplemooc_ratelimit_rejected_total{{view="{view}"}} {amount}' for view, amount in ratelimit_stats().items()]
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """
+    Mede cada requisição e acumula pelo nome da url. Deve ser o primeiro middleware, para medir também os demais
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        stats = _current.stats = RequestStats()
+        start = time.perf_counter()
+        try:
+            # Todas as conexões da thread (o BD principal e as réplicas). As das threads do core.concurrency
+            # recebem o mesmo wrapper em gather()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        registry.record(match.view_name if match else 'unresolved', duration, stats)
+        registry.flush()
+        return response
+
+
+class TimedTemplate(Template):
+    """
+    Template que soma o seu tempo de renderização às métricas da requisição
+    """
+
+    def render(self, context=None, request=None):
+        stats = getattr(_current, 'stats', None)
+        if stats is None:
+            return super().render(context, request)
+
+        stats.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if not stats.template_depth:
+                stats.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Backend de templates do Django que mede o tempo de renderização (ver TimedTemplate)
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
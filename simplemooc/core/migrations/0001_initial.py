@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Assunto')),
+                ('body_txt', models.TextField(verbose_name='Mensagem (texto)')),
+                ('body_html', models.TextField(verbose_name='Mensagem (HTML)')),
+                ('from_email', models.CharField(max_length=255, verbose_name='Remetente')),
+                ('recipients', models.TextField(verbose_name='Destinatários')),
+                ('individual', models.BooleanField(blank=True, default=False, verbose_name='Envio individual?')),
+                ('dedupe_key', models.CharField(db_index=True, max_length=64, verbose_name='Chave de duplicidade')),
+                ('status', models.IntegerField(blank=True, choices=[(0, 'Pendente'), (1, 'Enviado'), (2, 'Falhou')], default=0, verbose_name='Situação')),
+                ('attempts', models.IntegerField(blank=True, default=0, verbose_name='Tentativas')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Próxima Tentativa')),
+                ('claimed_by', models.CharField(blank=True, max_length=100, verbose_name='Reservado por')),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='Reservado até')),
+                ('last_error', models.TextField(blank=True, verbose_name='Último Erro')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado Em')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Enviado Em')),
+            ],
+            options={
+                'verbose_name': 'Email na Fila',
+                'verbose_name_plural': 'Emails na Fila',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='core_outbox_status_next_idx'),
+        ),
+    ]
@@ -1,3 +1,173 @@
+from datetime import timedelta
+
 from django.db import models
+from django.utils import timezone
+
+
+class OutboxMessageManager(models.Manager):
+    """
+    Gerenciador da fila de emails
+    """
+
+    def pending(self):
+        """
+        Mensagens ainda não enviadas (aguardando envio ou nova tentativa)
+        """
+        return self.get_queryset().filter(status=OutboxMessage.STATUS_PENDING)
+
+    def claim(self, worker, batch_size, lease_seconds):
+        """
+        Reserva um lote de mensagens prontas para envio para o worker informado.
+        A reserva é feita com um UPDATE condicional, então dois workers nunca pegam a mesma mensagem.
+        Se o worker morrer, a reserva expira depois de lease_seconds e a mensagem volta para a fila
+
+        :return: Lista das mensagens reservadas
+        """
+        now = timezone.now()
+        available = self.pending().filter(next_attempt_at__lte=now).filter(
+            models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lt=now)
+        )
+        ids = list(available.order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+
+        # Só ficam com este worker as que ainda estavam livres no momento do UPDATE
+        available.filter(pk__in=ids).update(
+            claimed_by=worker,
+            claimed_until=now + timedelta(seconds=lease_seconds)
+        )
+        return list(self.pending().filter(pk__in=ids, claimed_by=worker, claimed_until__gt=now))
+
+    def stats(self):
+        """
+        Profundidade e idade da fila
+        :return: dicionário com o total pendente, com falha definitiva e a idade (em segundos) da mais antiga
+        """
+        pending = self.pending()
+        oldest = pending.order_by('created_at').values_list('created_at', flat=True).first()
+        return {
+            'pending': pending.count(),
+            'failed': self.get_queryset().filter(status=OutboxMessage.STATUS_FAILED).count(),
+            'oldest_age': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        }
+
+
+class OutboxMessage(models.Model):
+    """
+    Fila de emails (outbox). Os emails são gravados aqui durante a requisição
+    e enviados depois pelo comando send_queued_mail
+    """
+
+    STATUS_PENDING = 0
+    STATUS_SENT = 1
+    STATUS_FAILED = 2
+
+    # Escolhas para Status
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_SENT, 'Enviado'),
+        (STATUS_FAILED, 'Falhou'),
+    )
+
+    subject = models.CharField(
+        'Assunto',
+        max_length=255
+    )
+
+    body_txt = models.TextField(
+        'Mensagem (texto)'
+    )
+
+    body_html = models.TextField(
+        'Mensagem (HTML)'
+    )
+
+    from_email = models.CharField(
+        'Remetente',
+        max_length=255
+    )
+
+    # Um email por linha
+    recipients = models.TextField(
+        'Destinatários'
+    )
+
+    # Se marcado, cada destinatário recebe o seu próprio email. Senão, todos vão juntos no mesmo email
+    individual = models.BooleanField(
+        'Envio individual?',
+        default=False,
+        blank=True
+    )
+
+    # Identifica mensagens idênticas, para não enfileirar a mesma mensagem mais de uma vez
+    dedupe_key = models.CharField(
+        'Chave de duplicidade',
+        max_length=64,
+        db_index=True
+    )
+
+    status = models.IntegerField(
+        'Situação',
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        blank=True
+    )
+
+    attempts = models.IntegerField(
+        'Tentativas',
+        default=0,
+        blank=True
+    )
+
+    next_attempt_at = models.DateTimeField(
+        'Próxima Tentativa',
+        default=timezone.now
+    )
+
+    claimed_by = models.CharField(
+        'Reservado por',
+        max_length=100,
+        blank=True
+    )
+
+    claimed_until = models.DateTimeField(
+        'Reservado até',
+        null=True,
+        blank=True
+    )
+
+    last_error = models.TextField(
+        'Último Erro',
+        blank=True
+    )
+
+    created_at = models.DateTimeField(
+        'Criado Em',
+        auto_now_add=True
+    )
+
+    sent_at = models.DateTimeField(
+        'Enviado Em',
+        null=True,
+        blank=True
+    )
+
+    objects = OutboxMessageManager()
+
+    def recipient_list(self):
+        """
+        Destinatários em forma de lista
+        """
+        return [recipient for recipient in self.recipients.splitlines() if recipient]
+
+    def __str__(self):
+        return self.subject
 
-# Create your models here.
+    class Meta:
+        verbose_name = 'Email na Fila'
+        verbose_name_plural = 'Emails na Fila'
+        ordering = ['created_at']
+        # O worker sempre procura por situação + data da próxima tentativa
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='core_outbox_status_next_idx'),
+        ]
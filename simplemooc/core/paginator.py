@@ -0,0 +1,56 @@
+"""
+Paginação de tabelas grandes (listagens do admin).
+
+O Paginator do Django faz um COUNT(*) exato a cada página, que percorre a tabela (ou o índice) inteira.
+Aqui a contagem para em ADMIN_EXACT_COUNT_LIMIT linhas: até esse limite o total é exato; acima dele, o total
+é a estimativa que o próprio BD guarda da tabela (sem filtros) ou apenas o limite (com filtros).
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Estimativa do total de linhas guardada pelo BD (atualizada pelo ANALYZE/estatísticas do próprio BD)
+ESTIMATE_SQL = {
+    'mysql': 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+}
+
+
+def estimate_rows(model, using):
+    """
+    Total aproximado de linhas da tabela do model, ou None se o BD não tiver estimativa (ex.: SQLite)
+    """
+    connection = connections[using]
+    sql = ESTIMATE_SQL.get(connection.vendor)
+    if sql is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator que só conta até ADMIN_EXACT_COUNT_LIMIT linhas (SELECT COUNT(*) FROM (... LIMIT n)).
+    Acima disso usa a estimativa do BD, e as páginas além do fim de verdade apenas aparecem vazias
+    """
+    # O total é uma estimativa? (preenchido ao contar)
+    estimated = False
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        capped = queryset.order_by()[:limit + 1].count()
+        self.estimated = capped > limit
+        if not self.estimated:
+            return capped
+
+        estimate = None
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+
+        return max(estimate or 0, capped)
@@ -0,0 +1,169 @@
+"""
+Limite de requisições por cliente (janela deslizante), configurado por nome de url em settings.RATELIMITS.
+
+Cada cliente (IP ou usuário) pode fazer 'rate' requisições por período. As requisições são contadas em janelas fixas
+do tamanho do período, e a janela anterior conta proporcionalmente ao quanto dela ainda cabe nos últimos 'período'
+segundos. Acima do limite, a resposta é 429 com o cabeçalho Retry-After.
+Os contadores ficam no cache (compartilhado entre os processos) e são incrementados com add + incr, que são atômicos:
+requisições simultâneas do mesmo cliente nunca leem a mesma contagem. Se o cache falhar, cada processo passa a usar
+os seus próprios contadores em memória, até o cache voltar.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .cache import count
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Contadores em memória, usados só quando o cache falha: {chave: {janela: requisições}}
+_local_windows = {}
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """
+    '5/m' -> (5, 60): 5 requisições por minuto
+    """
+    amount, period = rate.split('/')
+    return int(amount), PERIODS[period[0]]
+
+
+def rejected_key(name):
+    return f'ratelimit:rejected:{name}'
+
+
+def ratelimit_stats():
+    """
+    Requisições recusadas (429) por nome de url
+    """
+    names = list(settings.RATELIMITS)
+    stats = cache.get_many([rejected_key(name) for name in names])
+    return {name: stats.get(rejected_key(name), 0) for name in names}
+
+
+def client_key(request, key='ip'):
+    """
+    Identifica o cliente: pelo IP ou, com key='user', pelo usuário logado (anônimos continuam pelo IP)
+    """
+    if key == 'user' and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def hit(key, window, period):
+    """
+    Conta a requisição na janela atual do cache
+    :return: (requisições na janela atual, requisições na janela anterior)
+    """
+    current = f'{key}:{window}'
+    # Cada janela precisa durar enquanto for a atual ou a anterior
+    cache.add(current, 0, period * 2)
+    try:
+        used = cache.incr(current)
+    except ValueError:
+        # O contador foi descartado entre o add e o incr
+        cache.add(current, 1, period * 2)
+        used = 1
+
+    return used, cache.get(f'{key}:{window - 1}') or 0
+
+
+def hit_local(key, window):
+    """
+    Conta a requisição na janela atual em memória
+    """
+    with _local_lock:
+        windows = _local_windows.setdefault(key, {})
+        windows[window] = windows.get(window, 0) + 1
+        for old in [old for old in windows if old < window - 1]:
+            del windows[old]
+
+        return windows[window], windows.get(window - 1, 0)
+
+
+def undo(key, window, local):
+    """
+    Descarta a requisição recusada, para que ela não ocupe o lugar das próximas
+    """
+    if local:
+        with _local_lock:
+            _local_windows[key][window] -= 1
+        return
+
+    try:
+        cache.decr(f'{key}:{window}')
+    except Exception:
+        pass
+
+
+def take(key, capacity, period):
+    """
+    Conta uma requisição do cliente
+    :return: 0 se a requisição pode seguir, ou os segundos até o cliente poder fazer outra
+    """
+    now = time.time()
+    window = int(now // period)
+    elapsed = now % period
+    local = False
+    try:
+        used, previous = hit(key, window, period)
+    except Exception:
+        logger.warning('Cache indisponível para o limite de requisições, usando os contadores em memória', exc_info=True)
+        local = True
+        used, previous = hit_local(key, window)
+
+    # Parte da janela anterior que ainda está dentro dos últimos 'period' segundos
+    if previous * (1 - elapsed / period) + used <= capacity:
+        return 0
+
+    undo(key, window, local)
+    used -= 1
+    if previous and used < capacity:
+        # Quando a parte da janela anterior que ainda conta deixar lugar para mais uma
+        return (1 - (capacity - used - 1) / previous) * period - elapsed
+    return period - elapsed
+
+
+class RateLimitMiddleware:
+    """
+    Aplica os limites de settings.RATELIMITS. Exemplo:
+        RATELIMITS = {
+            'accounts:register': {'rate': '5/h', 'methods': ['POST']},
+            'courses:announcement': {'rate': '10/m', 'methods': ['POST'], 'key': 'user'},
+        }
+    Precisa vir depois do AuthenticationMiddleware, por causa dos limites por usuário
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = request.resolver_match.view_name
+        limit = settings.RATELIMITS.get(name)
+        if not limit or request.method not in limit.get('methods', ['GET', 'POST']):
+            return None
+
+        capacity, period = parse_rate(limit['rate'])
+        retry_after = take(f"ratelimit:{name}:{client_key(request, limit.get('key', 'ip'))}", capacity, period)
+        if not retry_after:
+            return None
+
+        try:
+            count(rejected_key(name))
+        except Exception:
+            # Sem cache não há contador, mas o limite continua valendo
+            pass
+        response = HttpResponse('Muitas requisições. Aguarde um pouco e tente novamente.', status=429)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
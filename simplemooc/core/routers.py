@@ -0,0 +1,197 @@
+"""
+Réplicas de leitura.
+
+As views marcadas com @read_from_replica leem de uma das réplicas de settings.DATABASE_REPLICAS.
+Todo o resto (gravações, transações e as demais views) usa o primário ('default').
+
+- Ler o que acabou de gravar: quando uma requisição grava no primário, a sessão do usuário fica presa ao primário
+  por REPLICA_STICKY_SECONDS (StickyPrimaryMiddleware). Assim quem acabou de comentar ou se inscrever já vê o resultado.
+- Atraso das réplicas: o atraso de cada réplica é consultado a cada REPLICA_LAG_CHECK_SECONDS. Uma réplica atrasada
+  mais que REPLICA_MAX_LAG, ou que não responde, deixa de receber leituras até se recuperar
+  (python manage.py replica_status mostra a situação).
+- Caches: o que vai para o cache não pode vir de uma réplica atrasada, senão o dado velho ficaria guardado.
+  Por isso os visitantes anônimos (cache de páginas) não usam as réplicas, e quem preenche os caches lê dentro
+  de with primary().
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from .cache import is_cacheable_request
+
+logger = logging.getLogger(__name__)
+
+# Chave da sessão com o horário até quando o usuário lê do primário
+STICKY_SESSION_KEY = '_db_primary_until'
+
+# Réplica em uso pela requisição em andamento em cada thread (None = primário)
+_state = threading.local()
+
+# Atraso de cada réplica: alias -> (horário da consulta, atraso em segundos ou None se indisponível)
+_lags = {}
+
+
+def measure_lag(alias):
+    """
+    Atraso da réplica em segundos, ou None se ela não está replicando ou não responde
+    """
+    try:
+        connection = connections[alias]
+        if connection.vendor != 'mysql':
+            # Sem replicação a consultar (ex.: dois SQLite locais): basta a réplica responder
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))['Seconds_Behind_Master']
+    except Exception:
+        logger.warning('Réplica %s indisponível', alias, exc_info=True)
+        return None
+
+
+def replica_lag(alias):
+    """
+    Atraso da réplica, consultado no máximo uma vez a cada REPLICA_LAG_CHECK_SECONDS por processo
+    """
+    now = time.monotonic()
+    checked_at, lag = _lags.get(alias, (None, None))
+    if checked_at is None or now - checked_at >= settings.REPLICA_LAG_CHECK_SECONDS:
+        lag = measure_lag(alias)
+        _lags[alias] = (now, lag)
+
+    return lag
+
+
+def is_healthy(alias):
+    lag = replica_lag(alias)
+    return lag is not None and lag <= settings.REPLICA_MAX_LAG
+
+
+def choose_replica():
+    """
+    Uma réplica saudável qualquer, ou None para ler do primário
+    """
+    healthy = [alias for alias in settings.DATABASE_REPLICAS if is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def replica_status():
+    """
+    Situação de cada réplica (para o comando replica_status)
+    """
+    return [
+        {'alias': alias, 'lag': replica_lag(alias), 'healthy': is_healthy(alias)}
+        for alias in settings.DATABASE_REPLICAS
+    ]
+
+
+def current_replica():
+    """
+    Réplica em uso na thread atual (None = primário)
+    """
+    return getattr(_state, 'replica', None)
+
+
+@contextmanager
+def use_replica(alias):
+    previous = current_replica()
+    _state.replica = alias
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def primary():
+    """
+    Lê do primário dentro do bloco, mesmo numa view de réplica (ex.: ao preencher um cache)
+    """
+    return use_replica(None)
+
+
+def is_sticky(request):
+    """
+    O usuário gravou algo há pouco?
+    """
+    return getattr(request, 'session', None) is not None and request.session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+def read_from_replica(view_func):
+    """
+    Decorador de views só de leitura: os GETs leem de uma réplica, exceto de quem gravou algo há pouco
+    e dos visitantes anônimos (a página deles vai para o cache de páginas)
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if (
+            not settings.DATABASE_REPLICAS
+            or request.method not in ('GET', 'HEAD')
+            or is_cacheable_request(request)
+            or is_sticky(request)
+        ):
+            return view_func(request, *args, **kwargs)
+
+        with use_replica(choose_replica()):
+            return view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """
+    Leituras vão para a réplica escolhida pela view (se houver), e nunca dentro de uma transação no primário.
+    Gravações sempre vão para o primário
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = current_replica()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # As réplicas têm os mesmos dados do primário
+        return True
+
+
+class StickyPrimaryMiddleware:
+    """
+    Prende ao primário, por REPLICA_STICKY_SECONDS, a sessão de quem gravou algo no BD.
+    Deve vir depois do SessionMiddleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        wrote = []
+
+        def detect_writes(execute, sql, params, many, context):
+            if not sql.lstrip()[:6].upper() == 'SELECT':
+                wrote.append(True)
+            return execute(sql, params, many, context)
+
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(detect_writes):
+            response = self.get_response(request)
+
+        if wrote and getattr(request, 'session', None) is not None:
+            request.session[STICKY_SESSION_KEY] = time.time() + settings.REPLICA_STICKY_SECONDS
+
+        return response
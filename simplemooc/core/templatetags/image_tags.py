@@ -0,0 +1,49 @@
+"""
+TAGs de Templates para imagens
+"""
+from django import template
+from django.core.cache import cache
+from django.utils.html import format_html
+
+from simplemooc.core.cache import add_cache_tags
+from simplemooc.core.images import get_manifest, generate_for_pages, page_tag, PENDING_TIMEOUT
+from simplemooc.core.utils import run_in_background
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, field_file, alt='', sizes='100vw'):
+    """
+    Imagem com as versões reduzidas em WebP (srcset), deixando o navegador escolher a menor que serve.
+    Navegadores sem WebP recebem o original. Se as versões ainda não existem, usa o original
+    e agenda a geração em segundo plano. A página em cache (cache_anonymous_page) passa a depender da imagem
+    e é refeita quando as versões ficarem prontas
+
+    Uso:
+        {% load image_tags %}
+        {% responsive_image course.image alt=course.name sizes='(min-width: 48em) 33vw, 100vw' %}
+    """
+    manifest = get_manifest(field_file)
+    if not manifest or not manifest['renditions']:
+        if manifest is None:
+            request = context.get('request')
+            if request is not None:
+                add_cache_tags(request, page_tag(field_file.name))
+            # Só agenda uma geração por imagem por vez
+            if cache.add(f'images:generating:{field_file.name}', True, PENDING_TIMEOUT):
+                run_in_background(f'renditions-{field_file.name}', generate_for_pages, field_file)
+        return format_html(
+            '<img src="{}" alt="{}" loading="lazy" decoding="async">', field_file.url, alt
+        )
+
+    storage = field_file.storage
+    srcset = ', '.join(
+        f'{storage.url(name)} {width}w'
+        for width, name in sorted(manifest['renditions'].items(), key=lambda item: int(item[0]))
+    )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" alt="{}" loading="lazy" decoding="async"></picture>',
+        srcset, sizes, field_file.url, alt
+    )
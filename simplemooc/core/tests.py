@@ -1,3 +1,551 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.db.models.fields.files import FieldFile
+from django.template import Template, Context
+from django.urls import reverse
+
+from .images import generate_renditions, manifest_name, page_tag
+from .cache import get_tag_versions
+from .mail import send_mail_template, send_mass_mail_template, process_outbox
+from .models import OutboxMessage
+from .ratelimit import ratelimit_stats, take
+from .metrics import registry, collect, render_prometheus, WORKERS_KEY, RequestStats, MetricsMiddleware
+
+from .routers import PrimaryReplicaRouter, use_replica, primary, choose_replica, current_replica, STICKY_SESSION_KEY
+from .concurrency import gather
+from .management.commands.measure_cold_start import SCRIPT
+from .asgi import WsgiToAsgi, get_asgi_application
+
+from simplemooc.courses.models import Course, Enrollment
+from simplemooc.warmup import warm_up
+
+User = get_user_model()
+
+
+class OutboxTestCase(TestCase):
+    """
+    Testa a fila de emails (outbox)
+    """
+
+    def test_send_mail_template_only_enqueues(self):
+        """
+        Nenhum email sai durante a requisição, apenas quando o worker roda
+        """
+        send_mail_template('Assunto', 'courses/contact_email.html', {'name': 'Fulano'}, ['a@teste.com'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.pending().count(), 1)
+
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['a@teste.com'])
+        self.assertEqual(OutboxMessage.objects.pending().count(), 0)
+
+    def test_duplicated_message_is_enqueued_once(self):
+        """
+        A mesma mensagem, para os mesmos destinatários, não entra duas vezes na fila
+        """
+        for i in range(3):
+            send_mail_template('Assunto', 'courses/contact_email.html', {'name': 'Fulano'}, ['a@teste.com'])
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_mass_mail_is_enqueued_in_batches(self):
+        """
+        Envio em massa vira uma mensagem por lote, e cada destinatário recebe o seu próprio email
+        """
+        recipients = [f'aluno{i}@teste.com' for i in range(5)]
+        send_mass_mail_template('Aviso', 'courses/contact_email.html', {}, iter(recipients), batch_size=2)
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+
+        process_outbox('teste')
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), recipients)
+
+    def test_failure_is_retried_with_backoff(self):
+        """
+        Uma falha de envio reagenda a mensagem apenas para quem ainda não recebeu
+        """
+        send_mass_mail_template('Aviso', 'courses/contact_email.html', {}, ['a@teste.com', 'b@teste.com'])
+        original = mail.get_connection().__class__.send_messages
+
+        def send_messages(connection, messages):
+            if messages[0].to == ['b@teste.com']:
+                raise ConnectionError('SMTP fora do ar')
+            return original(connection, messages)
+
+        with mock.patch.object(mail.get_connection().__class__, 'send_messages', send_messages), \
+                self.assertLogs('simplemooc.core.mail', 'WARNING'):
+            result = process_outbox('teste')
+
+        self.assertEqual(result, {'sent': 0, 'retried': 1, 'failed': 0})
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.recipient_list(), ['b@teste.com'])
+        self.assertEqual(len(mail.outbox), 1)
+        # Ainda não chegou a hora da nova tentativa
+        self.assertEqual(process_outbox('teste')['sent'], 0)
+        self.assertEqual(OutboxMessage.objects.stats()['pending'], 1)
+
+
+class RenditionsTestCase(TestCase):
+    """
+    Testa a geração das versões reduzidas das imagens
+    """
+
+    def setUp(self):
+        from PIL import Image
+
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITION_WIDTHS=[320, 640, 2000])
+        self.settings.enable()
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), 'blue').save(buffer, 'PNG')
+        name = default_storage.save('courses/images/curso.png', ContentFile(buffer.getvalue()))
+        self.image = FieldFile(None, mock.Mock(storage=default_storage), name)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_renditions_are_generated_next_to_the_original(self):
+        manifest = generate_renditions(self.image)
+        # Não amplia a imagem para 2000px
+        self.assertEqual(sorted(manifest['renditions']), ['320', '640'])
+        self.assertTrue(default_storage.exists('courses/images/curso.renditions/320.webp'))
+        self.assertTrue(default_storage.exists(manifest_name(self.image.name)))
+
+    def test_unchanged_source_is_not_regenerated(self):
+        generate_renditions(self.image)
+        with mock.patch('PIL.Image.open') as image_open:
+            generate_renditions(self.image)
+        image_open.assert_not_called()
+
+    def test_missing_manifest_is_cached(self):
+        """
+        Sem as versões, a página usa o original, agenda uma única geração e não procura o manifesto de novo
+        """
+        request = RequestFactory().get('/')
+        template = Template('{% load image_tags %}{% responsive_image image alt="Curso" %}')
+        with mock.patch('simplemooc.core.templatetags.image_tags.run_in_background') as run, \
+                mock.patch.object(default_storage, 'exists', wraps=default_storage.exists) as exists:
+            for i in range(3):
+                html = template.render(Context({'image': self.image, 'request': request}))
+        self.assertEqual(exists.call_count, 1)
+        self.assertEqual(run.call_count, 1)
+        self.assertIn(f'src="{self.image.url}"', html)
+        self.assertEqual(request.cache_tags, {page_tag(self.image.name)})
+
+        # Terminada a geração, as páginas que mostravam só o original são invalidadas
+        version = get_tag_versions([page_tag(self.image.name)])
+        run.call_args[0][1](*run.call_args[0][2:])
+        self.assertNotEqual(get_tag_versions([page_tag(self.image.name)]), version)
+        self.assertIn('320.webp', template.render(Context({'image': self.image})))
+
+    def test_template_tag_emits_srcset(self):
+        generate_renditions(self.image)
+        html = Template('{% load image_tags %}{% responsive_image image alt="Curso" %}').render(
+            Context({'image': self.image})
+        )
+        self.assertIn('320.webp 320w, ', html)
+        self.assertIn('640.webp 640w', html)
+        self.assertIn(f'src="{self.image.url}"', html)
+
+
+@override_settings(RATELIMITS={'accounts:reset': {'rate': '2/m', 'methods': ['POST']}})
+class RateLimitTestCase(TestCase):
+    """
+    Testa o limite de requisições por cliente
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, ip='10.0.0.1'):
+        return self.client.post(reverse('accounts:reset'), {'email': 'ninguem@teste.com'}, REMOTE_ADDR=ip)
+
+    def test_rejects_after_rate(self):
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1200):
+            self.assertEqual(self.post().status_code, 200)
+            self.assertEqual(self.post().status_code, 200)
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1230):
+            response = self.post()
+        self.assertEqual(response.status_code, 429)
+        # Até o fim da janela atual (1200 a 1260)
+        self.assertEqual(response['Retry-After'], '30')
+        # Outro cliente tem o seu próprio balde, e o GET não é limitado
+        self.assertEqual(self.post(ip='10.0.0.2').status_code, 200)
+        self.assertEqual(self.client.get(reverse('accounts:reset'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.assertEqual(ratelimit_stats(), {'accounts:reset': 1})
+
+    def test_window_slides(self):
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1000):
+            self.post()
+            self.post()
+            response = self.post()
+            self.assertEqual(response.status_code, 429)
+        # Na janela seguinte, as 2 requisições anteriores ainda contam 5/6: só há lugar para mais uma após 1050s
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1030):
+            response = self.post()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '20')
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1050):
+            self.assertEqual(self.post().status_code, 200)
+            self.assertEqual(self.post().status_code, 429)
+
+    def test_concurrent_requests_share_the_count(self):
+        """
+        Requisições simultâneas do mesmo cliente não passam todas juntas: a contagem é incrementada, não regravada
+        """
+        barrier = threading.Barrier(10)
+        results = []
+
+        def request():
+            barrier.wait()
+            results.append(take('ratelimit:teste', 2, 60))
+
+        threads = [threading.Thread(target=request) for i in range(10)]
+        with mock.patch('simplemooc.core.ratelimit.time.time', return_value=1000):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results.count(0), 2)
+
+    def test_local_fallback(self):
+        with mock.patch('simplemooc.core.ratelimit.cache.add', side_effect=ConnectionError), \
+                self.assertLogs('simplemooc.core.ratelimit', 'WARNING'):
+            self.assertEqual(self.post(ip='10.0.0.3').status_code, 200)
+            self.assertEqual(self.post(ip='10.0.0.3').status_code, 200)
+            self.assertEqual(self.post(ip='10.0.0.3').status_code, 429)
+
+
+class MetricsTestCase(TestCase):
+    """
+    Testa as métricas por view
+    """
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+
+    def test_records_views(self):
+        self.client.get(reverse('courses:index'))
+        self.client.get(reverse('courses:index'))
+        metrics = registry.snapshot()['courses:index']
+        self.assertEqual(metrics['count'], 2)
+        self.assertEqual(sum(metrics['buckets']), 2)
+        # A segunda vez veio do cache de páginas, sem consultas nem templates
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreater(metrics['template_time'], 0)
+
+    def test_endpoint_is_protected(self):
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='segredo'):
+            response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('simplemooc_request_duration_seconds_count{view="core:metrics"}', response.content.decode())
+
+    def test_wraps_every_connection(self):
+        """
+        Todas as conexões (principal e réplicas) contam as consultas da requisição
+        """
+        def get_response(request):
+            wrapped.extend(bool(c.execute_wrappers) for c in connections.all())
+            return HttpResponse()
+
+        wrapped = []
+        MetricsMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertEqual(wrapped, [True] * len(settings.DATABASES))
+        self.assertEqual([c.execute_wrappers for c in connections.all()], [[]] * len(settings.DATABASES))
+
+    def test_merges_workers(self):
+        self.client.get(reverse('core:home'))
+        registry.flush(force=True)
+        # Outro processo com a mesma view, com o mesmo pid mas em outra máquina
+        with mock.patch('simplemooc.core.metrics.socket.gethostname', return_value='outra-maquina'):
+            registry.flush(force=True)
+        self.assertEqual(len(cache.get(WORKERS_KEY)), 2)
+        self.assertEqual(collect()['core:home']['count'], 2)
+        text = render_prometheus(collect())
+        self.assertIn('simplemooc_request_duration_seconds_bucket{view="core:home",le="+Inf"} 2', text)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class BenchmarkRoutesTestCase(TestCase):
+    """
+    Testa o benchmark das rotas contra uma referência
+    """
+
+    def setUp(self):
+        cache.clear()
+        call_command(
+            'seed_data', '--users=10', '--courses=2', '--lessons=2', '--materials=1', '--enrollments=10',
+            '--announcements=1', '--comments=5', stdout=StringIO()
+        )
+        self.baseline = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        self.addCleanup(os.remove, self.baseline)
+
+    def test_baseline(self):
+        out = StringIO()
+        call_command('benchmark_routes', '--repeat=2', f'--baseline={self.baseline}', '--save-baseline', stdout=out)
+        self.assertIn('courses:lessons', out.getvalue())
+        with open(self.baseline) as file:
+            baseline = json.load(file)
+        self.assertEqual(baseline['courses:lessons|enrolled']['status'], 200)
+        self.assertNotIn('courses:enrollments|anonymous', baseline)
+
+        # Uma referência com menos consultas faz o benchmark falhar
+        baseline['courses:lessons|enrolled']['queries'] = 0
+        with open(self.baseline, 'w') as file:
+            json.dump(baseline, file)
+        with self.assertRaisesMessage(CommandError, 'courses:lessons|enrolled'):
+            call_command('benchmark_routes', '--repeat=2', f'--baseline={self.baseline}', stdout=StringIO())
+
+
+class WarmupTestCase(TestCase):
+    """
+    Testa o aquecimento do worker e a medição da partida a frio
+    """
+    # O aquecimento testa a conexão com todos os BDs (inclusive as réplicas)
+    databases = '__all__'
+
+    def test_warm_up(self):
+        report = warm_up()
+        self.assertFalse([name for name, step in report.items() if 'error' in step])
+        self.assertGreater(report['urls']['result'], 0)
+        compiled, failed = report['templates']['result']
+        self.assertGreater(compiled, 0)
+        self.assertEqual(failed, 0)
+
+    def test_measure_cold_start(self):
+        """
+        O processo medido usaria o BD configurado (e não o de testes): aqui ele é simulado
+        """
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        self.addCleanup(os.remove, output)
+        compile(SCRIPT, 'measure_cold_start', 'exec')
+        run = {'status': '200 OK', 'load': 0.5, 'first_request': 0.1, 'second_request': 0.01, 'cold_start': 0.6}
+        process = subprocess.CompletedProcess([], 0, stdout=json.dumps(run) + '\n', stderr='')
+        out = StringIO()
+        with mock.patch('simplemooc.core.management.commands.measure_cold_start.subprocess.run', return_value=process):
+            call_command('measure_cold_start', '--runs=1', f'--output={output}', stdout=out)
+        self.assertIn('cold_start', out.getvalue())
+        with open(output) as file:
+            self.assertEqual(json.load(file)['cold_start'], 0.6)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_LAG_CHECK_SECONDS=0)
+class ReplicaRouterTestCase(TransactionTestCase):
+    """
+    Testa as decisões do roteador de réplicas (sem precisar de uma réplica de verdade).
+    TransactionTestCase porque dentro de uma transação o roteador sempre usa o primário
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_follow_the_view(self):
+        self.assertEqual(self.router.db_for_read(Course), 'default')
+        with use_replica('replica'):
+            self.assertEqual(self.router.db_for_read(Course), 'replica')
+            self.assertEqual(self.router.db_for_write(Course), 'default')
+            with primary():
+                self.assertEqual(self.router.db_for_read(Course), 'default')
+            # Dentro de uma transação, tudo vai para o primário
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Course), 'default')
+
+    def test_lagging_replica_is_skipped(self):
+        with mock.patch('simplemooc.core.routers.measure_lag', return_value=1):
+            self.assertEqual(choose_replica(), 'replica')
+        with mock.patch('simplemooc.core.routers.measure_lag', return_value=30):
+            self.assertIsNone(choose_replica())
+        with mock.patch('simplemooc.core.routers.measure_lag', return_value=None):
+            self.assertIsNone(choose_replica())
+            out = StringIO()
+            call_command('replica_status', stdout=out)
+            self.assertIn('replica: indisponível, fora de uso', out.getvalue())
+
+    def test_writes_make_session_sticky(self):
+        User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        Course.objects.create(name='Django', slug='django')
+        self.client.login(username='aluno', password='123')
+        with mock.patch('simplemooc.core.routers.choose_replica', return_value=None) as choose:
+            self.client.get(reverse('courses:index'))
+            self.assertEqual(choose.call_count, 1)
+            # Inscrição (grava no BD): as próximas leituras do usuário vão para o primário
+            self.client.get(reverse('courses:enrollments', args=['django']))
+            self.client.get(reverse('courses:index'))
+            self.assertEqual(choose.call_count, 1)
+        self.assertIn(STICKY_SESSION_KEY, self.client.session)
+
+
+@skipUnless('replica' in settings.DATABASES, 'Rode com SIMPLEMOOC_LOCAL_REPLICA=1 (dois SQLite)')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class LocalReplicaTestCase(TransactionTestCase):
+    """
+    Com dois BDs de verdade (sem replicação entre eles), o que é gravado no primário não aparece nas leituras
+    da réplica, a não ser para quem acabou de gravar
+    """
+    databases = {'default', 'replica'}
+
+    def test_read_your_writes(self):
+        User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.client.login(username='aluno', password='123')
+        Course.objects.create(name='Curso Novo', slug='curso-novo')
+        # Lido da réplica, que não tem o curso
+        self.assertNotContains(self.client.get(reverse('courses:index')), 'Curso Novo')
+        # Depois de gravar (inscrição), o usuário lê do primário
+        self.client.get(reverse('courses:enrollments', args=['curso-novo']))
+        self.assertContains(self.client.get(reverse('courses:index')), 'Curso Novo')
+
+
+def asgi_get(application, path):
+    """
+    Uma requisição GET à aplicação ASGI
+    :return: (status, corpo)
+    """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'http_version': '1.1',
+    }
+    return application(scope, receive, send), messages
+
+
+@skipUnless(WsgiToAsgi, 'asgiref não instalado')
+@override_settings(ALLOWED_HOSTS=['testserver'], DATABASE_REPLICAS=[])
+class AsgiTestCase(TransactionTestCase):
+    """
+    Testa a aplicação ASGI (Django 2.2 com o adaptador do asgiref)
+    """
+
+    def test_serves_the_site(self):
+        call, messages = asgi_get(get_asgi_application(), reverse('core:home'))
+        asyncio.run(call)
+        self.assertEqual(messages[0]['status'], 200)
+
+    def test_threaded_adapter(self):
+        """
+        Uma requisição pelo ThreadedWsgiToAsgi: cabeçalho, corpo cortado no Content-Length e fim da resposta
+        """
+        from .asgi import ThreadedWsgiToAsgi
+
+        def app(environ, start_response):
+            start_response('201 Created', [('Content-Type', 'text/plain'), ('Content-Length', '5')])
+            return [environ['PATH_INFO'].encode(), b'-resto']
+
+        call, messages = asgi_get(ThreadedWsgiToAsgi(app), '/aula')
+        asyncio.run(call)
+        self.assertEqual(messages[0]['status'], 201)
+        self.assertIn((b'content-type', b'text/plain'), messages[0]['headers'])
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), b'/aula')
+        self.assertEqual(messages[-1], {'type': 'http.response.body'})
+
+    def test_requests_run_in_parallel(self):
+        """
+        Cada requisição roda na sua thread: requisições lentas não esperam umas pelas outras
+        """
+        def slow(environ, start_response):
+            time.sleep(0.2)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [threading.current_thread().name.encode()]
+
+        application = get_asgi_application().__class__(slow)
+        calls = [asgi_get(application, '/') for i in range(4)]
+
+        async def main():
+            await asyncio.gather(*[call for call, messages in calls])
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual(len({messages[1]['body'] for call, messages in calls}), 4)
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    """
+    Testa as consultas em paralelo (core.concurrency).
+    TransactionTestCase porque dentro de uma transação tudo roda em sequência
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_gather_runs_at_the_same_time(self):
+        def slow(value):
+            time.sleep(0.2)
+            return value, threading.current_thread().name
+
+        start = time.perf_counter()
+        results = gather(lambda: slow(1), lambda: slow(2), lambda: slow(3))
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual([value for value, thread in results], [1, 2, 3])
+        self.assertEqual(len({thread for value, thread in results}), 3)
+
+    def test_gather_is_serial_inside_transactions(self):
+        with transaction.atomic():
+            threads = gather(lambda: threading.current_thread(), lambda: threading.current_thread())
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+
+    def test_gather_raises_and_keeps_the_replica(self):
+        def fail():
+            raise ValueError('erro')
+
+        with self.assertRaisesMessage(ValueError, 'erro'):
+            gather(lambda: 1, fail)
+        with use_replica('replica'):
+            self.assertEqual(gather(current_replica, current_replica), ['replica', 'replica'])
+
+    def test_gather_keeps_execute_wrappers(self):
+        """
+        As consultas feitas nas threads do pool entram nas métricas da requisição
+        """
+        stats = RequestStats()
+        with connection.execute_wrapper(stats):
+            gather(Course.objects.count, Course.objects.count, Course.objects.count)
+        self.assertEqual(stats.queries, 3)
+
+    # Sem réplicas: com SIMPLEMOOC_LOCAL_REPLICA=1 as páginas leriam da réplica, que não tem os dados do teste
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_dashboard_with_cold_caches(self):
+        user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        course = Course.objects.create(name='Django', slug='django')
+        Enrollment.objects.create(user=user, course=course, status=Enrollment.STATUS_APPROVED)
+        self.client.login(username='aluno', password='123')
+        for name in ['courses:lessons', 'courses:announcements']:
+            cache.clear()
+            response = self.client.get(reverse(name, args=['django']))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['course'], course)
+            # Menu do painel, carregado junto com a lista da página
+            self.assertContains(response, 'Nenhum curso encontrado', count=0)
+            self.assertContains(response, '<i class="fa fa-book"></i>')
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('courses:lessons', args=['nenhum'])).status_code, 404)
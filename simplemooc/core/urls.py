@@ -8,4 +8,5 @@ app_name = 'core'
 urlpatterns = [
     path('', views.home, name='home'),
     path('contato/', views.contact, name='contact'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
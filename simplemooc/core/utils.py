@@ -1,6 +1,8 @@
 import hashlib
+import itertools
 import string
 import random
+import threading
 
 
 def random_key(size: int = 5):
@@ -27,3 +29,37 @@ def generate_hash_key(salt, size: int = 5):
     text = random_str + salt
     # Gera o hash
     return hashlib.sha224(text.encode('utf-8')).hexdigest()
+
+
+def chunked(iterable, size: int):
+    """
+    Divide qualquer iterável em listas de no máximo size itens, sem carregar tudo em memória
+    :param iterable: Iterável a ser dividido (lista, gerador, queryset.iterator(), ...)
+    :param size: Tamanho máximo de cada lote
+    :return: Gerador de listas
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_in_background(name, func, *args, **kwargs):
+    """
+    Executa a função numa thread separada, fora da requisição
+    A thread abre a sua própria conexão com o BD, que é fechada ao terminar
+    :param name: Nome da thread (aparece nos logs)
+    """
+    from django.db import connection
+
+    def run():
+        try:
+            func(*args, **kwargs)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
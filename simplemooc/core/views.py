@@ -1,9 +1,32 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
 
+from .cache import cache_anonymous_page
+from .metrics import collect, render_prometheus
 
+
+@cache_anonymous_page()
 def home(request):
     return render(request, 'core/home.html')
 
 
+@cache_anonymous_page()
 def contact(request):
     return render(request, 'core/contact.html')
+
+
+def metrics(request):
+    """
+    Métricas no formato do Prometheus. Só para a equipe (staff) ou com o token de METRICS_TOKEN:
+        Authorization: Bearer <token>
+    """
+    token = request.META.get('HTTP_AUTHORIZATION', '')[len('Bearer '):]
+    allowed = request.user.is_staff or (
+        settings.METRICS_TOKEN and constant_time_compare(token, settings.METRICS_TOKEN)
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_prometheus(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
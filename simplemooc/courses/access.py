@@ -0,0 +1,156 @@
+"""
+Mapa de acesso aos cursos, guardado no cache compartilhado.
+
+Para cada usuário: slug do curso -> (id do curso, situação da inscrição). Com o mapa no cache,
+verificar se o aluno pode acessar um curso não custa nenhuma consulta ao BD.
+O mapa é invalidado pelos signals de Enrollment (save/delete) e todos os mapas e cursos guardados
+deixam de valer quando qualquer curso é salvo ou apagado (o slug pode ter mudado).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+from simplemooc.core.cache import get_tag_versions, invalidate_tags
+from simplemooc.core.routers import primary
+
+# Tag (do core.cache) cuja versão é a geração atual dos mapas
+GENERATION_TAG = 'course-access'
+# Nome do trecho do menu do painel na tag {% cache %} (accounts/dashboard.html)
+DASHBOARD_MENU_FRAGMENT = 'dashboard_menu'
+
+
+def get_generation():
+    """
+    Geração atual dos mapas. Muda sempre que um curso é alterado
+    """
+    return get_tag_versions([GENERATION_TAG])[GENERATION_TAG]
+
+
+def enrollments_tag(user_id):
+    """
+    Tag (do core.cache) das inscrições do usuário. Muda junto com o mapa de acesso dele
+    """
+    return f'enrollments:{user_id}'
+
+
+def get_enrollment_version(user_id):
+    """
+    Versão das inscrições do usuário, para chaves de cache (ex.: o menu do painel).
+    Muda quando as inscrições do usuário mudam ou quando qualquer curso é alterado
+    """
+    versions = get_tag_versions([GENERATION_TAG, enrollments_tag(user_id)])
+    return f'{versions[GENERATION_TAG]}.{versions[enrollments_tag(user_id)]}'
+
+
+def dashboard_menu_version(user_id, course=None):
+    """
+    Parte variável da chave do menu do painel ({% cache ... dashboard_menu menu_version %} em accounts/dashboard.html):
+    o usuário, as inscrições dele e o curso da página, se houver
+    """
+    version = f'{user_id}:{get_enrollment_version(user_id)}'
+    if course:
+        version = f'{version}:{course.pk}:{course.updated_at.isoformat()}'
+    return version
+
+
+def dashboard_menu_key(user_id, course=None):
+    """
+    Chave do menu do painel no cache de trechos, a mesma montada pela tag {% cache %} do template
+    """
+    return make_template_fragment_key(DASHBOARD_MENU_FRAGMENT, [dashboard_menu_version(user_id, course)])
+
+
+def access_key(user_id, generation):
+    return f'courses:access:{generation}:{user_id}'
+
+
+def course_key(course_id, generation):
+    return f'courses:course:{generation}:{course_id}'
+
+
+def get_cached_access_map(user):
+    """
+    Mapa de acesso do usuário, se já estiver no cache (senão, None)
+    """
+    return cache.get(access_key(user.pk, get_generation()))
+
+
+def get_access_map(user):
+    """
+    Mapa slug -> (id do curso, situação) das inscrições do usuário.
+    Se não estiver no cache, é montado com uma única consulta
+    """
+    from .models import Enrollment
+
+    key = access_key(user.pk, get_generation())
+    access = cache.get(key)
+    if access is None:
+        # O que vai para o cache é lido do primário (uma réplica atrasada deixaria o mapa velho no cache)
+        with primary():
+            access = {
+                slug: (course_id, status)
+                for slug, course_id, status in Enrollment.objects.filter(user=user).values_list(
+                    'course__slug', 'course_id', 'status'
+                )
+            }
+        cache.set(key, access, settings.ACCESS_MAP_TIMEOUT)
+
+    return access
+
+
+def get_course(course_id):
+    """
+    Curso pelo id, guardado no cache junto com os mapas de acesso
+    """
+    from .models import Course
+
+    key = course_key(course_id, get_generation())
+    course = cache.get(key)
+    if course is None:
+        with primary():
+            course = Course.objects.get(pk=course_id)
+        cache.set(key, course, settings.ACCESS_MAP_TIMEOUT)
+
+    return course
+
+
+def get_course_by_slug(slug):
+    """
+    Curso pelo slug (lido do primário e guardado no cache como em get_course), ou None se não existir
+    """
+    from .models import Course
+
+    with primary():
+        course = Course.objects.filter(slug=slug).order_by().first()
+    if course is not None:
+        cache.set(course_key(course.pk, get_generation()), course, settings.ACCESS_MAP_TIMEOUT)
+
+    return course
+
+
+def invalidate_access(*user_ids):
+    """
+    Apaga o mapa de acesso dos usuários informados (e troca a versão das suas inscrições)
+    """
+    generation = get_generation()
+    cache.delete_many([access_key(user_id, generation) for user_id in user_ids])
+    invalidate_tags(*[enrollments_tag(user_id) for user_id in user_ids])
+
+
+def invalidate_all_access():
+    """
+    Invalida todos os mapas de acesso e cursos guardados, trocando a geração
+    """
+    invalidate_tags(GENERATION_TAG)
+
+
+def invalidate_on_commit(func, *args):
+    """
+    Executa a invalidação agora e de novo depois do commit da transação em andamento.
+    Agora, para que a própria transação não leia o mapa antigo. Depois do commit, porque até lá outra requisição
+    pode montar o mapa a partir dos dados ainda não confirmados e guardá-lo por ACCESS_MAP_TIMEOUT
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
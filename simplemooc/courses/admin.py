@@ -1,18 +1,94 @@
-from django.contrib import admin
+import io
 
+from django import forms
+from django.contrib import admin, messages
+from django.template.response import TemplateResponse
+
+from simplemooc.core.admin import LargeTableAdmin
+from .imports import read_identifiers
 from .models import Course, Enrollment, Announcement, Comment, Lesson, Material
 
 
+class ImportEnrollmentsForm(forms.Form):
+    file = forms.FileField(label='Arquivo (CSV ou JSONL)')
+
+
+def import_enrollments(modeladmin, request, queryset):
+    """
+    Ação do admin: importa inscrições de um arquivo (nomes de usuário ou emails) para o curso selecionado
+    """
+    if queryset.count() != 1:
+        modeladmin.message_user(request, 'Selecione apenas um curso para importar as inscrições', messages.ERROR)
+        return None
+
+    course = queryset.get()
+    form = ImportEnrollmentsForm(request.POST if 'import' in request.POST else None, request.FILES or None)
+    if form.is_valid():
+        upload = form.cleaned_data['file']
+        file_format = 'jsonl' if upload.name.endswith('.jsonl') else 'csv'
+        lines = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        totals = Enrollment.objects.bulk_enroll(course, read_identifiers(lines, file_format))
+        modeladmin.message_user(
+            request,
+            f"{course}: {totals['created']} inscritos, {totals['existing']} já estavam inscritos, "
+            f"{totals['not_found']} não encontrados"
+        )
+        return None
+
+    return TemplateResponse(request, 'admin/courses/import_enrollments.html', {
+        **modeladmin.admin_site.each_context(request),
+        'title': f'Importar inscrições: {course}',
+        'course': course,
+        'form': form,
+        'action': 'import_enrollments',
+        'opts': modeladmin.model._meta,
+    })
+
+
+import_enrollments.short_description = 'Importar inscrições de um arquivo'
+
+
 class CourseAdmin(admin.ModelAdmin):
     """
     Personaliza a amostragem do Model no Admin
     """
-    # Campos a serem mostrados na listagem
-    list_display = ['name', 'slug', 'start_date', 'created_at']
+    # Campos a serem mostrados na listagem. Os totais vêm de CourseStats, lidos junto com os cursos (JOIN)
+    list_display = [
+        'name', 'slug', 'start_date', 'seats', 'students', 'waitlist', 'lessons', 'announcements', 'comments',
+        'created_at'
+    ]
+    list_select_related = ['stats']
     # Campos em que o Admin fará a busca no campo de busca
     search_fields = ['name', 'slug']
     # Campos vinculados a outros. Exemplo: o Slug deve ser preenchido automaticamente baseado no nome
     prepopulated_fields = {'slug': ['name']}
+    # Ações em massa
+    actions = [import_enrollments]
+
+    def students(self, obj):
+        return obj.get_stats().approved
+
+    students.short_description = 'Alunos'
+
+    def waitlist(self, obj):
+        return obj.get_stats().waitlist
+
+    waitlist.short_description = 'Lista de Espera'
+
+    def lessons(self, obj):
+        return obj.get_stats().lessons
+
+    lessons.short_description = 'Aulas'
+
+    def announcements(self, obj):
+        return obj.get_stats().announcements
+
+    announcements.short_description = 'Anúncios'
+
+    def comments(self, obj):
+        return obj.get_stats().comments
+
+    comments.short_description = 'Comentários'
 
 
 class MaterialInlineAdmin(admin.StackedInline):
@@ -23,15 +99,49 @@ class MaterialInlineAdmin(admin.StackedInline):
     model = Material
 
 
-class LessonAdmin(admin.ModelAdmin):
+class LessonAdmin(LargeTableAdmin):
     list_display = ['name', 'number', 'course', 'release_date']
-    search_fields = ['name', 'description']
-    # Filtro lateral
+    # O curso de cada linha vem na mesma consulta (JOIN), em vez de uma consulta por linha
+    list_select_related = ['course']
+    # Busca pelo início do nome (LIKE '...%', índice courses_lesson_name_idx)
+    search_fields = ['^name']
+    # Filtro lateral (índice courses_lesson_created_idx)
     list_filter = ['created_at']
+    # Busca o curso pelo nome (ajax), em vez de um <select> com todos os cursos
+    autocomplete_fields = ['course']
     # Embutindo o cadastro de materiais dentro de aulas
     inlines = [MaterialInlineAdmin]
 
 
+class EnrollmentAdmin(LargeTableAdmin):
+    list_display = ['pk', 'user', 'course', 'status', 'created_at']
+    list_select_related = ['user', 'course']
+    # Índice courses_enroll_by_status_idx (situação + id)
+    list_filter = ['status']
+    # Busca exata pelo nome de usuário (índice único), em vez de LIKE '%...%' em milhões de linhas
+    search_fields = ['=user__username']
+    # Usuários: só o id (milhões de linhas). Cursos: busca pelo nome
+    raw_id_fields = ['user']
+    autocomplete_fields = ['course']
+
+
+class AnnouncementAdmin(LargeTableAdmin):
+    list_display = ['title', 'course', 'comments_count', 'created_at']
+    list_select_related = ['course']
+    # Busca pelo início do título (LIKE '...%', índice courses_announce_title_idx)
+    search_fields = ['^title']
+    autocomplete_fields = ['course']
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ['pk', 'user', 'announcement', 'created_at']
+    list_select_related = ['user', 'announcement']
+    search_fields = ['=user__username']
+    raw_id_fields = ['user', 'announcement']
+
+
 admin.site.register(Course, CourseAdmin)
-admin.site.register([Enrollment, Announcement, Comment])
+admin.site.register(Enrollment, EnrollmentAdmin)
+admin.site.register(Announcement, AnnouncementAdmin)
+admin.site.register(Comment, CommentAdmin)
 admin.site.register(Lesson, LessonAdmin)
@@ -1,35 +1,54 @@
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
+from django.http import Http404
 
+from simplemooc.core.concurrency import gather
 from .models import Course, Enrollment
+from .access import get_access_map, get_cached_access_map, get_course, get_course_by_slug
 
 
 def enrollment_required(view_func):
     """
     Decorador para pegar o curso de uma inscrição
+    A verificação usa o mapa de acesso do usuário (no cache), então não faz consultas ao BD quando o mapa já existe.
+    Quando não existe, o mapa e o curso são consultados ao mesmo tempo (core.concurrency)
     """
 
-    def get_course(request, *args, **kwargs):
+    def get_course_from_enrollment(request, *args, **kwargs):
         message = ''
         slug = kwargs.get('course_slug')
-        # Pega o curso
-        course = get_object_or_404(Course, slug=slug)
+        course = None
         # Tem permissão administrativa?
         has_permission = request.user.is_staff
+        if has_permission:
+            # Pega o curso
+            course = get_object_or_404(Course, slug=slug)
+
         # Se não tem permissão administrativa, primeiro verifica se está inscrito ao curso
-        if not has_permission:
-            try:
-                # Tenta pegar a inscrição
-                enrollment = Enrollment.objects.get(user=request.user, course=course)
+        else:
+            access_map = get_cached_access_map(request.user)
+            # Sem o mapa no cache: as duas consultas são independentes, então o mapa é montado e o curso é
+            # procurado pelo slug ao mesmo tempo
+            found = False  # False: o curso não foi procurado
+            if access_map is None:
+                access_map, found = gather(lambda: get_access_map(request.user), lambda: get_course_by_slug(slug))
+            access = access_map.get(slug)
 
             # Inscrição inexistente
-            except Enrollment.DoesNotExist:
+            if access is None:
+                # Se nem o curso existe, 404
+                if found is None or (found is False and not Course.objects.filter(slug=slug).exists()):
+                    raise Http404('Curso não encontrado')
                 message = 'Desculpe, mas você não se inscreveu nesse curso.'
 
             else:
+                course_id, status = access
                 # Está aprovado ao curso?
-                if enrollment.is_approved():
+                if status == Enrollment.STATUS_APPROVED:
                     has_permission = True
+                    course = found or get_course(course_id)
+                elif status == Enrollment.STATUS_WAITLIST:
+                    message = 'Você está na lista de espera deste curso.'
                 else:
                     message = 'A sua inscrição ainda está pendente'
 
@@ -42,4 +61,4 @@ def enrollment_required(view_func):
         request.course = course
         return view_func(request, *args, **kwargs)
 
-    return get_course
+    return get_course_from_enrollment
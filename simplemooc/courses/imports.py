@@ -0,0 +1,49 @@
+"""
+Leitura dos arquivos de importação de inscrições
+"""
+import csv
+import itertools
+import json
+
+# Colunas (CSV) ou chaves (JSONL) aceitas para identificar o usuário
+IDENTIFIER_FIELDS = ('username', 'email')
+
+
+def read_identifiers(lines, file_format):
+    """
+    Lê nomes de usuário ou emails de um arquivo, linha a linha (sem carregar o arquivo inteiro)
+
+    CSV: uma coluna "username" ou "email" no cabeçalho; sem cabeçalho, usa a primeira coluna
+    JSONL: cada linha é um texto ("fulano") ou um objeto ({"email": "fulano@exemplo.com"})
+
+    :param lines: Iterável de linhas de texto (um arquivo aberto em modo texto, por exemplo)
+    :param file_format: 'csv' ou 'jsonl'
+    :return: Gerador de identificadores
+    """
+    if file_format == 'jsonl':
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            value = json.loads(line)
+            if isinstance(value, dict):
+                value = next((value[field] for field in IDENTIFIER_FIELDS if value.get(field)), '')
+            if value:
+                yield str(value).strip()
+        return
+
+    rows = csv.reader(lines)
+    header = next(rows, None)
+    if header is None:
+        return
+    normalized = [column.strip().lower() for column in header]
+    column = next((normalized.index(field) for field in IDENTIFIER_FIELDS if field in normalized), None)
+    if column is None:
+        # Sem cabeçalho: a primeira linha já é um usuário
+        column = 0
+        rows = itertools.chain([header], rows)
+
+    for row in rows:
+        if len(row) > column and row[column].strip():
+            yield row[column].strip()
+
@@ -0,0 +1,91 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from simplemooc.core.utils import chunked
+from simplemooc.courses.models import Course, SearchTerm
+
+# Vocabulário para gerar o catálogo sintético
+WORDS = [
+    'programação', 'python', 'django', 'introdução', 'avançado', 'dados', 'análise', 'web', 'desenvolvimento',
+    'banco', 'segurança', 'redes', 'matemática', 'estatística', 'gestão', 'projetos', 'inglês', 'espanhol',
+    'música', 'fotografia', 'design', 'gráfico', 'marketing', 'digital', 'finanças', 'economia', 'física',
+    'química', 'biologia', 'história', 'geografia', 'filosofia', 'literatura', 'redação', 'lógica', 'algoritmos',
+    'estruturas', 'javascript', 'mobile', 'nuvem', 'inteligência', 'artificial', 'aprendizado', 'máquina',
+    'empreendedorismo', 'liderança', 'comunicação', 'negociação', 'vendas', 'contabilidade', 'direito',
+]
+
+# Vocabulário de preenchimento das descrições. Palavras sintéticas, para que cada termo de WORDS
+# apareça só numa parte pequena do catálogo, como num catálogo real
+FILLER = [f'termo{i}' for i in range(5000)]
+
+QUERIES = ['python', 'programação', 'Programacao Python', 'análise de dados', 'inteligencia artificial', 'xadrez']
+
+
+class Command(BaseCommand):
+    """
+    Compara a busca pelo índice invertido com a busca antiga (icontains) num catálogo sintético.
+    Tudo é feito dentro de uma transação desfeita ao final, então o BD não é alterado
+    """
+    help = 'Benchmark da busca de cursos: índice invertido x icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help='Tamanho do catálogo sintético')
+        parser.add_argument('--repeat', type=int, default=10, help='Repetições de cada busca')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            self.populate(options['courses'])
+            self.stdout.write(f"{'busca':<28}{'icontains (ms)':>16}{'índice (ms)':>14}{'resultados':>12}")
+            for query in QUERIES:
+                legacy = self.measure(lambda: self.legacy_search(query), options['repeat'])
+                indexed = self.measure(lambda: self.indexed_search(query), options['repeat'])
+                total = Course.objects.search(query).count()
+                self.stdout.write(f'{query:<28}{legacy:>16.2f}{indexed:>14.2f}{total:>12}')
+            # Desfaz o catálogo sintético
+            transaction.set_rollback(True)
+
+    def populate(self, total):
+        start = time.monotonic()
+        courses = (
+            Course(
+                name=' '.join(random.choices(WORDS, k=3)).capitalize(),
+                slug=f'curso-sintetico-{i}',
+                description=' '.join(random.choices(FILLER, k=38) + random.choices(WORDS, k=2)),
+            )
+            for i in range(total)
+        )
+        for batch in chunked(courses, 1000):
+            Course.objects.bulk_create(batch)
+        SearchTerm.objects.rebuild()
+        self.stdout.write(f'{total} cursos gerados e indexados em {time.monotonic() - start:.1f}s')
+
+    @staticmethod
+    def legacy_search(query):
+        """
+        A busca como era feita antes do índice (LIKE '%query%' nos dois campos)
+        """
+        queryset = Course.objects.filter(models.Q(name__icontains=query) | models.Q(description__icontains=query))
+        return queryset.count(), list(queryset[:20])
+
+    @staticmethod
+    def indexed_search(query):
+        queryset = Course.objects.search(query)
+        return queryset.count(), list(queryset[:20])
+
+    @staticmethod
+    def measure(func, repeat):
+        """
+        Mediana do tempo (em ms) de repeat execuções
+        """
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
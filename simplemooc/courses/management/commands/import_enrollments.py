@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simplemooc.courses.imports import read_identifiers
+from simplemooc.courses.models import Course, Enrollment
+
+
+class Command(BaseCommand):
+    """
+    Inscreve em massa os usuários de um arquivo CSV ou JSONL (nomes de usuário ou emails) em um curso
+    Exemplo:
+        python manage.py import_enrollments django alunos.csv
+    """
+    help = 'Importa inscrições de um arquivo CSV ou JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_slug', help='Slug do curso')
+        parser.add_argument('path', help='Arquivo com os usuários')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Padrão: pela extensão do arquivo')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Usuários por lote')
+
+    def handle(self, *args, **options):
+        try:
+            course = Course.objects.get(slug=options['course_slug'])
+        except Course.DoesNotExist:
+            raise CommandError(f"Curso não encontrado: {options['course_slug']}")
+
+        file_format = options['format'] or ('jsonl' if options['path'].endswith('.jsonl') else 'csv')
+        start = time.monotonic()
+
+        def progress(totals):
+            elapsed = time.monotonic() - start
+            rate = totals['read'] / elapsed if elapsed else 0
+            self.stdout.write(f"{totals['read']} lidos, {totals['created']} inscritos ({rate:.0f}/s)")
+
+        with open(options['path'], encoding='utf-8', newline='') as file:
+            totals = Enrollment.objects.bulk_enroll(
+                course, read_identifiers(file, file_format), options['batch_size'], progress
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['created']} inscritos, {totals['existing']} já estavam inscritos, "
+            f"{totals['not_found']} não encontrados em {time.monotonic() - start:.1f}s"
+        ))
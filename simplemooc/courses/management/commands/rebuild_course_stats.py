@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simplemooc.courses.models import CourseStats
+
+
+class Command(BaseCommand):
+    """
+    Confere os totais dos cursos (CourseStats) com as tabelas e corrige os que estiverem errados.
+    Normalmente não é necessário, já que os totais são mantidos pelos signals, mas é útil depois de cargas em massa
+    (bulk_create e update() não disparam signals) ou de alterações feitas direto no BD
+    """
+    help = 'Refaz os totais de inscrições, anúncios, comentários e aulas dos cursos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Cursos por lote')
+        parser.add_argument('--course', type=int, action='append', help='Apenas o curso com esse id (pode repetir)')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        checked, fixed = CourseStats.objects.rebuild(options['course'], options['batch_size'])
+        self.stdout.write(f'{checked} cursos verificados, {fixed} corrigidos em {time.monotonic() - start:.1f}s')
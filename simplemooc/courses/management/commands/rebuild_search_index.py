@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simplemooc.courses.models import SearchTerm
+
+
+class Command(BaseCommand):
+    """
+    Reconstrói todo o índice de busca. Normalmente não é necessário, já que o índice é mantido pelos signals
+    de Course e Lesson, mas é útil depois de cargas em massa (bulk_create não dispara signals)
+    """
+    help = 'Reconstrói o índice de busca de cursos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Cursos indexados por lote')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        total = SearchTerm.objects.rebuild(options['batch_size'])
+        self.stdout.write(f'{total} cursos indexados em {time.monotonic() - start:.1f}s')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from simplemooc.core.cache import invalidate_tags
+from simplemooc.courses.models import Lesson
+from simplemooc.courses.releases import get_calendar, invalidate_calendar
+
+
+class Command(BaseCommand):
+    """
+    Virada do dia do calendário de liberação das aulas.
+    Deve ser agendado para a meia-noite do TIME_ZONE do projeto (America/Sao_Paulo). Exemplo no cron:
+        0 0 * * * TZ=America/Sao_Paulo python manage.py rollover_lessons
+    Só os cursos com aulas liberadas no dia são refeitos. Os demais viram o dia sozinhos, em memória,
+    na primeira consulta
+    """
+    help = 'Libera as aulas do dia no calendário de liberação'
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        course_ids = list(
+            Lesson.objects.filter(release_date=today).values_list('course_id', flat=True).distinct()
+        )
+        invalidate_calendar(*course_ids)
+        for course_id in course_ids:
+            # Já deixa o calendário novo no cache
+            get_calendar(course_id)
+        # As páginas desses cursos no cache de páginas também mudaram
+        invalidate_tags(*[f'course:{course_id}' for course_id in course_ids])
+        self.stdout.write(f'{today:%d/%m/%Y}: {len(course_ids)} cursos com aulas liberadas hoje')
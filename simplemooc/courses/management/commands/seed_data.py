@@ -0,0 +1,192 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from simplemooc.core.cache import invalidate_tags
+from simplemooc.core.utils import chunked
+from simplemooc.courses.access import invalidate_all_access
+from simplemooc.courses.models import (
+    Course, CourseStats, Lesson, Material, Enrollment, Announcement, Comment, SearchTerm
+)
+from simplemooc.courses.progress import to_bytes
+
+from .benchmark_search import WORDS
+
+User = get_user_model()
+
+
+def skewed_weights(total, skew):
+    """
+    Pesos no formato de Zipf: o primeiro curso é o maior, e os demais caem rapidamente (como num catálogo real)
+    """
+    return [1 / (i + 1) ** skew for i in range(total)]
+
+
+def distribute(total, weights, cap=None):
+    """
+    Divide total proporcionalmente aos pesos, limitando cada parte a cap
+    """
+    weight_sum = sum(weights)
+    return [min(round(total * weight / weight_sum), cap if cap is not None else total) for weight in weights]
+
+
+class Command(BaseCommand):
+    """
+    Gera uma massa de dados sintética para testes de desempenho, com poucos cursos enormes e muitos pequenos.
+    Tudo é gravado com bulk_create (sem signals) e, ao final, o índice de busca e os caches são refeitos.
+    Usuários e cursos gerados começam com o prefixo informado, e --clear apaga os de uma geração anterior.
+    Todos os usuários gerados têm a senha 'senha123'
+    """
+    help = 'Gera usuários, cursos, aulas, materiais, inscrições, anúncios e comentários sintéticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--courses', type=int, default=50)
+        parser.add_argument('--lessons', type=int, default=20, help='Aulas por curso')
+        parser.add_argument('--materials', type=int, default=2, help='Materiais por aula')
+        parser.add_argument('--enrollments', type=int, default=20000, help='Total de inscrições')
+        parser.add_argument('--announcements', type=int, default=5, help='Anúncios por curso')
+        parser.add_argument('--comments', type=int, default=20000, help='Total de comentários')
+        parser.add_argument('--skew', type=float, default=1.2, help='Concentração nos maiores cursos (Zipf)')
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true', help='Apaga antes os dados gerados com o mesmo prefixo')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.prefix = options['prefix']
+        start = time.monotonic()
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            users = self.create_users(options['users'])
+            courses = self.create_courses(options['courses'])
+            weights = skewed_weights(len(courses), options['skew'])
+            lessons = self.create_lessons(courses, options['lessons'])
+            self.create_materials(lessons, options['materials'])
+            self.create_enrollments(
+                courses, users, distribute(options['enrollments'], weights, len(users)), options['lessons']
+            )
+            announcements = self.create_announcements(courses, options['announcements'])
+            self.create_comments(courses, announcements, users, distribute(options['comments'], weights))
+
+        # Sem signals, o índice de busca, os totais dos cursos e os caches são refeitos aqui
+        SearchTerm.objects.rebuild()
+        CourseStats.objects.rebuild()
+        invalidate_all_access()
+        invalidate_tags('catalog', 'search')
+        self.stdout.write(f'Dados gerados em {time.monotonic() - start:.1f}s')
+
+    def clear(self):
+        Course.objects.filter(slug__startswith=f'{self.prefix}-').delete()
+        User.objects.filter(username__startswith=f'{self.prefix}-').delete()
+
+    def bulk_create(self, model, objects):
+        total = 0
+        for batch in chunked(objects, 1000):
+            model.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write(f'{total} {model._meta.verbose_name_plural}')
+
+    def create_users(self, total):
+        # O hash da senha é calculado uma vez só
+        password = make_password('senha123')
+        self.bulk_create(User, (
+            User(username=f'{self.prefix}-aluno{i}', email=f'{self.prefix}-aluno{i}@exemplo.com', password=password)
+            for i in range(total)
+        ))
+        return list(User.objects.filter(username__startswith=f'{self.prefix}-').values_list('pk', flat=True))
+
+    def create_courses(self, total):
+        today = timezone.localdate()
+        self.bulk_create(Course, (
+            Course(
+                name=' '.join(random.choices(WORDS, k=3)).capitalize(),
+                slug=f'{self.prefix}-curso-{i}',
+                description=' '.join(random.choices(WORDS, k=30)),
+                about=' '.join(random.choices(WORDS, k=80)),
+                start_date=today + timedelta(days=random.randint(-90, 30)),
+            )
+            for i in range(total)
+        ))
+        # Na ordem da geração: o primeiro é o maior
+        courses = Course.objects.filter(slug__startswith=f'{self.prefix}-').only('pk', 'slug', 'start_date')
+        return sorted(courses, key=lambda course: int(course.slug.rsplit('-', 1)[1]))
+
+    def create_lessons(self, courses, per_course):
+        # Uma aula por semana a partir do início do curso: parte já liberada, parte ainda por liberar
+        self.bulk_create(Lesson, (
+            Lesson(
+                course_id=course.pk,
+                name=f'Aula {number}',
+                description=' '.join(random.choices(WORDS, k=20)),
+                number=number,
+                release_date=course.start_date + timedelta(weeks=number - 1),
+                progress_bit=number - 1,
+            )
+            for course in courses for number in range(1, per_course + 1)
+        ))
+        Course.objects.filter(pk__in=[course.pk for course in courses]).update(lesson_bits=per_course)
+        return list(Lesson.objects.filter(course__in=courses).values_list('pk', flat=True))
+
+    def create_materials(self, lessons, per_lesson):
+        self.bulk_create(Material, (
+            Material(
+                lesson_id=lesson_id,
+                name=f'Material {i + 1}',
+                embedded='<p>' + ' '.join(random.choices(WORDS, k=40)) + '</p>',
+            )
+            for lesson_id in lessons for i in range(per_lesson)
+        ))
+
+    def create_enrollments(self, courses, users, per_course, lessons):
+        # Cada aluno concluiu as primeiras aulas do curso (de nenhuma a todas)
+        self.bulk_create(Enrollment, (
+            Enrollment(
+                user_id=user_id,
+                course_id=course.pk,
+                status=Enrollment.STATUS_APPROVED,
+                progress=to_bytes((1 << random.randint(0, lessons)) - 1),
+            )
+            for course, total in zip(courses, per_course) for user_id in random.sample(users, total)
+        ))
+
+    def create_announcements(self, courses, per_course):
+        self.bulk_create(Announcement, (
+            Announcement(course_id=course.pk, title=f'Anúncio {i + 1}', content=' '.join(random.choices(WORDS, k=60)))
+            for course in courses for i in range(per_course)
+        ))
+        announcements = {}
+        for announcement in Announcement.objects.filter(course__in=courses).only('pk', 'course_id').order_by('pk'):
+            announcements.setdefault(announcement.course_id, []).append(announcement)
+        return announcements
+
+    def create_comments(self, courses, announcements, users, per_course):
+        # Os comentários de cada curso se concentram nos anúncios mais recentes
+        counts = {}
+        comments = []
+        for course, total in zip(courses, per_course):
+            course_announcements = announcements.get(course.pk)
+            if not course_announcements:
+                continue
+            weights = range(1, len(course_announcements) + 1)
+            for announcement in random.choices(course_announcements, weights=weights, k=total):
+                counts[announcement] = counts.get(announcement, 0) + 1
+                comments.append(Comment(
+                    announcement_id=announcement.pk,
+                    user_id=random.choice(users),
+                    comment=' '.join(random.choices(WORDS, k=15)),
+                ))
+        self.bulk_create(Comment, comments)
+
+        # comments_count (sem signals no bulk_create)
+        for announcement, total in counts.items():
+            announcement.comments_count = total
+        for batch in chunked(counts, 500):
+            Announcement.objects.bulk_update(batch, ['comments_count'])
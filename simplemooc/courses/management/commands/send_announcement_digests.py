@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from simplemooc.courses.models import send_announcement_digests
+
+
+class Command(BaseCommand):
+    """
+    Resumo diário dos anúncios, para os alunos que preferem um email por dia a um email por anúncio.
+    Agende uma vez por dia (ex.: cron: 0 7 * * * python manage.py send_announcement_digests).
+    Com MAIL_OUTBOX_ENABLED, os resumos entram na fila e são enviados pelo send_queued_mail
+    """
+    help = 'Envia a cada aluno um único email com os novos anúncios dos seus cursos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Alunos por lote (padrão: MAIL_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        result = send_announcement_digests(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"{result['students']} resumos com {result['announcements']} anúncios "
+            f"({result['renders']} renderizações) em {time.monotonic() - start:.1f}s"
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from simplemooc.courses.search import document_weights
+
+
+def build_search_index(apps, schema_editor):
+    """
+    Indexa os cursos já existentes
+    """
+    Course = apps.get_model('courses', 'Course')
+    SearchTerm = apps.get_model('courses', 'SearchTerm')
+    for course in Course.objects.prefetch_related('lessons'):
+        SearchTerm.objects.bulk_create([
+            SearchTerm(course=course, token=token, weight=weight)
+            for token, weight in document_weights(course, course.lessons.all()).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50, verbose_name='Termo')),
+                ('weight', models.FloatField(default=0, verbose_name='Peso')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='courses.Course', verbose_name='Curso')),
+            ],
+            options={
+                'verbose_name': 'Termo de Busca',
+                'verbose_name_plural': 'Termos de Busca',
+                'unique_together': {('token', 'course')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
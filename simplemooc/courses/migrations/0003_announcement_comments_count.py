@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+def count_comments(apps, schema_editor):
+    """
+    Preenche o total de comentários dos anúncios já existentes
+    """
+    Announcement = apps.get_model('courses', 'Announcement')
+    Comment = apps.get_model('courses', 'Comment')
+    totals = Comment.objects.values('announcement').annotate(total=models.Count('id')).values_list(
+        'announcement', 'total'
+    )
+    for announcement_id, total in totals:
+        Announcement.objects.filter(pk=announcement_id).update(comments_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0002_search_term'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='comments_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Comentários'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0003_announcement_comments_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='seats',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Vagas'),
+        ),
+        migrations.AlterField(
+            model_name='enrollment',
+            name='status',
+            field=models.IntegerField(blank=True, choices=[(0, 'Pendente'), (1, 'Aprovado'), (2, 'Cancelado'), (3, 'Lista de Espera')], default=0, verbose_name='Situação'),
+        ),
+        migrations.CreateModel(
+            name='SeatShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField(verbose_name='Número')),
+                ('capacity', models.IntegerField(default=0, verbose_name='Capacidade')),
+                ('taken', models.IntegerField(default=0, verbose_name='Ocupadas')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_shards', to='courses.Course', verbose_name='Curso')),
+            ],
+            options={
+                'verbose_name': 'Vagas',
+                'verbose_name_plural': 'Vagas',
+                'unique_together': {('course', 'number')},
+            },
+        ),
+    ]
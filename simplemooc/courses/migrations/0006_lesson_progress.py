@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+def assign_progress_bits(apps, schema_editor):
+    """
+    Dá um bit de progresso a cada aula já existente, na ordem das aulas de cada curso
+    """
+    Course = apps.get_model('courses', 'Course')
+    Lesson = apps.get_model('courses', 'Lesson')
+    for course in Course.objects.all():
+        lessons = list(Lesson.objects.filter(course=course).order_by('number', 'pk'))
+        for bit, lesson in enumerate(lessons):
+            lesson.progress_bit = bit
+        Lesson.objects.bulk_update(lessons, ['progress_bit'], batch_size=500)
+        Course.objects.filter(pk=course.pk).update(lesson_bits=len(lessons))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lesson_bits',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Bits de Progresso'),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='progress',
+            field=models.BinaryField(default=b'', verbose_name='Progresso'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='progress_bit',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Bit de Progresso'),
+        ),
+        migrations.RunPython(assign_progress_bits, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='lesson',
+            unique_together={('course', 'progress_bit')},
+        ),
+    ]
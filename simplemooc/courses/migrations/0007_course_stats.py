@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+STATUS_FIELDS = {0: 'pending', 1: 'approved', 2: 'canceled', 3: 'waitlist'}
+
+
+def count_stats(apps, schema_editor):
+    """
+    Preenche os totais dos cursos já existentes
+    """
+    Course = apps.get_model('courses', 'Course')
+    CourseStats = apps.get_model('courses', 'CourseStats')
+    Enrollment = apps.get_model('courses', 'Enrollment')
+    Announcement = apps.get_model('courses', 'Announcement')
+    Comment = apps.get_model('courses', 'Comment')
+    Lesson = apps.get_model('courses', 'Lesson')
+
+    totals = {course_id: {} for course_id in Course.objects.values_list('pk', flat=True)}
+    for course_id, status, total in Enrollment.objects.values_list('course', 'status').annotate(
+        total=models.Count('pk')
+    ).order_by():
+        totals[course_id][STATUS_FIELDS[status]] = total
+    for field, model, course_field in (
+        ('announcements', Announcement, 'course'),
+        ('comments', Comment, 'announcement__course'),
+        ('lessons', Lesson, 'course'),
+    ):
+        for course_id, total in model.objects.values_list(course_field).annotate(total=models.Count('pk')).order_by():
+            totals[course_id][field] = total
+
+    CourseStats.objects.bulk_create(
+        [CourseStats(course_id=course_id, **fields) for course_id, fields in totals.items()], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_lesson_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='courses.Course', verbose_name='Curso')),
+                ('pending', models.IntegerField(default=0, verbose_name='Pendentes')),
+                ('approved', models.IntegerField(default=0, verbose_name='Alunos')),
+                ('canceled', models.IntegerField(default=0, verbose_name='Cancelados')),
+                ('waitlist', models.IntegerField(default=0, verbose_name='Lista de Espera')),
+                ('announcements', models.IntegerField(default=0, verbose_name='Anúncios')),
+                ('comments', models.IntegerField(default=0, verbose_name='Comentários')),
+                ('lessons', models.IntegerField(default=0, verbose_name='Aulas')),
+            ],
+            options={
+                'verbose_name': 'Totais do Curso',
+                'verbose_name_plural': 'Totais dos Cursos',
+            },
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
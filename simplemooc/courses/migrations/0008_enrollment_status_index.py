@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_course_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['status'], name='courses_enroll_by_status_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:20
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+import simplemooc.core.files
+
+
+def move_materials(apps, schema_editor):
+    """
+    Move os arquivos dos materiais já enviados do MEDIA_ROOT (público) para o PROTECTED_MEDIA_ROOT
+    """
+    Material = apps.get_model('courses', 'Material')
+    names = Material.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True)
+    for name in names.iterator():
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        target = os.path.join(settings.PROTECTED_MEDIA_ROOT, name)
+        if os.path.exists(source) and not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_enrollment_status_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=simplemooc.core.files.ProtectedStorage(), upload_to='lessons/materials'),
+        ),
+        migrations.RunPython(move_materials, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,29 @@
-from django.db import models
+import logging
+import math
+import random
+import threading
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils import timezone
-from ..core.mail import send_mail_template
+from ..accounts.models import User
+from ..core.cache import invalidate_tags
+from ..core.files import protected_storage
+from ..core.images import generate_renditions
+from ..core.mail import render_mail_template, send_mass_mail_template, send_personal_mails
+from ..core.utils import chunked, run_in_background
+from .access import invalidate_access, invalidate_all_access, invalidate_on_commit
+from .progress import set_bit, has_bit, make_mask, count_bits, percent
+from .releases import released_lesson_ids, invalidate_calendar
+from .search import tokenize, document_weights
+
+logger = logging.getLogger(__name__)
+
+# Tentativas de gravar o progresso de uma aula quando outra requisição altera o mesmo progresso ao mesmo tempo
+PROGRESS_ATTEMPTS = 10
 
 
 class CourseManager(models.Manager):
@@ -12,15 +34,66 @@ class CourseManager(models.Manager):
 
     def search(self, query):
         """
-        Pesquisa dentro da tabela, pelo conteúdo do nome ou pelo conteudo da descrição
+        Pesquisa no índice de busca (SearchTerm), sem diferenciar acentos e maiúsculas.
+        Só retorna cursos que tenham todos os termos pesquisados, ordenados pela relevância.
+        A relevância de cada termo é o seu peso no curso multiplicado pelo quão raro ele é no catálogo (idf)
+        :return: CourseSearchResults, que pode ser paginado com o Paginator do Django
         """
-        return self.get_queryset().filter(
-            # Usando o models.Q é possível definir o tipo de pesquisa entre os campos
-            # | = OR
-            # & = AND
-            # [campo]__icontains = query
-            models.Q(name__icontains=query) | models.Q(description__icontains=query)
+        tokens = sorted(set(tokenize(query)))
+        if not tokens:
+            return CourseSearchResults(self.get_queryset(), SearchTerm.objects.none())
+
+        # Em quantos cursos cada termo aparece (uma consulta usando o índice de token)
+        frequencies = dict(
+            SearchTerm.objects.filter(token__in=tokens).values('token').annotate(
+                total=models.Count('course')
+            ).values_list('token', 'total')
         )
+        if len(frequencies) < len(tokens):
+            # Algum termo não existe no catálogo
+            return CourseSearchResults(self.get_queryset(), SearchTerm.objects.none())
+
+        total_courses = self.get_queryset().count()
+        score = models.Sum(models.Case(
+            *[
+                models.When(token=token, then=models.F('weight') * math.log(1 + total_courses / frequency))
+                for token, frequency in frequencies.items()
+            ],
+            output_field=models.FloatField()
+        ))
+        # A relevância é calculada só sobre o índice, sem JOIN com a tabela de cursos
+        ranking = SearchTerm.objects.filter(token__in=tokens).values('course').annotate(
+            matches=models.Count('token'),
+            score=score
+        ).filter(matches=len(tokens)).order_by('-score', 'course')
+        return CourseSearchResults(self.get_queryset(), ranking)
+
+
+class CourseSearchResults:
+    """
+    Resultado de uma busca. Ordenado pela relevância e fatiável, então pode ser usado com o Paginator.
+    Os cursos só são carregados para a fatia pedida (a página), numa única consulta por chave primária
+    """
+
+    def __init__(self, queryset, ranking):
+        self.queryset = queryset
+        self.ranking = ranking
+
+    def count(self):
+        return self.ranking.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = list(self.ranking[index].values_list('course', flat=True))
+            courses = self.queryset.in_bulk(ids)
+            return [courses[pk] for pk in ids if pk in courses]
+        return self[index:index + 1][0]
+
+    def __iter__(self):
+        return iter(self[:])
 
 
 class Course(models.Model):
@@ -65,6 +138,21 @@ class Course(models.Model):
         blank=True
     )
 
+    # Limite de vagas. Vazio = sem limite. Quem se inscreve com as vagas esgotadas vai para a lista de espera
+    seats = models.PositiveIntegerField(
+        'Vagas',
+        null=True,
+        blank=True
+    )
+
+    # Próximo bit de progresso a ser dado a uma aula nova (ver courses/progress.py). Bits de aulas apagadas
+    # não são reaproveitados
+    lesson_bits = models.PositiveIntegerField(
+        'Bits de Progresso',
+        default=0,
+        editable=False
+    )
+
     # Data/Hora que será preenchido automaticamente no INSERT
     created_at = models.DateTimeField(
         'Criado em',
@@ -95,13 +183,40 @@ class Course(models.Model):
         from django.urls import reverse
         return reverse('courses:details', args=[str(self.slug)])
 
+    def save(self, *args, **kwargs):
+        """
+        lesson_bits só é alterado no BD, por Lesson.save(). Uma instância carregada antes de aulas novas (ex.: no admin)
+        gravaria o contador antigo de volta, e as próximas aulas repetiriam bits. Por isso ele fica fora dos UPDATEs
+        """
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'lesson_bits' and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    def get_stats(self):
+        """
+        Totais do curso (CourseStats). Use select_related('stats') para ler junto com o curso
+        """
+        try:
+            return self.stats
+        except CourseStats.DoesNotExist:
+            return CourseStats(course=self)
+
+    def progress_mask(self):
+        """
+        Máscara com os bits de progresso das aulas do curso (para os percentuais de conclusão)
+        """
+        return make_mask(self.lessons.order_by().values_list('progress_bit', flat=True))
+
     def release_lessons(self):
         """
         Retorna todas as aulas deste curso que estão liberadAS
+        As aulas liberadas vêm do calendário de liberação (courses.releases), guardado no cache
         """
-        today = timezone.now().date()
-        # lte = menor ou igual a (https://docs.djangoproject.com/en/2.2/ref/models/querysets/)
-        return self.lessons.filter(release_date__lte=today)
+        return self.lessons.filter(pk__in=released_lesson_ids(self.pk))
 
     class Meta:
         """
@@ -145,6 +260,13 @@ class Lesson(models.Model):
         null=True
     )
 
+    # Posição da aula no progresso dos alunos (Enrollment.progress). Fixa, distribuída na criação
+    progress_bit = models.PositiveIntegerField(
+        'Bit de Progresso',
+        null=True,
+        editable=False
+    )
+
     # Data/Hora que será preenchido automaticamente no INSERT
     created_at = models.DateTimeField(
         'Criado em',
@@ -158,13 +280,24 @@ class Lesson(models.Model):
     )
 
     def is_available(self):
-        if self.release_date:
-            # pega o dia atual
-            today = timezone.now().date()
-            # retorna se o curso já foi liberado hoje
-            return today >= self.release_date
+        """
+        A aula já foi liberada? Consulta o calendário de liberação do curso (em memória)
+        """
+        return self.pk in released_lesson_ids(self.course_id)
 
-        return False
+    def save(self, *args, **kwargs):
+        """
+        Na criação, a aula recebe o próximo bit de progresso do curso. O contador é incrementado no próprio BD,
+        e a linha do curso fica travada até o fim da transação (duas aulas criadas ao mesmo tempo não recebem o mesmo bit)
+        """
+        if self.progress_bit is not None:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            courses = Course.objects.filter(pk=self.course_id)
+            courses.update(lesson_bits=models.F('lesson_bits') + 1)
+            self.progress_bit = courses.values_list('lesson_bits', flat=True).get() - 1
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -173,6 +306,91 @@ class Lesson(models.Model):
         verbose_name = 'Aula'
         verbose_name_plural = 'Aulas'
         ordering = ['number']
+        indexes = [
+            # Aulas do curso na ordem (course.lessons.all() e release_lessons())
+            models.Index(fields=['course', 'number'], name='courses_lesson_number_idx'),
+            # Calendário de liberação: datas das aulas do curso
+            models.Index(fields=['course', 'release_date'], name='courses_lesson_release_idx'),
+            # Admin: busca pelo início do nome e filtro por data de criação
+            models.Index(fields=['name'], name='courses_lesson_name_idx'),
+            models.Index(fields=['created_at'], name='courses_lesson_created_idx'),
+        ]
+        # Também serve de índice para a máscara de progresso do curso (Course.progress_mask)
+        unique_together = (('course', 'progress_bit'),)
+
+
+class SearchTermManager(models.Manager):
+    """
+    Mantém o índice invertido da busca de cursos
+    """
+
+    def index_course(self, course):
+        """
+        Refaz os termos de um curso (apaga os antigos e grava os novos de uma vez só)
+        """
+        weights = document_weights(course, course.lessons.all())
+        with transaction.atomic():
+            self.get_queryset().filter(course=course).delete()
+            self.bulk_create([
+                SearchTerm(course=course, token=token, weight=weight) for token, weight in weights.items()
+            ])
+
+    def rebuild(self, batch_size=1000):
+        """
+        Reconstrói o índice inteiro, em lotes de cursos
+        :return: Total de cursos indexados
+        """
+        total = 0
+        self.get_queryset().all().delete()
+        courses = Course.objects.order_by('pk').prefetch_related('lessons')
+        for batch in chunked(courses.iterator(chunk_size=batch_size), batch_size):
+            # prefetch_related não funciona com iterator(), então as aulas do lote são buscadas juntas
+            lessons = {}
+            for lesson in Lesson.objects.filter(course__in=batch):
+                lessons.setdefault(lesson.course_id, []).append(lesson)
+
+            terms = []
+            for course in batch:
+                weights = document_weights(course, lessons.get(course.pk, []))
+                terms += [SearchTerm(course=course, token=token, weight=weight) for token, weight in weights.items()]
+            # O tamanho máximo de cada INSERT fica por conta do Django (depende do BD)
+            for part in chunked(terms, batch_size):
+                self.bulk_create(part)
+            total += len(batch)
+
+        return total
+
+
+class SearchTerm(models.Model):
+    """
+    Índice invertido da busca: cada linha é um termo (já normalizado) de um curso, com o seu peso
+    """
+    course = models.ForeignKey(
+        Course,
+        verbose_name='Curso',
+        related_name='search_terms',
+        on_delete=models.CASCADE
+    )
+
+    token = models.CharField(
+        'Termo',
+        max_length=50
+    )
+
+    weight = models.FloatField(
+        'Peso',
+        default=0
+    )
+
+    objects = SearchTermManager()
+
+    def __str__(self):
+        return self.token
+
+    class Meta:
+        verbose_name = 'Termo de Busca'
+        verbose_name_plural = 'Termos de Busca'
+        unique_together = (('token', 'course'),)
 
 
 class Material(models.Model):
@@ -194,8 +412,10 @@ class Material(models.Model):
         null=True
     )
 
+    # Fora do MEDIA_ROOT: só é entregue pela view de download, para os inscritos
     file = models.FileField(
         upload_to='lessons/materials',
+        storage=protected_storage,
         blank=True,
         null=True
     )
@@ -227,16 +447,321 @@ class Material(models.Model):
         verbose_name_plural = 'Materiais'
 
 
+class SeatShardManager(models.Manager):
+    """
+    Controle de vagas dos cursos, dividido em várias linhas (shards).
+    Cada inscrição ocupa uma vaga de um shard escolhido ao acaso, com um UPDATE condicional
+    (só ocupa se ainda houver vaga naquele shard). Como a soma das capacidades dos shards é o total de vagas,
+    nunca se vende mais vagas do que existem, e as inscrições simultâneas se dividem entre as linhas
+    em vez de disputarem uma só
+    """
+
+    def take(self, course, count=1):
+        """
+        Ocupa até count vagas do curso
+        :return: Quantidade de vagas conseguidas (0 se esgotado)
+        """
+        shards = list(self.get_queryset().filter(course=course).values_list('pk', flat=True))
+        # Começa por um shard aleatório e, se estiver cheio, tenta os demais
+        start = random.randrange(len(shards)) if shards else 0
+        granted = 0
+        for pk in shards[start:] + shards[:start]:
+            wanted = count - granted
+            while wanted > 0:
+                if self.get_queryset().filter(pk=pk, taken__lte=models.F('capacity') - wanted).update(
+                    taken=models.F('taken') + wanted
+                ):
+                    granted += wanted
+                    break
+                # Não coube tudo neste shard: tenta só o que ainda resta nele
+                free = self.get_queryset().filter(pk=pk).values_list(
+                    models.F('capacity') - models.F('taken'), flat=True
+                ).first() or 0
+                wanted = min(wanted, free)
+            if granted == count:
+                break
+
+        return granted
+
+    def release(self, course, count=1):
+        """
+        Libera count vagas do curso
+        """
+        for pk in self.get_queryset().filter(course=course, taken__gt=0).values_list('pk', flat=True):
+            while count > 0:
+                if not self.get_queryset().filter(pk=pk, taken__gt=0).update(taken=models.F('taken') - 1):
+                    break
+                count -= 1
+            if not count:
+                return
+
+    def sync(self, course):
+        """
+        Redistribui as vagas livres entre os shards quando o limite de vagas do curso muda
+        """
+        with transaction.atomic():
+            shards = list(self.get_queryset().select_for_update().filter(course=course).order_by('number'))
+            if course.seats is None:
+                self.get_queryset().filter(course=course).delete()
+                return
+
+            if not shards:
+                # Vagas já ocupadas por quem se inscreveu antes do limite existir
+                taken = Enrollment.objects.filter(course=course, status=1).count()
+                self.bulk_create([
+                    SeatShard(course=course, number=number, taken=taken if number == 0 else 0)
+                    for number in range(settings.SEAT_SHARDS)
+                ])
+                shards = list(self.get_queryset().filter(course=course).order_by('number'))
+
+            free = max(course.seats - sum(shard.taken for shard in shards), 0)
+            for number, shard in enumerate(shards):
+                shard.capacity = shard.taken + free // len(shards) + (1 if number < free % len(shards) else 0)
+            self.bulk_update(shards, ['capacity'])
+
+
+class SeatShard(models.Model):
+    """
+    Parte do contador de vagas de um curso (ver SeatShardManager)
+    """
+    course = models.ForeignKey(
+        Course,
+        verbose_name='Curso',
+        related_name='seat_shards',
+        on_delete=models.CASCADE
+    )
+
+    number = models.IntegerField(
+        'Número'
+    )
+
+    capacity = models.IntegerField(
+        'Capacidade',
+        default=0
+    )
+
+    taken = models.IntegerField(
+        'Ocupadas',
+        default=0
+    )
+
+    objects = SeatShardManager()
+
+    class Meta:
+        verbose_name = 'Vagas'
+        verbose_name_plural = 'Vagas'
+        unique_together = (('course', 'number'),)
+
+
+class EnrollmentManager(models.Manager):
+    """
+    Gerenciador das inscrições
+    """
+
+    def dashboard(self, user):
+        """
+        Inscrições do usuário para o painel (menu e lista de cursos), com os cursos na mesma consulta (JOIN)
+        e só com os campos usados nos templates
+        """
+        return list(
+            self.filter(user=user).select_related('course').only(
+                'course', 'course__name', 'course__slug', 'course__start_date', 'course__description'
+            ).order_by('course__name')
+        )
+
+    def complete_lesson(self, user, lesson):
+        """
+        Marca a aula como concluída na inscrição (aprovada) do usuário, sem travas: lê o progresso e grava o novo
+        só se ele não mudou nesse meio tempo (compare-and-swap), lendo de novo se mudou.
+        Se a aula já estava concluída, não grava nada
+        :return: True se a aula foi marcada agora
+        """
+        if lesson.progress_bit is None:
+            # Aula ainda sem bit (não deveria acontecer: o bit é dado na criação)
+            return False
+
+        enrollments = self.filter(user=user, course_id=lesson.course_id, status=Enrollment.STATUS_APPROVED)
+        for attempt in range(PROGRESS_ATTEMPTS):
+            current = enrollments.values_list('pk', 'progress').first()
+            if current is None or has_bit(current[1], lesson.progress_bit):
+                return False
+            pk, progress = current
+            if self.filter(pk=pk, progress=progress).update(progress=set_bit(progress, lesson.progress_bit)):
+                return True
+
+        logger.warning('Progresso da aula %s não gravado para %s: muitas alterações simultâneas', lesson.pk, user)
+        return False
+
+    def course_progress(self, course, mask=None):
+        """
+        Conclusão das aulas entre os alunos aprovados do curso, lendo só o progresso de cada inscrição (sem JOINs)
+        :return: Dicionário com o total de alunos, o percentual médio e quantos concluíram todas as aulas
+        """
+        mask = course.progress_mask() if mask is None else mask
+        total = bin(mask).count('1')
+        students = completed = done = 0
+        progresses = self.filter(course_id=course.pk, status=Enrollment.STATUS_APPROVED).values_list(
+            'progress', flat=True
+        ).order_by()
+        for progress in progresses.iterator(chunk_size=2000):
+            count = count_bits(progress, mask)
+            students += 1
+            done += count
+            completed += total > 0 and count == total
+
+        return {
+            'students': students,
+            'average': round(done * 100 / (students * total)) if students and total else 0,
+            'completed': completed,
+        }
+
+    def enroll(self, user, course):
+        """
+        Inscreve o usuário no curso, com uma única escrita na inscrição (já aprovada).
+        Se o curso tem limite de vagas e elas acabaram, a inscrição entra na lista de espera
+        :return: Tupla (inscrição, se foi criada agora)
+        """
+        try:
+            with transaction.atomic():
+                status = Enrollment.STATUS_APPROVED
+                if course.seats is not None and not SeatShard.objects.take(course):
+                    status = Enrollment.STATUS_WAITLIST
+                return self.create(user=user, course=course, status=status), True
+        except IntegrityError:
+            # Já estava inscrito (ou se inscreveu ao mesmo tempo em outra requisição).
+            # A vaga ocupada acima foi desfeita junto com a transação
+            return self.get(user=user, course=course), False
+
+    def cancel(self, enrollment):
+        """
+        Cancela (apaga) a inscrição. Se ela ocupava uma vaga, a vaga vai para o primeiro da lista de espera.
+        Se a inscrição já foi apagada por outro cancelamento, não faz nada: a vaga e os totais já foram devolvidos
+        :return: True se a inscrição foi apagada agora
+        """
+        course = enrollment.course
+        try:
+            with transaction.atomic():
+                # Trava a inscrição e usa a situação atual (ela pode ter saído da lista de espera depois de carregada)
+                status = self.select_for_update().filter(pk=enrollment.pk).values_list('status', flat=True).first()
+                if status is None:
+                    return False
+                enrollment.status = status
+                if not enrollment.delete()[0]:
+                    # Apagada por outro cancelamento entre a leitura e o DELETE (em BDs sem trava de linha, como
+                    # o SQLite). Desfaz a transação, com os totais que o signal já tinha atualizado
+                    raise Enrollment.DoesNotExist
+                if course.seats is not None and status == Enrollment.STATUS_APPROVED:
+                    SeatShard.objects.release(course)
+        except Enrollment.DoesNotExist:
+            return False
+
+        if course.seats is not None:
+            self.promote_waitlist(course)
+        return True
+
+    def promote_waitlist(self, course):
+        """
+        Aprova os primeiros da lista de espera enquanto houver vagas.
+        Cada promoção (a vaga e a inscrição) é uma transação: se o processo cair no meio, a vaga não se perde
+        :return: Quantidade de inscrições aprovadas
+        """
+        promoted = 0
+        waitlist = self.get_queryset().filter(course=course, status=Enrollment.STATUS_WAITLIST)
+        while True:
+            with transaction.atomic():
+                candidate = waitlist.order_by('created_at', 'pk').values_list('pk', 'user_id').first()
+                if candidate is None or not SeatShard.objects.take(course):
+                    return promoted
+                pk, user_id = candidate
+                # Condicional: se outro processo já promoveu esta inscrição, devolve a vaga e tenta a próxima
+                if waitlist.filter(pk=pk).update(status=Enrollment.STATUS_APPROVED):
+                    invalidate_on_commit(invalidate_access, user_id)
+                    CourseStats.objects.add(course.pk, waitlist=-1, approved=1)
+                    promoted += 1
+                else:
+                    SeatShard.objects.release(course)
+
+    def bulk_enroll(self, course, identifiers, batch_size=1000, progress=None):
+        """
+        Inscreve (já aprovados, ou na lista de espera se as vagas acabarem) muitos usuários de uma vez, em lotes.
+        Cada lote custa quatro consultas (usuários, inscrições já existentes, o INSERT e o UPDATE dos totais do curso),
+        independente do tamanho (mais o UPDATE das vagas, em cursos com limite).
+        Não dispara signals nem envia emails
+
+        :param course: Curso
+        :param identifiers: Iterável de nomes de usuário ou emails (pode ser um gerador lendo um arquivo)
+        :param batch_size: Tamanho de cada lote
+        :param progress: Função chamada a cada lote com o total acumulado até ali
+        :return: dicionário com o total lido, inscritos, já inscritos e não encontrados
+        """
+        from django.contrib.auth import get_user_model
+
+        User = get_user_model()
+        totals = {'read': 0, 'created': 0, 'existing': 0, 'not_found': 0}
+        for batch in chunked(identifiers, batch_size):
+            batch = set(batch)
+            users, matched = set(), set()
+            for pk, username, email in User.objects.filter(
+                models.Q(username__in=batch) | models.Q(email__in=batch)
+            ).values_list('pk', 'username', 'email'):
+                users.add(pk)
+                matched.update((username, email))
+            # Se outra inscrição de um desses usuários entrar ao mesmo tempo, o INSERT falha no unique_together e o
+            # lote é refeito sem ela. Assim as vagas e os totais contam só as inscrições realmente criadas aqui
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        existing = set(
+                            self.get_queryset().filter(
+                                course=course, user_id__in=users
+                            ).values_list('user_id', flat=True)
+                        )
+                        new = [pk for pk in users if pk not in existing]
+                        # Em cursos com limite, quem não couber nas vagas vai para a lista de espera
+                        approved = len(new) if course.seats is None else SeatShard.objects.take(course, len(new))
+                        self.bulk_create([
+                            Enrollment(
+                                user_id=pk,
+                                course=course,
+                                status=Enrollment.STATUS_APPROVED if i < approved else Enrollment.STATUS_WAITLIST
+                            )
+                            for i, pk in enumerate(new)
+                        ])
+                        # Sem signals, os totais do curso precisam ser atualizados aqui
+                        CourseStats.objects.add(course.pk, approved=approved, waitlist=len(new) - approved)
+                    break
+                except IntegrityError:
+                    if attempt:
+                        raise
+            invalidate_on_commit(invalidate_access, *new)
+
+            totals['read'] += len(batch)
+            totals['created'] += len(new)
+            totals['existing'] += len(existing)
+            # Pelos identificadores: o mesmo usuário pode vir pelo nome e pelo email no mesmo lote
+            totals['not_found'] += len(batch - matched)
+            if progress:
+                progress(totals)
+
+        return totals
+
+
 class Enrollment(models.Model):
     """
     Modelo para Inscrições de Curso
     """
 
+    STATUS_PENDING = 0
+    STATUS_APPROVED = 1
+    STATUS_CANCELED = 2
+    STATUS_WAITLIST = 3
+
     # Escolhas para Status
     STATUS_CHOICES = (
-        (0, 'Pendente'),
-        (1, 'Aprovado'),
-        (2, 'Cancelado'),
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_APPROVED, 'Aprovado'),
+        (STATUS_CANCELED, 'Cancelado'),
+        (STATUS_WAITLIST, 'Lista de Espera'),
     )
 
     user = models.ForeignKey(
@@ -270,6 +795,14 @@ class Enrollment(models.Model):
         auto_now=True
     )
 
+    # Aulas concluídas: um bit por aula, na posição Lesson.progress_bit (ver courses/progress.py)
+    progress = models.BinaryField(
+        'Progresso',
+        default=b''
+    )
+
+    objects = EnrollmentManager()
+
     def active(self):
         """
         Ativando curso do aluno
@@ -283,12 +816,38 @@ class Enrollment(models.Model):
         """
         return self.status == 1
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Guarda a situação lida do BD, para os totais do curso saberem de qual situação a inscrição saiu
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def has_completed(self, lesson):
+        return has_bit(self.progress, lesson.progress_bit)
+
+    def progress_percent(self, mask=None):
+        """
+        Percentual das aulas do curso concluídas
+        """
+        return percent(self.progress, self.course.progress_mask() if mask is None else mask)
+
     class Meta:
         verbose_name = 'Inscrição'
         verbose_name_plural = 'Inscrições'
         # Garante que não haverá repetição de cursos para o mesmo usuário (liter. Juntos somos Únicos).
         # Cada tupla interna da tupla principal indica as uniões de campos que não devem se repetir
         unique_together = (('user', 'course'),)
+        # Inscritos de um curso por situação (envio dos anúncios), e a lista de espera na ordem de chegada
+        indexes = [
+            models.Index(fields=['course', 'status', 'created_at'], name='courses_enroll_status_idx'),
+            # Filtro por situação no admin (WHERE status = ... ORDER BY id DESC), sem escolher um curso.
+            # O índice acima não serve: a primeira coluna dele é o curso. Neste, o id já vem depois da situação
+            # (o id faz parte de qualquer índice no InnoDB e no SQLite), então a página sai do índice, sem ordenar
+            models.Index(fields=['status'], name='courses_enroll_by_status_idx'),
+        ]
 
 
 class Announcement(models.Model):
@@ -308,6 +867,13 @@ class Announcement(models.Model):
         'Conteúdo'
     )
 
+    # Total de comentários, mantido pelos signals de Comment (evita um COUNT a cada exibição)
+    comments_count = models.IntegerField(
+        'Comentários',
+        default=0,
+        editable=False
+    )
+
     created_at = models.DateTimeField(
         'Criado Em',
         auto_now_add=True
@@ -321,10 +887,39 @@ class Announcement(models.Model):
     def __str__(self):
         return self.title
 
+    def comments_page(self, after=None, size=20):
+        """
+        Uma página de comentários, em ordem de criação, já com os usuários (JOIN).
+        A paginação é por cursor (keyset): a próxima página começa depois do (created_at, id) informado,
+        então o custo de cada página não depende de quantos comentários vieram antes
+
+        :param after: Tupla (created_at, id) do último comentário já exibido, ou None para a primeira página
+        :param size: Quantidade de comentários por página
+        :return: Tupla (comentários, cursor da próxima página ou None se não houver mais)
+        """
+        comments = self.comments.select_related('user').order_by('created_at', 'id')
+        if after:
+            created_at, pk = after
+            comments = comments.filter(
+                models.Q(created_at__gt=created_at) | models.Q(created_at=created_at, pk__gt=pk)
+            )
+        # Um a mais, só para saber se existe uma próxima página
+        comments = list(comments[:size + 1])
+        if len(comments) > size:
+            comments = comments[:size]
+            return comments, (comments[-1].created_at, comments[-1].pk)
+
+        return comments, None
+
     class Meta:
         verbose_name = 'Anúncio'
         verbose_name_plural = 'Anúncios'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['course', '-created_at'], name='courses_announce_created_idx'),
+            # Admin: busca pelo início do título
+            models.Index(fields=['title'], name='courses_announce_title_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -363,6 +958,243 @@ class Comment(models.Model):
         verbose_name = 'Comentário'
         verbose_name_plural = 'Comentários'
         ordering = ['created_at']
+        # Páginas de comentários do anúncio (created_at, id). O id já faz parte de qualquer índice no SQLite e no InnoDB
+        indexes = [
+            models.Index(fields=['announcement', 'created_at'], name='courses_comment_created_idx'),
+        ]
+
+
+class CourseStatsManager(models.Manager):
+    """
+    Mantém os totais de CourseStats
+    """
+
+    def increment(self, queryset, **deltas):
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+        # Os totais de um curso sendo apagado são apagados junto com ele
+        queryset = queryset.exclude(course_id__in=getattr(_deleting_courses, 'ids', set()))
+        return queryset.update(**{field: models.F(field) + delta for field, delta in deltas.items()})
+
+    def add(self, course_id, **deltas):
+        """
+        Soma (ou subtrai) os valores informados aos totais do curso, no próprio BD (sem ler antes).
+        Ex.: CourseStats.objects.add(course.pk, approved=1, waitlist=-1)
+        """
+        if not self.increment(self.filter(course_id=course_id), **deltas) and any(deltas.values()):
+            if course_id not in getattr(_deleting_courses, 'ids', set()):
+                logger.warning('Curso %s sem totais. Rode: python manage.py rebuild_course_stats', course_id)
+
+    def add_comments(self, announcement_id, step):
+        """
+        Soma step comentários ao curso do anúncio, sem precisar ler o curso antes (subconsulta no UPDATE)
+        """
+        self.increment(self.filter(course__announcements=announcement_id), comments=step)
+
+    def add_status(self, course_id, status, step=1):
+        """
+        Soma step inscrições na situação informada
+        """
+        self.add(course_id, **{CourseStats.STATUS_FIELDS[status]: step})
+
+    def count(self, course_ids):
+        """
+        Calcula os totais dos cursos informados a partir das tabelas (uma consulta agrupada por tabela)
+        :return: Dicionário id do curso -> dicionário campo -> total
+        """
+        totals = {course_id: dict.fromkeys(CourseStats.COUNTERS, 0) for course_id in course_ids}
+        enrollments = Enrollment.objects.filter(course_id__in=course_ids).values_list('course_id', 'status').annotate(
+            total=models.Count('pk')
+        ).order_by()
+        for course_id, status, total in enrollments:
+            totals[course_id][CourseStats.STATUS_FIELDS[status]] = total
+
+        for field, model, course_field in (
+            ('announcements', Announcement, 'course_id'),
+            ('comments', Comment, 'announcement__course_id'),
+            ('lessons', Lesson, 'course_id'),
+        ):
+            counts = model.objects.filter(**{f'{course_field}__in': course_ids}).values_list(course_field).annotate(
+                total=models.Count('pk')
+            ).order_by()
+            for course_id, total in counts:
+                totals[course_id][field] = total
+
+        return totals
+
+    def rebuild(self, course_ids=None, batch_size=500):
+        """
+        Refaz os totais (de todos os cursos, ou dos informados) em lotes, gravando só os que estavam errados
+        :return: Tupla (cursos verificados, cursos corrigidos)
+        """
+        courses = Course.objects.order_by('pk').values_list('pk', flat=True)
+        if course_ids is not None:
+            courses = courses.filter(pk__in=course_ids)
+        checked = fixed = 0
+        for batch in chunked(courses.iterator(chunk_size=batch_size), batch_size):
+            totals = self.count(batch)
+            with transaction.atomic():
+                current = {stats.course_id: stats for stats in self.select_for_update().filter(course_id__in=batch)}
+                wrong = [
+                    course_id for course_id in batch
+                    if course_id not in current or current[course_id].totals() != totals[course_id]
+                ]
+                self.filter(course_id__in=wrong).delete()
+                self.bulk_create([CourseStats(course_id=course_id, **totals[course_id]) for course_id in wrong])
+            checked += len(batch)
+            fixed += len(wrong)
+
+        return checked, fixed
+
+
+class CourseStats(models.Model):
+    """
+    Totais do curso, mantidos pelos signals de Enrollment, Announcement, Comment e Lesson (incrementos no BD).
+    Mostrar os totais custa a leitura de uma linha, em vez de um COUNT por tabela.
+    Depois de cargas em massa ou se algo sair do lugar: python manage.py rebuild_course_stats
+    """
+
+    # Campo do total de cada situação de inscrição
+    STATUS_FIELDS = {
+        Enrollment.STATUS_PENDING: 'pending',
+        Enrollment.STATUS_APPROVED: 'approved',
+        Enrollment.STATUS_CANCELED: 'canceled',
+        Enrollment.STATUS_WAITLIST: 'waitlist',
+    }
+    COUNTERS = ['pending', 'approved', 'canceled', 'waitlist', 'announcements', 'comments', 'lessons']
+
+    course = models.OneToOneField(
+        Course,
+        verbose_name='Curso',
+        related_name='stats',
+        primary_key=True,
+        on_delete=models.CASCADE
+    )
+
+    pending = models.IntegerField('Pendentes', default=0)
+    approved = models.IntegerField('Alunos', default=0)
+    canceled = models.IntegerField('Cancelados', default=0)
+    waitlist = models.IntegerField('Lista de Espera', default=0)
+    announcements = models.IntegerField('Anúncios', default=0)
+    comments = models.IntegerField('Comentários', default=0)
+    lessons = models.IntegerField('Aulas', default=0)
+
+    objects = CourseStatsManager()
+
+    def totals(self):
+        return {field: getattr(self, field) for field in self.COUNTERS}
+
+    def released_lessons(self):
+        """
+        Aulas já liberadas hoje (do calendário de liberação, em memória)
+        """
+        return len(released_lesson_ids(self.course_id))
+
+    def __str__(self):
+        return f'Totais de {self.course_id}'
+
+    class Meta:
+        verbose_name = 'Totais do Curso'
+        verbose_name_plural = 'Totais dos Cursos'
+
+
+def send_announcement_mail(announcement):
+    """
+    Envia o anúncio para todos os inscritos aprovados do curso (menos os que preferem o resumo diário).
+    Os emails dos alunos são lidos numa única consulta, em streaming, e o envio é feito em lotes
+
+    :param announcement: O anúncio a ser enviado
+    :return: Lista com as estatísticas de cada lote
+    """
+    batch_size = settings.MAIL_BATCH_SIZE
+    # Apenas os emails, trazidos com JOIN, sem instanciar Enrollment nem User
+    recipients = Enrollment.objects.filter(
+        course_id=announcement.course_id, status=1, user__announcement_delivery=User.DELIVERY_IMMEDIATE
+    ).values_list('user__email', flat=True).iterator(chunk_size=batch_size)
+
+    return send_mass_mail_template(
+        announcement.title,
+        'courses/announcements_mail.html',
+        {'announcement': announcement},
+        recipients,
+        batch_size=batch_size
+    )
+
+
+# Período do primeiro resumo de quem ainda não recebeu nenhum
+DIGEST_FIRST_WINDOW = timedelta(days=1)
+
+
+def digest_subject(announcements):
+    if len(announcements) == 1:
+        return 'Resumo diário: 1 novo anúncio'
+    return f'Resumo diário: {len(announcements)} novos anúncios'
+
+
+def send_announcement_digests(until=None, batch_size=None):
+    """
+    Envia o resumo diário: um único email por aluno (com announcement_delivery = resumo diário), com todos os anúncios
+    dos seus cursos criados desde o último resumo (User.digest_sent_at). Deve ser agendado uma vez por dia
+    (python manage.py send_announcement_digests).
+
+    Os pares (aluno, anúncio) saem de uma única consulta, em streaming e ordenados por aluno. O conteúdo de cada
+    anúncio é lido uma vez por lote, e alunos dos mesmos cursos recebem o mesmo conteúdo, renderizado uma única vez.
+    Ao final de cada lote, digest_sent_at dos alunos do lote passa a ser until: se o envio for interrompido,
+    a próxima execução continua de onde parou, sem repetir anúncios
+
+    :param until: Anúncios criados até esse momento. Se não informado, agora
+    :param batch_size: Alunos por lote. Se não informado, usa MAIL_BATCH_SIZE
+    :return: dicionário com a quantidade de alunos, anúncios e renderizações
+    """
+    until = until or timezone.now()
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    since = Coalesce(
+        'user__digest_sent_at', models.Value(until - DIGEST_FIRST_WINDOW, output_field=models.DateTimeField())
+    )
+    # A mesma condição num único filter(): o JOIN com os anúncios é feito uma só vez
+    rows = Enrollment.objects.filter(
+        status=Enrollment.STATUS_APPROVED,
+        user__announcement_delivery=User.DELIVERY_DIGEST,
+        course__announcements__created_at__gt=since,
+        course__announcements__created_at__lte=until,
+    ).order_by(
+        'user_id', 'course_id', 'course__announcements__created_at', 'course__announcements'
+    ).values_list('user_id', 'user__email', 'course__announcements').iterator(chunk_size=batch_size)
+
+    # ((id, email), [ids dos anúncios]) de cada aluno
+    students = (
+        (user, [row[2] for row in group]) for user, group in groupby(rows, key=lambda row: (row[0], row[1]))
+    )
+    announcements = {}
+    rendered = {}
+    result = {'students': 0, 'announcements': 0, 'renders': 0}
+    for batch in chunked(students, batch_size):
+        # Limita a memória quando quase todo aluno tem uma combinação diferente de cursos
+        if len(rendered) > batch_size:
+            rendered.clear()
+        missing = {pk for user, ids in batch for pk in ids} - announcements.keys()
+        announcements.update(Announcement.objects.select_related('course').in_bulk(missing))
+
+        mails = []
+        for (user_id, email), ids in batch:
+            key = tuple(ids)
+            if key not in rendered:
+                items = [announcements[pk] for pk in ids]
+                message_html, message_txt = render_mail_template(
+                    'courses/announcements_digest_mail.html', {'announcements': items}
+                )
+                rendered[key] = (digest_subject(items), message_html, message_txt)
+                result['renders'] += 1
+            mails.append(rendered[key] + (email,))
+
+        send_personal_mails(mails, batch_size=batch_size)
+        User.objects.filter(pk__in=[user_id for (user_id, email), ids in batch]).update(digest_sent_at=until)
+        result['students'] += len(batch)
+        logger.info('Resumo diário: %d alunos enviados', result['students'])
+
+    result['announcements'] = len(announcements)
+    return result
 
 
 def post_save_announcement(instance: Announcement, created, **kwargs):
@@ -376,16 +1208,148 @@ def post_save_announcement(instance: Announcement, created, **kwargs):
     """
     # Envia apenas ser for na criação
     if created:
-        context = {
-            'announcement': instance
-        }
-        # Pegando inscrições relacionados ao anuncio
-        enrollments = Enrollment.objects.filter(course=instance.course, status=1)
-        # Enviando email para cada inscrito separadamente
-        for enrollment in enrollments:
-            send_mail_template(instance.title, 'courses/announcements_mail.html', context, [enrollment.user.email])
+        if settings.ANNOUNCEMENT_MAIL_ASYNC:
+            # Só dispara depois do commit, para que a thread enxergue o anúncio salvo
+            transaction.on_commit(
+                lambda: run_in_background(f'announcement-{instance.pk}', send_announcement_mail, instance)
+            )
+        else:
+            send_announcement_mail(instance)
+
+
+# Cursos sendo apagados na thread atual. As aulas apagadas em cascata não devem reindexá-los
+_deleting_courses = threading.local()
+
+
+def update_search_index(instance, **kwargs):
+    """
+    Signal. Mantém o índice de busca atualizado quando um curso ou uma aula é salvo ou apagado
+    """
+    if isinstance(instance, Course):
+        SearchTerm.objects.index_course(instance)
+    elif instance.course_id not in getattr(_deleting_courses, 'ids', set()):
+        SearchTerm.objects.index_course(instance.course)
+
+
+def pre_delete_course(instance, **kwargs):
+    """
+    Signal. Marca o curso como sendo apagado (os termos dele são apagados em cascata)
+    """
+    if not hasattr(_deleting_courses, 'ids'):
+        _deleting_courses.ids = set()
+    _deleting_courses.ids.add(instance.pk)
+
+
+def post_delete_course(instance, **kwargs):
+    getattr(_deleting_courses, 'ids', set()).discard(instance.pk)
+
+
+models.signals.post_save.connect(update_search_index, sender=Course, dispatch_uid='search_index_course')
+models.signals.post_save.connect(update_search_index, sender=Lesson, dispatch_uid='search_index_lesson_save')
+models.signals.post_delete.connect(update_search_index, sender=Lesson, dispatch_uid='search_index_lesson_delete')
+models.signals.pre_delete.connect(pre_delete_course, sender=Course, dispatch_uid='search_pre_delete_course')
+models.signals.post_delete.connect(post_delete_course, sender=Course, dispatch_uid='search_post_delete_course')
+
+
+def invalidate_page_cache(sender, instance, **kwargs):
+    """
+    Signal. Invalida apenas as páginas do cache de páginas anônimas que dependem do objeto alterado
+    """
+    if sender is Course:
+        # A listagem e a página do curso
+        invalidate_tags('catalog', f'course:{instance.pk}')
+    elif sender is Lesson:
+        # As aulas entram no resultado da busca
+        invalidate_tags('search', f'course:{instance.course_id}')
+    else:
+        invalidate_tags(f'course:{instance.course_id}')
+
+
+for model in (Course, Lesson, Announcement):
+    models.signals.post_save.connect(
+        invalidate_page_cache, sender=model, dispatch_uid=f'page_cache_save_{model.__name__}'
+    )
+    models.signals.post_delete.connect(
+        invalidate_page_cache, sender=model, dispatch_uid=f'page_cache_delete_{model.__name__}'
+    )
+
+
+def post_save_course_seats(instance, **kwargs):
+    """
+    Signal. Acompanha o limite de vagas do curso: redistribui as vagas e, se aumentaram, chama a lista de espera
+    """
+    if instance.seats is not None or instance.seat_shards.exists():
+        SeatShard.objects.sync(instance)
+        if instance.seats is not None:
+            Enrollment.objects.promote_waitlist(instance)
+
+
+models.signals.post_save.connect(post_save_course_seats, sender=Course, dispatch_uid='post_save_course_seats')
+
+
+def post_save_course_image(instance, **kwargs):
+    """
+    Signal. Gera as versões reduzidas da imagem do curso em segundo plano, depois do commit
+    Se a imagem não mudou, a geração não faz nada (o manifesto guarda a assinatura do original)
+    """
+    def generate():
+        generate_renditions(instance.image)
+        # As páginas em cache ainda apontam para a imagem original
+        invalidate_tags('catalog', f'course:{instance.pk}')
+
+    if instance.image:
+        transaction.on_commit(lambda: run_in_background(f'renditions-{instance.pk}', generate))
+
+
+models.signals.post_save.connect(post_save_course_image, sender=Course, dispatch_uid='post_save_course_image')
+
+
+def update_release_calendar(instance, **kwargs):
+    """
+    Signal. Refaz o calendário de liberação quando uma aula é salva ou apagada (agora e depois do commit)
+    """
+    invalidate_on_commit(invalidate_calendar, instance.course_id)
+
+
+models.signals.post_save.connect(update_release_calendar, sender=Lesson, dispatch_uid='release_calendar_save')
+models.signals.post_delete.connect(update_release_calendar, sender=Lesson, dispatch_uid='release_calendar_delete')
+
+
+def invalidate_course_access(sender, instance, **kwargs):
+    """
+    Signal. Mantém os mapas de acesso (courses.access) em dia
+    """
+    if sender is Enrollment:
+        invalidate_on_commit(invalidate_access, instance.user_id)
+    else:
+        # O slug do curso pode ter mudado. Todos os mapas são refeitos sob demanda
+        invalidate_on_commit(invalidate_all_access)
+
+
+for model in (Course, Enrollment):
+    models.signals.post_save.connect(
+        invalidate_course_access, sender=model, dispatch_uid=f'course_access_save_{model.__name__}'
+    )
+    models.signals.post_delete.connect(
+        invalidate_course_access, sender=model, dispatch_uid=f'course_access_delete_{model.__name__}'
+    )
+
+
+def update_comments_count(instance, **kwargs):
+    """
+    Signal. Incrementa (novo comentário) ou decrementa (comentário apagado) o total de comentários do anúncio
+    """
+    if kwargs.get('created') is False:
+        return
+    step = 1 if kwargs.get('created') else -1
+    Announcement.objects.filter(pk=instance.announcement_id).update(
+        comments_count=models.F('comments_count') + step
+    )
 
 
+models.signals.post_save.connect(update_comments_count, sender=Comment, dispatch_uid='comments_count_save')
+models.signals.post_delete.connect(update_comments_count, sender=Comment, dispatch_uid='comments_count_delete')
+
 # Registrando Gatilho de Pós Salvamento
 models.signals.post_save.connect(
     # Função a ser executada
@@ -395,3 +1359,38 @@ models.signals.post_save.connect(
     # Evita que o sinal seja cadastrado em duplicidade
     dispatch_uid='post_save_announcement'
 )
+
+
+def update_course_stats(sender, instance, **kwargs):
+    """
+    Signal. Mantém os totais do curso (CourseStats) com incrementos no BD
+    """
+    created = kwargs.get('created')
+    step = -1 if created is None else 1
+    if sender is Course:
+        if created and not kwargs.get('raw'):
+            CourseStats.objects.create(course=instance)
+    elif sender is Enrollment:
+        previous = getattr(instance, '_loaded_status', None)
+        if created or created is None:
+            CourseStats.objects.add_status(instance.course_id, instance.status, step)
+        elif previous is not None and previous != instance.status:
+            CourseStats.objects.add(instance.course_id, **{
+                CourseStats.STATUS_FIELDS[previous]: -1, CourseStats.STATUS_FIELDS[instance.status]: 1
+            })
+        instance._loaded_status = instance.status
+    elif created is not False:
+        if sender is Comment:
+            CourseStats.objects.add_comments(instance.announcement_id, step)
+        else:
+            CourseStats.objects.add(instance.course_id, **{'announcements' if sender is Announcement else 'lessons': step})
+
+
+models.signals.post_save.connect(update_course_stats, sender=Course, dispatch_uid='course_stats_course')
+for model in (Enrollment, Announcement, Comment, Lesson):
+    models.signals.post_save.connect(
+        update_course_stats, sender=model, dispatch_uid=f'course_stats_save_{model.__name__}'
+    )
+    models.signals.post_delete.connect(
+        update_course_stats, sender=model, dispatch_uid=f'course_stats_delete_{model.__name__}'
+    )
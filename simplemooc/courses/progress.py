@@ -0,0 +1,54 @@
+"""
+Progresso dos alunos nas aulas, guardado como um conjunto de bits em cada inscrição (Enrollment.progress).
+
+Cada aula do curso tem um bit fixo (Lesson.progress_bit), distribuído na criação e nunca reaproveitado: a aula
+de bit 0 é o bit menos significativo do primeiro byte, a de bit 9 é o segundo bit do segundo byte, e assim por diante.
+Um curso com 200 aulas ocupa 25 bytes por aluno, em vez de uma linha por (aluno, aula). Os percentuais são calculados
+em memória com uma máscara das aulas que ainda existem, sem JOINs.
+"""
+
+
+def to_int(data):
+    return int.from_bytes(bytes(data or b''), 'little')
+
+
+def to_bytes(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def set_bit(data, bit):
+    """
+    Os bytes com o bit informado ligado
+    """
+    return to_bytes(to_int(data) | (1 << bit))
+
+
+def has_bit(data, bit):
+    return bit is not None and bool(to_int(data) >> bit & 1)
+
+
+def make_mask(bits):
+    """
+    Máscara (número inteiro) com os bits informados ligados (ex.: os das aulas do curso)
+    """
+    mask = 0
+    for bit in bits:
+        if bit is not None:
+            mask |= 1 << bit
+
+    return mask
+
+
+def count_bits(data, mask):
+    """
+    Quantas aulas da máscara estão concluídas
+    """
+    return bin(to_int(data) & mask).count('1')
+
+
+def percent(data, mask):
+    """
+    Percentual de conclusão (0 a 100) das aulas da máscara
+    """
+    total = bin(mask).count('1')
+    return round(count_bits(data, mask) * 100 / total) if total else 0
@@ -0,0 +1,78 @@
+"""
+Calendário de liberação das aulas, guardado no cache compartilhado.
+
+Para cada curso, guarda as datas de liberação ordenadas e o conjunto de aulas já liberadas no dia.
+As verificações de disponibilidade viram consultas em memória. A virada do dia (meia-noite no TIME_ZONE
+do projeto) é feita pelo comando rollover_lessons, e também acontece sozinha na primeira consulta do dia.
+"""
+import bisect
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from simplemooc.core.routers import primary
+
+
+def calendar_key(course_id):
+    return f'courses:releases:{course_id}'
+
+
+def build_calendar(course_id):
+    """
+    Monta o calendário do curso com uma única consulta (no primário, já que o calendário vai para o cache)
+    """
+    from .models import Lesson
+
+    with primary():
+        releases = sorted(
+            (release_date, pk)
+            for pk, release_date in Lesson.objects.filter(
+                course_id=course_id, release_date__isnull=False
+            ).values_list('pk', 'release_date')
+        )
+    return {'day': None, 'dates': [date for date, pk in releases], 'lessons': [pk for date, pk in releases]}
+
+
+def roll(calendar, today):
+    """
+    Atualiza as aulas liberadas para o dia informado, sem consultar o BD
+    """
+    # As datas estão ordenadas: tudo até a posição de "hoje" já foi liberado
+    position = bisect.bisect_right(calendar['dates'], today)
+    calendar['day'] = today
+    calendar['released'] = frozenset(calendar['lessons'][:position])
+    calendar['next_release'] = calendar['dates'][position] if position < len(calendar['dates']) else None
+    return calendar
+
+
+def get_calendar(course_id):
+    """
+    Calendário do curso para o dia de hoje (data local)
+    """
+    today = timezone.localdate()
+    key = calendar_key(course_id)
+    calendar = cache.get(key)
+    if calendar is None or calendar['day'] != today:
+        calendar = roll(calendar or build_calendar(course_id), today)
+        cache.set(key, calendar, settings.RELEASE_CALENDAR_TIMEOUT)
+
+    return calendar
+
+
+def released_lesson_ids(course_id):
+    """
+    Ids das aulas do curso já liberadas hoje
+    """
+    return get_calendar(course_id)['released']
+
+
+def next_release(course_id):
+    """
+    Data da próxima liberação de aula do curso, ou None se não houver
+    """
+    return get_calendar(course_id)['next_release']
+
+
+def invalidate_calendar(*course_ids):
+    cache.delete_many([calendar_key(course_id) for course_id in course_ids])
@@ -0,0 +1,61 @@
+"""
+Funções de apoio à busca de cursos (índice invertido)
+"""
+import re
+import unicodedata
+from collections import Counter
+
+# Palavras muito comuns em português, que não ajudam na busca
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'como', 'da', 'das', 'de', 'do', 'dos', 'e', 'em', 'na', 'nas', 'no', 'nos',
+    'o', 'os', 'ou', 'para', 'pela', 'pelo', 'por', 'que', 'se', 'sem', 'sua', 'seu', 'um', 'uma',
+}
+
+# Peso de cada campo no cálculo da relevância
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'description': 1.0,
+    'about': 0.5,
+    'lesson': 0.5,
+}
+
+# Tamanho máximo de um termo no índice
+MAX_TOKEN_LENGTH = 50
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    Remove acentos e coloca em minúsculas. Ex.: 'Programação' -> 'programacao'
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    """
+    Quebra o texto em termos normalizados, ignorando stopwords e termos de uma letra
+    """
+    return [
+        token[:MAX_TOKEN_LENGTH]
+        for token in TOKEN_RE.findall(normalize(text))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def document_weights(course, lessons=()):
+    """
+    Calcula o peso de cada termo de um curso (e, opcionalmente, das suas aulas)
+    :return: Counter com termo -> peso
+    """
+    weights = Counter()
+    for field in ('name', 'description', 'about'):
+        for token in tokenize(getattr(course, field)):
+            weights[token] += FIELD_WEIGHTS[field]
+
+    for lesson in lessons:
+        for token in tokenize(f'{lesson.name} {lesson.description}'):
+            weights[token] += FIELD_WEIGHTS['lesson']
+
+    return weights
@@ -1,10 +1,40 @@
-from django.test import TestCase
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote
+
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, models, transaction, IntegrityError, OperationalError
 from django.core import mail
+from django.core.management import call_command
 from django.test.client import Client
 from django.urls import reverse
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import (
+    Course, CourseStats, Enrollment, Announcement, Lesson, SearchTerm, Comment, Material, send_announcement_digests
+)
+from .decorators import enrollment_required
+from .releases import next_release, get_calendar, calendar_key
+from .imports import read_identifiers
+from .access import get_access_map, get_cached_access_map, access_key, get_generation
+
+from simplemooc.accounts.models import PasswordReset
+
+from simplemooc.core.cache import page_cache_stats
 
-from .models import Course
+User = get_user_model()
 
 
 class ContactCourseTestCase(TestCase):
@@ -61,7 +91,1007 @@ class ContactCourseTestCase(TestCase):
         client = Client()
         path = reverse('courses:details', args=[str(self.course.slug)])
         client.post(path, data)
+        # O email vai para a fila. Processa a fila como o worker faria
+        call_command('send_queued_mail', stdout=StringIO())
         # Testa se foi tem 1 email na caixa de saída de emails
         self.assertEqual(len(mail.outbox), 1)
         # Testa se o email foi enviado para a pessoa certa
         self.assertEqual(mail.outbox[0].to[0], settings.CONTACT_EMAIL)
+
+
+@override_settings(ANNOUNCEMENT_MAIL_ASYNC=False, MAIL_BATCH_SIZE=2)
+class AnnouncementMailTestCase(TestCase):
+    """
+    Testa o envio em lote dos anúncios para os inscritos
+    """
+
+    def setUp(self):
+        self.course = Course.objects.create(name='Django', slug='django')
+        for i in range(5):
+            user = User.objects.create_user(f'aluno{i}', f'aluno{i}@teste.com', '123')
+            # Apenas o último aluno fica com a inscrição pendente
+            Enrollment.objects.create(user=user, course=self.course, status=0 if i == 4 else 1)
+
+    def test_announcement_sent_to_each_approved_student(self):
+        """
+        Cada aluno aprovado recebe o seu próprio email, e os pendentes não recebem
+        """
+        Announcement.objects.create(course=self.course, title='Aviso', content='Conteúdo')
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox),
+            [f'aluno{i}@teste.com' for i in range(4)]
+        )
+        self.assertTrue(all(len(email.to) == 1 for email in mail.outbox))
+
+    def test_announcement_update_does_not_send(self):
+        """
+        Alterar um anúncio existente não reenvia os emails
+        """
+        announcement = Announcement.objects.create(course=self.course, title='Aviso', content='Conteúdo')
+        call_command('send_queued_mail', stdout=StringIO())
+        mail.outbox = []
+        announcement.title = 'Aviso alterado'
+        announcement.save()
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+
+@override_settings(ANNOUNCEMENT_MAIL_ASYNC=False)
+class AnnouncementDigestTestCase(TestCase):
+    """
+    Testa o resumo diário dos anúncios
+    """
+
+    def setUp(self):
+        self.django = Course.objects.create(name='Django', slug='django')
+        self.python = Course.objects.create(name='Python', slug='python')
+        self.immediate = User.objects.create_user('imediato', 'imediato@teste.com', '123')
+        self.digest = []
+        for i in range(3):
+            user = User.objects.create_user(f'resumo{i}', f'resumo{i}@teste.com', '123')
+            user.announcement_delivery = User.DELIVERY_DIGEST
+            user.save()
+            self.digest.append(user)
+        for user in [self.immediate] + self.digest:
+            Enrollment.objects.create(user=user, course=self.django, status=1)
+        Enrollment.objects.create(user=self.digest[0], course=self.python, status=1)
+
+    def test_digest_users_are_not_in_fan_out(self):
+        Announcement.objects.create(course=self.django, title='Aviso', content='Conteúdo')
+        call_command('send_queued_mail', stdout=StringIO())
+        self.assertEqual([email.to for email in mail.outbox], [['imediato@teste.com']])
+
+    def test_one_mail_per_student(self):
+        """
+        Cada aluno recebe um único email com os anúncios de todos os seus cursos, e o mesmo conteúdo é
+        renderizado uma única vez
+        """
+        Announcement.objects.create(course=self.django, title='Aviso Django', content='Conteúdo')
+        Announcement.objects.create(course=self.python, title='Aviso Python', content='Conteúdo')
+        call_command('send_queued_mail', stdout=StringIO())
+        mail.outbox = []
+
+        # Alunos, conteúdo dos anúncios, fila e digest_sent_at
+        with self.assertNumQueries(4):
+            result = send_announcement_digests()
+        self.assertEqual(result, {'students': 3, 'announcements': 2, 'renders': 2})
+        call_command('send_queued_mail', stdout=StringIO())
+        emails = {email.to[0]: email for email in mail.outbox}
+        self.assertEqual(sorted(emails), [f'resumo{i}@teste.com' for i in range(3)])
+        self.assertEqual(emails['resumo0@teste.com'].subject, 'Resumo diário: 2 novos anúncios')
+        self.assertIn('Aviso Python', emails['resumo0@teste.com'].body)
+        self.assertNotIn('Aviso Python', emails['resumo1@teste.com'].body)
+
+        # Os anúncios já enviados não se repetem no próximo resumo
+        mail.outbox = []
+        self.assertEqual(send_announcement_digests()['students'], 0)
+        Announcement.objects.create(course=self.python, title='Novo', content='Conteúdo')
+        self.assertEqual(send_announcement_digests(batch_size=1)['students'], 1)
+
+    def test_switching_to_digest_skips_mailed_announcements(self):
+        """
+        Ao escolher o resumo, os anúncios já recebidos um a um não entram no primeiro resumo
+        """
+        Announcement.objects.create(course=self.django, title='Aviso', content='Conteúdo')
+        client = Client()
+        client.force_login(self.immediate)
+        client.post(reverse('accounts:edit'), {
+            'username': 'imediato', 'email': 'imediato@teste.com', 'name': '',
+            'announcement_delivery': User.DELIVERY_DIGEST,
+        })
+        self.immediate.refresh_from_db()
+        self.assertEqual(self.immediate.announcement_delivery, User.DELIVERY_DIGEST)
+        self.assertEqual(send_announcement_digests()['students'], 3)
+
+    def test_switching_in_admin_skips_mailed_announcements(self):
+        Announcement.objects.create(course=self.django, title='Aviso', content='Conteúdo')
+        User.objects.create_superuser('admin', 'admin@teste.com', '123')
+        client = Client()
+        client.login(username='admin', password='123')
+        path = reverse('admin:accounts_user_change', args=[self.immediate.pk])
+        data = client.get(path).context['adminform'].form.initial
+        data = {key: value for key, value in data.items() if value is not None and key != 'password'}
+        data.update(announcement_delivery=User.DELIVERY_DIGEST)
+        client.post(path, data)
+        self.immediate.refresh_from_db()
+        self.assertEqual(self.immediate.announcement_delivery, User.DELIVERY_DIGEST)
+        self.assertIsNotNone(self.immediate.digest_sent_at)
+        self.assertEqual(send_announcement_digests()['students'], 3)
+
+    def test_delivery_is_required(self):
+        client = Client()
+        client.force_login(self.immediate)
+        response = client.post(reverse('accounts:edit'), {
+            'username': 'imediato', 'email': 'imediato@teste.com', 'name': '', 'announcement_delivery': '',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('announcement_delivery', response.context['form'].errors)
+
+
+class CourseSearchTestCase(TestCase):
+    """
+    Testa a busca de cursos pelo índice invertido
+    """
+
+    def setUp(self):
+        self.python = Course.objects.create(
+            name='Programação em Python', slug='python', description='Aprenda a programar'
+        )
+        self.django = Course.objects.create(
+            name='Django', slug='django', description='Framework web escrito em Python'
+        )
+
+    def test_search_ignores_accents_and_case(self):
+        self.assertEqual(list(Course.objects.search('PROGRAMACAO')), [self.python])
+
+    def test_search_ranks_name_above_description(self):
+        self.assertEqual(list(Course.objects.search('python')), [self.python, self.django])
+
+    def test_search_requires_all_terms(self):
+        self.assertEqual(list(Course.objects.search('python framework')), [self.django])
+        self.assertEqual(list(Course.objects.search('python inexistente')), [])
+
+    def test_index_follows_lessons(self):
+        """
+        O índice é atualizado quando aulas são salvas ou apagadas
+        """
+        lesson = Lesson.objects.create(course=self.django, name='Templates e formulários')
+        self.assertEqual(list(Course.objects.search('formularios')), [self.django])
+        lesson.delete()
+        self.assertEqual(list(Course.objects.search('formularios')), [])
+
+    def test_deleting_course_removes_terms(self):
+        Lesson.objects.create(course=self.django, name='Templates')
+        self.django.delete()
+        self.assertFalse(SearchTerm.objects.filter(course_id=self.django.pk).exists())
+        self.assertTrue(SearchTerm.objects.filter(course=self.python).exists())
+
+    def test_index_view_paginates_search(self):
+        response = Client().get(reverse('courses:index'), {'q': 'python'})
+        self.assertEqual(list(response.context['courses']), [self.python, self.django])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class PageCacheTestCase(TestCase):
+    """
+    Testa o cache de páginas para visitantes anônimos
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.django = Course.objects.create(name='Django', slug='django')
+        self.python = Course.objects.create(name='Python', slug='python')
+
+    def get(self, course):
+        return self.client.get(reverse('courses:details', args=[course.slug]))
+
+    def test_second_request_is_a_hit(self):
+        self.assertEqual(self.get(self.django)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(self.django)['X-Cache'], 'HIT')
+        self.assertEqual(page_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_saving_course_invalidates_only_its_pages(self):
+        self.get(self.django)
+        self.get(self.python)
+        self.django.name = 'Django 2'
+        self.django.save()
+        response = self.get(self.django)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Django 2')
+        self.assertEqual(self.get(self.python)['X-Cache'], 'HIT')
+
+    def test_catalog_invalidated_by_new_course(self):
+        self.client.get(reverse('courses:index'))
+        Course.objects.create(name='Flask', slug='flask')
+        response = self.client.get(reverse('courses:index'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Flask')
+
+    def test_cached_page_gets_a_fresh_csrf_token(self):
+        self.get(self.django)
+        response = Client().get(reverse('courses:details', args=[self.django.slug]))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotContains(response, 'csrf_token_placeholder')
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_post_and_logged_users_bypass_cache(self):
+        self.get(self.django)
+        path = reverse('courses:details', args=[self.django.slug])
+        self.assertNotIn('X-Cache', self.client.post(path, {}))
+        User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.client.login(username='aluno', password='123')
+        self.assertNotIn('X-Cache', self.get(self.django))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class EnrollmentRequiredTestCase(TestCase):
+    """
+    Testa o decorador enrollment_required com o mapa de acesso no cache
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name='Django', slug='django')
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.enrollment = Enrollment.objects.create(user=self.user, course=self.course, status=1)
+        self.client = Client()
+        self.client.login(username='aluno', password='123')
+
+    def messages(self, response):
+        return [str(message) for message in response.context['messages']]
+
+    def test_warm_access_check_costs_no_queries(self):
+        view = enrollment_required(lambda request, course_slug: request.course)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        view(request, course_slug='django')
+        with self.assertNumQueries(0):
+            self.assertEqual(view(request, course_slug='django'), self.course)
+
+    def test_pending_enrollment_is_refused(self):
+        self.enrollment.status = 0
+        self.enrollment.save()
+        response = self.client.get(reverse('courses:lessons', args=['django']), follow=True)
+        self.assertEqual(self.messages(response), ['A sua inscrição ainda está pendente'])
+
+    def test_enrollment_changes_reach_the_map(self):
+        path = reverse('courses:lessons', args=['django'])
+        self.assertEqual(self.client.get(path).status_code, 200)
+        self.enrollment.delete()
+        response = self.client.get(path, follow=True)
+        self.assertEqual(self.messages(response), ['Desculpe, mas você não se inscreveu nesse curso.'])
+
+    def test_renamed_course_slug(self):
+        self.client.get(reverse('courses:lessons', args=['django']))
+        self.course.slug = 'django-2'
+        self.course.save()
+        self.assertEqual(self.client.get(reverse('courses:lessons', args=['django-2'])).status_code, 200)
+
+    def test_unknown_course_is_404(self):
+        self.assertEqual(self.client.get(reverse('courses:lessons', args=['flask'])).status_code, 404)
+
+
+class AnnouncementCommentsTestCase(TestCase):
+    """
+    Testa a paginação por cursor dos comentários e o total de comentários do anúncio
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name='Django', slug='django')
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        Enrollment.objects.create(user=self.user, course=self.course, status=1)
+        self.announcement = Announcement.objects.create(course=self.course, title='Aviso', content='Conteúdo')
+        for i in range(25):
+            Comment.objects.create(announcement=self.announcement, user=self.user, comment=f'Comentário {i}')
+        self.client = Client()
+        self.client.login(username='aluno', password='123')
+
+    def test_comments_count_is_maintained(self):
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.comments_count, 25)
+        Comment.objects.first().delete()
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.comments_count, 24)
+
+    def test_announcement_body_follows_updates(self):
+        url = reverse('courses:announcement', args=['django', self.announcement.pk])
+        self.assertContains(self.client.get(url), 'Conteúdo')
+        self.announcement.content = 'Novo conteúdo'
+        self.announcement.save()
+        self.assertContains(self.client.get(url), 'Novo conteúdo')
+
+    def test_comments_are_paginated_by_cursor(self):
+        response = self.client.get(reverse('courses:announcement', args=['django', self.announcement.pk]))
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertContains(response, '25 Comentários')
+
+        path = reverse('courses:announcement_comments', args=['django', self.announcement.pk])
+        response = self.client.get(path, {'after': response.context['cursor']})
+        self.assertEqual(
+            [comment.comment for comment in response.context['comments']],
+            [f'Comentário {i}' for i in range(20, 25)]
+        )
+        self.assertEqual(response.context['cursor'], '')
+        self.assertNotContains(response, '<html')
+
+    def test_comment_burst_is_limited(self):
+        """
+        Os comentários do aluno são limitados (RATELIMITS['courses:announcement'])
+        """
+        url = reverse('courses:announcement', args=['django', self.announcement.pk])
+        statuses = [self.client.post(url, {'comment': f'Spam {i}'}).status_code for i in range(15)]
+        self.assertNotIn(429, statuses[:10])
+        self.assertEqual(statuses[10:], [429] * 5)
+        self.assertEqual(Comment.objects.filter(comment__startswith='Spam').count(), 10)
+
+    def test_comment_users_come_in_the_same_query(self):
+        comments, cursor = self.announcement.comments_page(size=20)
+        with self.assertNumQueries(0):
+            [str(comment.user) for comment in comments]
+
+
+class ReleaseCalendarTestCase(TestCase):
+    """
+    Testa o calendário de liberação das aulas
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.course = Course.objects.create(name='Django', slug='django')
+        self.released = Lesson.objects.create(course=self.course, name='Aula 1', release_date=self.today)
+        self.tomorrow = Lesson.objects.create(
+            course=self.course, name='Aula 2', release_date=self.today + timedelta(days=1)
+        )
+        self.undated = Lesson.objects.create(course=self.course, name='Aula 3')
+
+    def test_availability(self):
+        self.assertTrue(self.released.is_available())
+        self.assertFalse(self.tomorrow.is_available())
+        self.assertFalse(self.undated.is_available())
+        self.assertEqual(list(self.course.release_lessons()), [self.released])
+        self.assertEqual(next_release(self.course.pk), self.today + timedelta(days=1))
+
+    def test_availability_is_checked_in_memory(self):
+        self.released.is_available()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.tomorrow.is_available())
+
+    def test_saving_lesson_updates_calendar(self):
+        self.assertFalse(self.tomorrow.is_available())
+        self.tomorrow.release_date = self.today
+        self.tomorrow.save()
+        self.assertTrue(self.tomorrow.is_available())
+
+    def test_day_rollover(self):
+        self.assertFalse(self.tomorrow.is_available())
+        with mock.patch('django.utils.timezone.localdate', return_value=self.today + timedelta(days=1)):
+            call_command('rollover_lessons', stdout=StringIO())
+            with self.assertNumQueries(0):
+                self.assertTrue(self.tomorrow.is_available())
+            self.assertIsNone(next_release(self.course.pk))
+
+
+class MaterialDownloadTestCase(TestCase):
+    """
+    Testa o download protegido dos materiais
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(
+            MEDIA_ROOT=os.path.join(self.media_root, 'media'), PROTECTED_MEDIA_ROOT=os.path.join(self.media_root, 'protected')
+        )
+        self.settings.enable()
+        course = Course.objects.create(name='Django', slug='django')
+        lesson = Lesson.objects.create(course=course, name='Aula 1', release_date=timezone.localdate())
+        self.material = Material(lesson=lesson, name='Apostila')
+        self.material.file.save('apostila.pdf', ContentFile(b'0123456789' * 100))
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        Enrollment.objects.create(user=self.user, course=course, status=1)
+        self.client = Client()
+        self.client.login(username='aluno', password='123')
+        self.path = reverse('courses:material_download', args=['django', self.material.pk])
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_full_download(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 100)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_file_is_outside_media_root(self):
+        path = self.material.file.path
+        self.assertTrue(path.startswith(settings.PROTECTED_MEDIA_ROOT + os.sep))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, self.material.file.name)))
+
+    def test_material_page_redirects_to_download(self):
+        response = self.client.get(reverse('courses:material', args=['django', self.material.pk]))
+        self.assertRedirects(response, self.path, fetch_redirect_response=False)
+
+    def test_conditional_request(self):
+        etag = self.client.get(self.path)['ETag']
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_request(self):
+        response = self.client.get(self.path, HTTP_RANGE='bytes=10-14')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-14/1000')
+        self.assertEqual(b''.join(response.streaming_content), b'01234')
+        self.assertEqual(self.client.get(self.path, HTTP_RANGE='bytes=2000-').status_code, 416)
+
+    def test_stale_if_range_gets_full_file(self):
+        response = self.client.get(self.path, HTTP_RANGE='bytes=10-14', HTTP_IF_RANGE='"outro"')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PROTECTED_MEDIA_HEADER='X-Accel-Redirect')
+    def test_internal_redirect(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.material.file.name)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(PROTECTED_MEDIA_HEADER='X-Accel-Redirect')
+    def test_internal_redirect_with_accented_name(self):
+        self.material.file.save('aula_ção.pdf', ContentFile(b'0123456789'))
+        response = self.client.get(self.path)
+        self.assertEqual(
+            response['Content-Disposition'], "inline; filename=\"aula_cao.pdf\"; filename*=utf-8''aula_%C3%A7%C3%A3o.pdf"
+        )
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + quote(self.material.file.name))
+        self.assertTrue(response['X-Accel-Redirect'].isascii())
+
+    def test_not_enrolled_is_refused(self):
+        User.objects.create_user('outro', 'outro@teste.com', '123')
+        self.client.login(username='outro', password='123')
+        self.assertRedirects(self.client.get(self.path), reverse('accounts:dashboard'))
+
+
+class BulkEnrollmentTestCase(TestCase):
+    """
+    Testa a importação de inscrições em massa
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name='Django', slug='django')
+        self.users = [User.objects.create_user(f'aluno{i}', f'aluno{i}@teste.com', '123') for i in range(5)]
+        Enrollment.objects.create(user=self.users[0], course=self.course, status=1)
+
+    def test_bulk_enroll(self):
+        identifiers = ['aluno0', 'aluno1', 'aluno2@teste.com', 'aluno3', 'aluno4@teste.com', 'ninguem']
+        # Por lote: usuários, inscrições existentes, o INSERT e o UPDATE dos totais do curso
+        # (mais o SAVEPOINT e o RELEASE da transação do lote, já que o teste roda dentro de uma transação)
+        with self.assertNumQueries(12):
+            totals = Enrollment.objects.bulk_enroll(self.course, iter(identifiers), batch_size=3)
+        self.assertEqual(totals, {'read': 6, 'created': 4, 'existing': 1, 'not_found': 1})
+        self.assertEqual(self.course.enrollments.filter(status=1).count(), 5)
+        self.assertEqual(CourseStats.objects.get(course=self.course).approved, 5)
+
+    def test_bulk_enroll_same_user_twice(self):
+        """
+        Nome e email do mesmo aluno no mesmo lote: uma inscrição, e nenhum dos dois conta como não encontrado
+        """
+        totals = Enrollment.objects.bulk_enroll(self.course, ['aluno1', 'aluno1@teste.com', 'ninguem'])
+        self.assertEqual(totals, {'read': 3, 'created': 1, 'existing': 0, 'not_found': 1})
+        self.assertEqual(self.course.enrollments.filter(user=self.users[1]).count(), 1)
+
+    def test_bulk_enroll_invalidates_access_map(self):
+        self.assertEqual(get_access_map(self.users[1]), {})
+        Enrollment.objects.bulk_enroll(self.course, ['aluno1'])
+        self.assertEqual(get_access_map(self.users[1]), {'django': (self.course.pk, 1)})
+
+    def test_read_identifiers(self):
+        self.assertEqual(list(read_identifiers(['nome,email\n', 'Fulano,a@b.com\n'], 'csv')), ['a@b.com'])
+        self.assertEqual(list(read_identifiers(['aluno1\n', 'aluno2\n'], 'csv')), ['aluno1', 'aluno2'])
+        self.assertEqual(
+            list(read_identifiers(['"aluno1"\n', '\n', '{"email": "a@b.com"}\n'], 'jsonl')),
+            ['aluno1', 'a@b.com']
+        )
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('username\naluno1\naluno2\n')
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('import_enrollments', 'django', file.name, stdout=out)
+        self.assertIn('2 inscritos', out.getvalue())
+        self.assertEqual(self.course.enrollments.count(), 3)
+
+    def test_admin_action(self):
+        User.objects.create_superuser('admin', 'admin@teste.com', '123')
+        client = Client()
+        client.login(username='admin', password='123')
+        path = reverse('admin:courses_course_changelist')
+        data = {'action': 'import_enrollments', '_selected_action': [self.course.pk]}
+        self.assertContains(client.post(path, data), 'Importar inscrições')
+
+        upload = ContentFile(b'aluno3\naluno4\n', name='alunos.csv')
+        client.post(path, dict(data, file=upload, **{'import': '1'}))
+        self.assertEqual(self.course.enrollments.count(), 3)
+
+
+class SeatLimitTestCase(TestCase):
+    """
+    Testa o limite de vagas e a lista de espera
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name='Django', slug='django', seats=2)
+        self.users = [User.objects.create_user(f'aluno{i}', f'aluno{i}@teste.com', '123') for i in range(4)]
+
+    def test_waitlist_when_full(self):
+        statuses = [Enrollment.objects.enroll(user, self.course)[0].status for user in self.users[:3]]
+        self.assertEqual(statuses, [Enrollment.STATUS_APPROVED, Enrollment.STATUS_APPROVED, Enrollment.STATUS_WAITLIST])
+        # Inscrever de novo não ocupa outra vaga
+        enrollment, created = Enrollment.objects.enroll(self.users[0], self.course)
+        self.assertFalse(created)
+        self.assertEqual(self.course.seat_shards.aggregate(models.Sum('taken'))['taken__sum'], 2)
+
+    def test_cancel_promotes_waitlist(self):
+        enrollments = [Enrollment.objects.enroll(user, self.course)[0] for user in self.users[:3]]
+        Enrollment.objects.cancel(enrollments[0])
+        self.assertEqual(Enrollment.objects.get(pk=enrollments[2].pk).status, Enrollment.STATUS_APPROVED)
+        self.assertEqual(get_access_map(self.users[2]), {'django': (self.course.pk, Enrollment.STATUS_APPROVED)})
+
+    def test_more_seats_promotes_waitlist(self):
+        for user in self.users:
+            Enrollment.objects.enroll(user, self.course)
+        self.course.seats = 3
+        self.course.save()
+        self.assertEqual(self.course.enrollments.filter(status=Enrollment.STATUS_APPROVED).count(), 3)
+        self.assertEqual(self.course.enrollments.filter(status=Enrollment.STATUS_WAITLIST).count(), 1)
+
+    def test_bulk_enroll_respects_seats(self):
+        totals = Enrollment.objects.bulk_enroll(self.course, [user.username for user in self.users])
+        self.assertEqual(totals['created'], 4)
+        self.assertEqual(self.course.enrollments.filter(status=Enrollment.STATUS_APPROVED).count(), 2)
+
+    def test_bulk_enroll_conflict_does_not_keep_seats(self):
+        """
+        Um lote que esbarra numa inscrição criada ao mesmo tempo é refeito sem ocupar as vagas duas vezes
+        """
+        bulk_create = Enrollment.objects.bulk_create
+        with mock.patch.object(Enrollment.objects, 'bulk_create', side_effect=[IntegrityError, bulk_create]):
+            Enrollment.objects.bulk_enroll(self.course, ['aluno0', 'aluno1', 'aluno2'])
+        self.assertEqual(self.course.seat_shards.aggregate(models.Sum('taken'))['taken__sum'], 2)
+        stats = CourseStats.objects.get(course=self.course)
+        self.assertEqual((stats.approved, stats.waitlist), (2, 1))
+
+    def test_cancel_twice(self):
+        """
+        Dois cancelamentos da mesma inscrição devolvem a vaga e descontam os totais uma única vez
+        """
+        enrollments = [Enrollment.objects.enroll(user, self.course)[0] for user in self.users]
+        stale = Enrollment.objects.get(pk=enrollments[0].pk)
+        self.assertTrue(Enrollment.objects.cancel(enrollments[0]))
+        self.assertFalse(Enrollment.objects.cancel(stale))
+        self.assertEqual(self.course.seat_shards.aggregate(models.Sum('taken'))['taken__sum'], 2)
+        self.assertEqual(self.course.enrollments.filter(status=Enrollment.STATUS_APPROVED).count(), 2)
+        stats = CourseStats.objects.get(course=self.course)
+        self.assertEqual((stats.approved, stats.waitlist), (2, 1))
+
+
+class AccessInvalidationTestCase(TransactionTestCase):
+    """
+    O mapa de acesso montado por outra requisição antes do commit não fica no cache
+    """
+
+    def test_map_cached_before_commit_is_discarded(self):
+        cache.clear()
+        user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        course = Course.objects.create(name='Django', slug='django')
+        with transaction.atomic():
+            Enrollment.objects.create(user=user, course=course, status=1)
+            # Outra requisição (outra conexão) ainda não enxerga a inscrição e guarda o mapa vazio
+            cache.set(access_key(user.pk, get_generation()), {})
+            self.assertEqual(get_cached_access_map(user), {})
+        self.assertIsNone(get_cached_access_map(user))
+        self.assertEqual(get_access_map(user), {'django': (course.pk, 1)})
+
+
+class ReleaseCalendarInvalidationTestCase(TransactionTestCase):
+    """
+    O calendário montado por outra requisição antes do commit não fica no cache
+    """
+
+    def test_calendar_cached_before_commit_is_discarded(self):
+        cache.clear()
+        today = timezone.localdate()
+        course = Course.objects.create(name='Django', slug='django')
+        lesson = Lesson.objects.create(course=course, name='Aula 1', release_date=today + timedelta(days=1))
+        stale = get_calendar(course.pk)
+        with transaction.atomic():
+            lesson.release_date = today
+            lesson.save()
+            # Outra requisição (outra conexão) ainda vê a data antiga e guarda o calendário
+            cache.set(calendar_key(course.pk), stale)
+            self.assertFalse(lesson.is_available())
+        self.assertIsNone(cache.get(calendar_key(course.pk)))
+        self.assertTrue(lesson.is_available())
+        self.assertIsNone(next_release(course.pk))
+
+
+class ConcurrentEnrollmentTestCase(TransactionTestCase):
+    """
+    Várias inscrições ao mesmo tempo não podem passar do limite de vagas
+    """
+
+    def test_concurrent_enrollments(self):
+        course = Course.objects.create(name='Django', slug='django', seats=4)
+        users = [User.objects.create_user(f'aluno{i}', f'aluno{i}@teste.com', '123') for i in range(10)]
+        barrier = threading.Barrier(len(users))
+
+        def enroll(user):
+            barrier.wait()
+            try:
+                # No SQLite as escritas simultâneas podem esbarrar no lock do banco: tenta de novo
+                for _ in range(500):
+                    try:
+                        Enrollment.objects.enroll(user, course)
+                        return
+                    except OperationalError:
+                        time.sleep(random.uniform(0.001, 0.02))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=enroll, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(course.enrollments.count(), 10)
+        self.assertEqual(course.enrollments.filter(status=Enrollment.STATUS_APPROVED).count(), 4)
+        self.assertEqual(course.enrollments.filter(status=Enrollment.STATUS_WAITLIST).count(), 6)
+
+
+class ProgressTestCase(TestCase):
+    """
+    Testa o progresso dos alunos nas aulas (um bit por aula na inscrição)
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        self.course = Course.objects.create(name='Django', slug='django')
+        yesterday = timezone.localdate() - timedelta(days=1)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, name=f'Aula {i}', number=i, release_date=yesterday)
+            for i in range(1, 4)
+        ]
+        self.enrollment = Enrollment.objects.create(user=self.user, course=self.course, status=1)
+        self.client.login(username='aluno', password='123')
+
+    def test_bits_are_never_reused(self):
+        self.assertEqual([lesson.progress_bit for lesson in self.lessons], [0, 1, 2])
+        self.lessons[2].delete()
+        self.assertEqual(Lesson.objects.create(course=self.course, name='Aula 4').progress_bit, 3)
+        self.assertEqual(Lesson.objects.create(course=Course.objects.create(name='Outro'), name='A').progress_bit, 0)
+
+    def test_stale_course_save_keeps_counter(self):
+        """
+        Salvar um curso carregado antes das aulas (ex.: no admin) não volta o contador de bits
+        """
+        self.course.name = 'Django Avançado'
+        self.course.save()
+        Course.objects.only('name').get(pk=self.course.pk).save()
+        self.assertEqual(Course.objects.get(pk=self.course.pk).lesson_bits, 3)
+        self.assertEqual(Lesson.objects.create(course=self.course, name='Aula 4').progress_bit, 3)
+
+    def test_lesson_without_bit(self):
+        Lesson.objects.filter(pk=self.lessons[0].pk).update(progress_bit=None)
+        lesson = Lesson.objects.get(pk=self.lessons[0].pk)
+        self.assertFalse(Enrollment.objects.complete_lesson(self.user, lesson))
+
+    def test_viewing_a_lesson_completes_it(self):
+        lesson = self.lessons[1]
+        self.client.get(reverse('courses:show_lesson', args=['django', lesson.pk]))
+        self.enrollment.refresh_from_db()
+        self.assertEqual(bytes(self.enrollment.progress), b'\x02')
+        self.assertTrue(self.enrollment.has_completed(lesson))
+        self.assertEqual(self.enrollment.progress_percent(), 33)
+        # Já concluída: só a leitura do progresso, sem gravar de novo
+        with self.assertNumQueries(1):
+            self.assertFalse(Enrollment.objects.complete_lesson(self.user, lesson))
+
+        response = self.client.get(reverse('courses:lessons', args=['django']))
+        self.assertEqual(response.context['progress'], 33)
+        self.assertEqual(response.context['completed'], {lesson.pk})
+        self.assertContains(response, 'Você concluiu 33% das aulas')
+
+    def test_course_progress(self):
+        other = Enrollment.objects.create(
+            user=User.objects.create_user('outro', 'outro@teste.com', '123'), course=self.course, status=1
+        )
+        for lesson in self.lessons:
+            Enrollment.objects.complete_lesson(other.user, lesson)
+        Enrollment.objects.complete_lesson(self.user, self.lessons[0])
+        # Fora da lista de espera não entra na conta
+        Enrollment.objects.create(
+            user=User.objects.create_user('espera', 'espera@teste.com', '123'), course=self.course, status=3
+        )
+        self.assertEqual(
+            Enrollment.objects.course_progress(self.course), {'students': 2, 'average': 67, 'completed': 1}
+        )
+        # Aulas apagadas deixam de contar
+        self.lessons[2].delete()
+        self.assertEqual(
+            Enrollment.objects.course_progress(self.course), {'students': 2, 'average': 75, 'completed': 1}
+        )
+
+
+class ConcurrentProgressTestCase(TransactionTestCase):
+    """
+    Aulas concluídas ao mesmo tempo pelo mesmo aluno não podem se perder (compare-and-swap)
+    """
+
+    def test_concurrent_completions(self):
+        user = User.objects.create_user('aluno', 'aluno@teste.com', '123')
+        course = Course.objects.create(name='Django', slug='django')
+        lessons = [Lesson.objects.create(course=course, name=f'Aula {i}', number=i) for i in range(12)]
+        enrollment = Enrollment.objects.create(user=user, course=course, status=1)
+        barrier = threading.Barrier(len(lessons))
+
+        def complete(lesson):
+            barrier.wait()
+            try:
+                # No SQLite as escritas simultâneas podem esbarrar no lock do banco: tenta de novo
+                for _ in range(500):
+                    try:
+                        Enrollment.objects.complete_lesson(user, lesson)
+                        return
+                    except OperationalError:
+                        time.sleep(random.uniform(0.001, 0.02))
+            finally:
+                connection.close()
+
+        with mock.patch('simplemooc.courses.models.PROGRESS_ATTEMPTS', 100):
+            threads = [threading.Thread(target=complete, args=(lesson,)) for lesson in lessons]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        enrollment.refresh_from_db()
+        self.assertEqual(bytes(enrollment.progress), b'\xff\x0f')
+        self.assertEqual(enrollment.progress_percent(), 100)
+
+
+class CourseStatsTestCase(TestCase):
+    """
+    Testa os totais dos cursos (CourseStats), mantidos pelos signals
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(name='Django', slug='django', seats=1)
+        self.users = [User.objects.create_user(f'aluno{i}', f'aluno{i}@teste.com', '123') for i in range(3)]
+
+    def stats(self):
+        return CourseStats.objects.get(course=self.course).totals()
+
+    def test_signals_keep_totals(self):
+        first, second = [Enrollment.objects.enroll(user, self.course)[0] for user in self.users[:2]]
+        lesson = Lesson.objects.create(course=self.course, name='Aula 1', release_date=timezone.localdate())
+        announcement = Announcement.objects.create(course=self.course, title='Oi', content='Olá')
+        for user in self.users:
+            Comment.objects.create(announcement=announcement, user=user, comment='Legal')
+        self.assertEqual(self.stats(), {
+            'pending': 0, 'approved': 1, 'canceled': 0, 'waitlist': 1, 'announcements': 1, 'comments': 3, 'lessons': 1
+        })
+
+        # Cancelar libera a vaga para a lista de espera (update sem signals)
+        Enrollment.objects.cancel(first)
+        second = Enrollment.objects.get(pk=second.pk)
+        second.status = Enrollment.STATUS_CANCELED
+        second.save()
+        announcement.comments.first().delete()
+        lesson.delete()
+        self.assertEqual(self.stats(), {
+            'pending': 0, 'approved': 0, 'canceled': 1, 'waitlist': 0, 'announcements': 1, 'comments': 2, 'lessons': 0
+        })
+        # Apagar o anúncio apaga os comentários em cascata
+        announcement.delete()
+        self.assertEqual(self.stats()['comments'], 0)
+        self.assertEqual(self.stats()['announcements'], 0)
+
+    def test_rebuild(self):
+        Enrollment.objects.create(user=self.users[0], course=self.course, status=1)
+        CourseStats.objects.filter(course=self.course).update(approved=10, comments=3)
+        other = Course.objects.create(name='Python', slug='python')
+        CourseStats.objects.filter(course=other).delete()
+        out = StringIO()
+        call_command('rebuild_course_stats', stdout=out)
+        self.assertIn('2 cursos verificados, 2 corrigidos', out.getvalue())
+        self.assertEqual(self.stats()['approved'], 1)
+        self.assertEqual(self.stats()['comments'], 0)
+        self.assertTrue(CourseStats.objects.filter(course=other).exists())
+        self.assertEqual(CourseStats.objects.rebuild(), (2, 0))
+
+    def test_details_reads_one_row(self):
+        Enrollment.objects.create(user=self.users[0], course=self.course, status=1)
+        Lesson.objects.create(course=self.course, name='Aula 1', release_date=timezone.localdate())
+        Lesson.objects.create(course=self.course, name='Aula 2')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses:details', args=['django']))
+        self.assertContains(response, '1 aluno')
+        self.assertContains(response, '1 de 2')
+        self.assertFalse([query for query in context if 'COUNT' in query['sql']])
+        self.assertFalse([query for query in context if 'courses_coursestats' in query['sql'] and 'JOIN' not in query['sql']])
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+class LargeTableAdminTestCase(TestCase):
+    """
+    Testa as listagens do admin de tabelas grandes (contagem limitada, JOINs e paginação por chave)
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@teste.com', '123', is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+        self.course = Course.objects.create(name='Django', slug='django')
+        self.announcement = Announcement.objects.create(course=self.course, title='Oi', content='Olá')
+
+    def add_rows(self, total):
+        for i in range(total):
+            user = User.objects.create_user(f'aluno{User.objects.count()}', f'{i}-{User.objects.count()}@teste.com')
+            Enrollment.objects.create(user=user, course=self.course, status=1)
+            Comment.objects.create(announcement=self.announcement, user=user, comment='Legal')
+
+    def changelist(self, model, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(f'admin:courses_{model}_changelist'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, len(context), [query['sql'] for query in context]
+
+    def test_bounded_queries(self):
+        models_ = ['enrollment', 'comment', 'announcement', 'lesson']
+        self.add_rows(3)
+        small = {}
+        for model in models_:
+            response, small[model], queries = self.changelist(model)
+            # Nenhum COUNT sem LIMIT
+            self.assertFalse([sql for sql in queries if 'COUNT(' in sql and 'LIMIT' not in sql])
+        # Com mais linhas que ADMIN_EXACT_COUNT_LIMIT, o número de consultas continua o mesmo (sem consultas por linha)
+        self.add_rows(10)
+        for model in models_:
+            self.assertEqual(self.changelist(model)[1], small[model])
+
+    def test_keyset_pages(self):
+        self.add_rows(12)
+        with mock.patch('simplemooc.core.admin.LargeTableAdmin.list_per_page', 5):
+            response = self.changelist('comment')[0]
+            self.assertContains(response, 'Cerca de 6 Comentários')
+            ids = [comment.pk for comment in response.context['cl'].result_list]
+            self.assertEqual(ids, sorted(ids, reverse=True))
+            next_url = response.context['cl'].next_keyset_url()
+            self.assertIn(f'id__lt={ids[-1]}', next_url)
+            response = self.client.get(reverse('admin:courses_comment_changelist') + next_url)
+            self.assertEqual(
+                [comment.pk for comment in response.context['cl'].result_list],
+                list(Comment.objects.filter(pk__lt=ids[-1]).order_by('-pk').values_list('pk', flat=True)[:5])
+            )
+            self.assertContains(response, 'Primeiros registros')
+
+    def test_filters_and_searches_use_indexes(self):
+        """
+        Filtros e buscas das tabelas grandes: só em colunas que começam um índice, e a busca por prefixo ou exata
+        """
+        from django.contrib import admin
+        from simplemooc.core.admin import LargeTableAdmin
+
+        for model, model_admin in admin.site._registry.items():
+            if not isinstance(model_admin, LargeTableAdmin):
+                continue
+            leading = {index.fields[0].lstrip('-') for index in model._meta.indexes}
+            leading |= {fields[0] for fields in model._meta.unique_together}
+            leading |= {field.name for field in model._meta.fields if field.db_index or field.unique}
+            for name in model_admin.list_filter:
+                self.assertIn(name, leading, f'{model.__name__}.list_filter: {name}')
+            for name in model_admin.search_fields:
+                self.assertIn(name[0], '^=', f'{model.__name__}.search_fields: {name}')
+                if '__' not in name:
+                    self.assertIn(name[1:], leading, f'{model.__name__}.search_fields: {name}')
+
+    def test_small_tables_keep_numbered_pages(self):
+        self.add_rows(2)
+        response = self.changelist('enrollment')[0]
+        self.assertFalse(response.context['cl'].paginator.estimated)
+        self.assertContains(response, '2 Inscrições')
+
+
+class SeedDataTestCase(TestCase):
+    """
+    Testa a geração da massa de dados sintética
+    """
+
+    def test_seed_data(self):
+        call_command(
+            'seed_data', '--users=30', '--courses=4', '--lessons=3', '--materials=1', '--enrollments=40',
+            '--announcements=2', '--comments=50', stdout=StringIO()
+        )
+        courses = Course.objects.annotate(total=models.Count('enrollments')).order_by('slug')
+        totals = [course.total for course in courses]
+        # O primeiro curso é o maior
+        self.assertEqual(max(totals), courses[0].total)
+        self.assertEqual(Lesson.objects.count(), 12)
+        self.assertEqual(Comment.objects.count(), sum(Announcement.objects.values_list('comments_count', flat=True)))
+        self.assertTrue(SearchTerm.objects.filter(course=courses[0]).exists())
+        self.assertEqual(Enrollment.objects.course_progress(courses[0])['students'], courses[0].total)
+        self.assertEqual(courses[0].stats.approved, courses[0].total)
+        # --clear apaga a geração anterior antes de gerar de novo
+        call_command('seed_data', '--users=5', '--courses=1', '--clear', stdout=StringIO())
+        self.assertEqual(Course.objects.count(), 1)
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    As consultas mais frequentes têm que usar os índices: nada de ler a tabela inteira (SCAN / type ALL)
+    nem de ordenar à parte (TEMP B-TREE / filesort)
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_data', '--users=60', '--courses=5', '--lessons=10', '--materials=1', '--enrollments=150',
+            '--announcements=4', '--comments=200', stdout=StringIO()
+        )
+        cls.course = Course.objects.get(slug='seed-curso-0')
+        cls.announcement = cls.course.announcements.first()
+        cls.user = User.objects.get(username='seed-aluno0')
+        PasswordReset.objects.create(user=cls.user, key='chave')
+
+    def assertUsesIndexes(self, queryset):
+        if connection.vendor == 'mysql':
+            plan = queryset.explain(format='json')
+            problems = [
+                line.strip() for line in plan.splitlines()
+                if '"access_type": "ALL"' in line or '"using_filesort": true' in line
+            ]
+        else:
+            plan = queryset.explain()
+            problems = [line for line in plan.splitlines() if 'SCAN' in line or 'TEMP B-TREE' in line]
+        self.assertFalse(problems, f'{queryset.query}\n{plan}')
+
+    def test_announcement_fan_out(self):
+        self.assertUsesIndexes(
+            Enrollment.objects.filter(course=self.course, status=Enrollment.STATUS_APPROVED).values_list('user__email')
+        )
+
+    def test_waitlist(self):
+        self.assertUsesIndexes(
+            Enrollment.objects.filter(course=self.course, status=Enrollment.STATUS_WAITLIST).order_by('created_at')
+        )
+
+    def test_access_map(self):
+        self.assertUsesIndexes(Enrollment.objects.filter(user=self.user).values_list('course__slug', 'status'))
+
+    def test_lessons(self):
+        self.assertUsesIndexes(self.course.lessons.all())
+        self.assertUsesIndexes(self.course.release_lessons())
+        self.assertUsesIndexes(
+            Lesson.objects.filter(course=self.course, release_date__isnull=False).values_list('pk', 'release_date')
+        )
+
+    def test_announcements(self):
+        self.assertUsesIndexes(self.course.announcements.all())
+
+    def test_comments(self):
+        comments = self.announcement.comments.select_related('user').order_by('created_at', 'id')
+        self.assertUsesIndexes(comments)
+        self.assertUsesIndexes(comments.filter(
+            models.Q(created_at__gt=timezone.now()) | models.Q(created_at=timezone.now(), pk__gt=1)
+        ))
+
+    def test_password_resets(self):
+        self.assertUsesIndexes(self.user.resets.all())
@@ -12,7 +12,13 @@ urlpatterns = [
     path('<slug:course_slug>/inscricao/cancelar', views.undo_enrollment, name='undo_enrollment'),
     path('<slug:course_slug>/anuncios', views.announcements, name='announcements'),
     path('<slug:course_slug>/anuncios/<int:announcement_id>', views.show_announcement, name='announcement'),
+    path(
+        '<slug:course_slug>/anuncios/<int:announcement_id>/comentarios',
+        views.announcement_comments,
+        name='announcement_comments'
+    ),
     path('<slug:course_slug>/aulas', views.lessons, name='lessons'),
     path('<slug:course_slug>/aulas/<int:lesson_id>', views.show_lesson, name='show_lesson'),
     path('<slug:course_slug>/material/<int:material_id>', views.material, name='material'),
+    path('<slug:course_slug>/material/<int:material_id>/arquivo', views.material_download, name='material_download'),
 ]
@@ -1,26 +1,100 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-
+from django.core.cache import caches, InvalidCacheBackendError
+from django.core.paginator import Paginator
+from django.utils.dateparse import parse_datetime
+
+from simplemooc.core.cache import cache_anonymous_page, add_cache_tags
+from simplemooc.core.concurrency import gather
+from simplemooc.core.files import serve_protected_file
+from simplemooc.core.routers import read_from_replica
 from .models import Course, Enrollment, Lesson, Material
 from .forms import ContactCourse, CommentForm
+from .access import dashboard_menu_key
 from .decorators import enrollment_required
+from .releases import next_release
+
+
+# Quantidade de cursos por página na listagem
+COURSES_PER_PAGE = 20
+# Quantidade de comentários carregados por vez em um anúncio
+COMMENTS_PER_PAGE = 20
+
+
+def encode_cursor(cursor):
+    """
+    Cursor de paginação (created_at, id) em forma de texto, para ir na url
+    """
+    return f'{cursor[0].isoformat()}_{cursor[1]}' if cursor else ''
+
+
+def decode_cursor(value):
+    """
+    Faz o inverso de encode_cursor. Retorna None se o cursor for inválido
+    """
+    created_at, _, pk = (value or '').rpartition('_')
+    try:
+        created_at = parse_datetime(created_at)
+        return (created_at, int(pk)) if created_at else None
+    except ValueError:
+        return None
 
 
+def fragment_cache():
+    """
+    Cache usado pela tag {% cache %}
+    """
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def load_dashboard(request, course, queryset):
+    """
+    Carrega a lista da página do painel (aulas, anúncios) e, se o menu do painel não estiver no cache de trechos,
+    os cursos do menu, ao mesmo tempo (core.concurrency). O menu é entregue à tag my_courses pelo request
+    :return: A lista já carregada
+    """
+    user = request.user
+    if fragment_cache().get(dashboard_menu_key(user.pk, course)) is not None:
+        return list(queryset)
+
+    items, enrollments = gather(lambda: list(queryset), lambda: Enrollment.objects.dashboard(user))
+    request._my_courses = (user.pk, enrollments)
+    return items
+
+
+@cache_anonymous_page('catalog')
+@read_from_replica
 def index(request):
-    # Pegando todos os cursos
-    cursos = Course.objects.all()
+    # Pesquisa pelo índice de busca, ou pega todos os cursos
+    query = request.GET.get('q', '').strip()
+    if query:
+        # O resultado da busca também depende das aulas
+        add_cache_tags(request, 'search')
+    cursos = Course.objects.search(query) if query else Course.objects.all()
+    # Paginando (?page=<número>)
+    page = Paginator(cursos, COURSES_PER_PAGE).get_page(request.GET.get('page'))
     return render(request, 'courses/index.html', {
-        'courses': cursos
+        'courses': page,
+        'page': page,
+        'query': query
     })
 
 
+@cache_anonymous_page()
+@read_from_replica
 def details(request, course_slug):
     # Esse método funciona, mas pode retornar erro se o ID não existir.
     # curso = Course.objects.get(pk=course_id)  # ou slug=<variavel_slug>
 
     # O ideal é usar assim, para direcionar à pagina 404 se o objeto não existir:
-    curso = get_object_or_404(Course, slug=course_slug)  # ou pk=<variavel_id>
+    # Os totais do curso (CourseStats) vêm na mesma consulta
+    curso = get_object_or_404(Course.objects.select_related('stats'), slug=course_slug)  # ou pk=<variavel_id>
+    # Para o cache de páginas: a página deixa de valer quando este curso mudar
+    add_cache_tags(request, f'course:{curso.pk}')
     contexto = {}
 
     # Houve postagem e Formulário é válido?
@@ -49,12 +123,15 @@ def enrollments(request, course_slug):
     :param course_slug: slug do curso a ser adicionado
     """
     course = get_object_or_404(Course, slug=course_slug)
-    # Pega uma associação ou cria automaticamente para usuário/curso. O segundo parametro é se criou ou não (bool)
-    enrollment, created = Enrollment.objects.get_or_create(user=request.user, course=course)
+    # Pega a inscrição ou cria (já aprovada, ou na lista de espera se as vagas acabaram). O segundo parametro é se criou
+    enrollment, created = Enrollment.objects.enroll(request.user, course)
     # Precisou criar?
-    if created:
-        enrollment.active()
+    if created and enrollment.status == Enrollment.STATUS_WAITLIST:
+        messages.info(request, 'As vagas deste curso estão esgotadas. Você entrou na lista de espera.')
+    elif created:
         messages.success(request, 'Você foi inscrito no curso com sucesso :)')
+    elif enrollment.status == Enrollment.STATUS_WAITLIST:
+        messages.info(request, 'Você já está na lista de espera deste curso.')
     else:
         messages.info(request, 'Você já está inscrito neste curso ;)')
 
@@ -70,7 +147,8 @@ def undo_enrollment(request, course_slug):
 
     # Confirmou remoção da inscrição?
     if request.method == 'POST':
-        enrollment.delete()
+        # Libera a vaga (se ocupava uma) para o próximo da lista de espera
+        Enrollment.objects.cancel(enrollment)
         messages.success(request, 'Sua inscrição foi cancelada com sucesso!')
         return redirect('accounts:dashboard')
 
@@ -80,6 +158,7 @@ def undo_enrollment(request, course_slug):
 
 
 @login_required
+@read_from_replica
 @enrollment_required
 def announcements(request, course_slug):
     """
@@ -90,7 +169,7 @@ def announcements(request, course_slug):
 
     return render(request, 'courses/dashboard/announcements.html', {
         'course': course,
-        'announcements': course.announcements.all()
+        'announcements': load_dashboard(request, course, course.announcements.all())
     })
 
 
@@ -114,24 +193,59 @@ def show_announcement(request, course_slug, announcement_id):
         comment.save()
         form = CommentForm()
         messages.success(request, 'Seu comentário foi postado!')
+        # O total de comentários foi atualizado no BD pelo signal
+        announcement.refresh_from_db(fields=['comments_count'])
 
+    comments, cursor = announcement.comments_page(size=COMMENTS_PER_PAGE)
     return render(request, 'courses/dashboard/show_announcement.html', {
         'course': course,
         'announcement': announcement,
+        'comments': comments,
+        'cursor': encode_cursor(cursor),
         'form': form
     })
 
 
 @login_required
 @enrollment_required
+def announcement_comments(request, course_slug, announcement_id):
+    """
+    "Carregar mais": devolve apenas o trecho de HTML com os próximos comentários (depois do cursor ?after=)
+    """
+    course = request.course
+    announcement = get_object_or_404(course.announcements.all(), pk=announcement_id)
+    comments, cursor = announcement.comments_page(decode_cursor(request.GET.get('after')), COMMENTS_PER_PAGE)
+    return render(request, 'courses/dashboard/comments.html', {
+        'course': course,
+        'announcement': announcement,
+        'comments': comments,
+        'cursor': encode_cursor(cursor)
+    })
+
+
+@login_required
+@read_from_replica
+@enrollment_required
 def lessons(request, course_slug):
     # Pegando curso (no decorador)
     course = request.course
-    return render(request, 'courses/dashboard/lessons.html', {
+    # Chama todas as aulas se for admin, ou apenas as liberadas, caso contrário
+    lessons = load_dashboard(
+        request, course, course.lessons.all() if request.user.is_staff else course.release_lessons()
+    )
+    context = {
         'course': course,
-        # Chama todas as aulas se for admin, ou apenas as liberadas, caso contrário
-        'lessons': course.lessons.all() if request.user.is_staff else course.release_lessons()
-    })
+        'lessons': lessons,
+        'next_release': next_release(course.pk)
+    }
+    # Progresso do aluno (a equipe não tem inscrição)
+    enrollment = Enrollment.objects.filter(user=request.user, course=course).only('progress').first()
+    if enrollment is not None:
+        enrollment.course = course
+        context['progress'] = enrollment.progress_percent()
+        context['completed'] = {lesson.pk for lesson in lessons if enrollment.has_completed(lesson)}
+
+    return render(request, 'courses/dashboard/lessons.html', context)
 
 
 @login_required
@@ -145,6 +259,8 @@ def show_lesson(request, course_slug, lesson_id):
     if not request.user.is_staff and not lesson.is_available():
         messages.error(request, 'Essa aula ainda não está disponível')
         return redirect('accounts:dashboard')
+    # Marca a aula como concluída no progresso do aluno
+    Enrollment.objects.complete_lesson(request.user, lesson)
 
     return render(request, 'courses/dashboard/show_lesson.html', {
         'course': course,
@@ -158,17 +274,36 @@ def material(request, course_slug, material_id):
     # Pegando curso (no decorador)
     course = request.course
     # Pega o material, garantindo que ID informado pertence ao curso informado da aula informado
-    this_material = get_object_or_404(Material, pk=material_id, lesson__course=course)
+    this_material = get_object_or_404(Material.objects.select_related('lesson'), pk=material_id, lesson__course=course)
     # Se não for admin, verifica se a aula está disponível
     if not request.user.is_staff and not this_material.lesson.is_available():
         messages.error(request, 'Essa aula ainda não está disponível, e nem os materiais dela')
         return redirect('accounts:dashboard')
-    # Verifica se é embedded. Se não redireciona
+    # Ver um material também conclui a aula
+    Enrollment.objects.complete_lesson(request.user, this_material.lesson)
+    # Verifica se é embedded. Se não redireciona para o download protegido
     if not this_material.is_embedded():
-        return redirect(this_material.file.url)
+        return redirect('courses:material_download', course_slug=course.slug, material_id=this_material.pk)
 
     return render(request, 'courses/dashboard/material.html', {
         'course': course,
         'lesson': this_material.lesson,
         'material': this_material
     })
+
+
+@login_required
+@enrollment_required
+def material_download(request, course_slug, material_id):
+    """
+    Download do arquivo do material, apenas para inscritos (o arquivo não fica público em MEDIA_URL)
+    """
+    course = request.course
+    this_material = get_object_or_404(
+        Material.objects.select_related('lesson'), pk=material_id, lesson__course=course, file__gt=''
+    )
+    if not request.user.is_staff and not this_material.lesson.is_available():
+        messages.error(request, 'Essa aula ainda não está disponível, e nem os materiais dela')
+        return redirect('accounts:dashboard')
+
+    return serve_protected_file(request, this_material.file)
@@ -42,12 +42,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'simplemooc.core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'simplemooc.core.ratelimit.RateLimitMiddleware',
+    'simplemooc.core.routers.StickyPrimaryMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -55,7 +58,8 @@ ROOT_URLCONF = 'simplemooc.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que mede o tempo de renderização para as métricas
+        'BACKEND': 'simplemooc.core.metrics.TimedDjangoTemplates',
         'DIRS': [
             # Indicando qual o diretório padrão para os templates
             os.path.join(BASE_DIR, 'templates')
@@ -67,12 +71,14 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'simplemooc.core.context_processors.fragment_cache',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'simplemooc.wsgi.application'
+# Para servidores ASGI (uvicorn, daphne): simplemooc.asgi:application
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -84,10 +90,73 @@ DATABASES = {
         'USER': 'root',
         'PASSWORD': '',
         'PORT': 3306,
-        'HOST': 'localhost'
+        'HOST': 'localhost',
+        # Mantém a conexão aberta entre as requisições (segundos), em vez de conectar de novo a cada uma
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# Réplicas de leitura (aliases de DATABASES), usadas pelas views marcadas com @read_from_replica.
+# Sem réplicas, tudo vai para o 'default'. Ver simplemooc/core/routers.py
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['simplemooc.core.routers.PrimaryReplicaRouter']
+# Depois de gravar algo, o usuário lê do primário por esse tempo (segundos), para ver o que acabou de gravar
+REPLICA_STICKY_SECONDS = 5
+# Réplica atrasada mais que isso (segundos) deixa de receber leituras
+REPLICA_MAX_LAG = 2
+# De quanto em quanto tempo (segundos) o atraso de cada réplica é consultado, em cada processo
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# Threads (por processo) para as consultas independentes feitas em paralelo nas páginas do painel.
+# Cada thread mantém uma conexão com o BD. 0 = tudo em sequência. Ver simplemooc/core/concurrency.py
+CONCURRENT_READS_WORKERS = 4
+
+# Teste local das réplicas com dois SQLite (primário e réplica, sem replicação entre eles):
+# SIMPLEMOOC_LOCAL_REPLICA=1 python manage.py ...
+if os.environ.get('SIMPLEMOOC_LOCAL_REPLICA') == '1':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+        },
+    }
+    DATABASE_REPLICAS = ['replica']
+
+# Listagens do admin de tabelas grandes: até esse total a contagem é exata; acima, é estimada (core/paginator.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Em produção, use um cache compartilhado entre os processos (memcached ou redis). Com o LocMemCache
+# cada processo tem o seu próprio cache, e as invalidações não chegam aos outros processos
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'simplemooc',
+    }
+}
+
+# Tempo máximo (segundos) que uma página fica no cache de páginas anônimas, mesmo sem ser invalidada
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Tempo máximo (segundos) dos trechos de templates guardados com {% cache FRAGMENT_CACHE_TIMEOUT ... %}.
+# As chaves já mudam quando o conteúdo muda (updated_at, versão das inscrições), então o tempo só limita a memória
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Tempo máximo (segundos) que o mapa de acesso aos cursos de um usuário fica no cache
+ACCESS_MAP_TIMEOUT = 60 * 60 * 24
+
+# Tempo máximo (segundos) que o calendário de liberação de aulas de um curso fica no cache
+RELEASE_CALENDAR_TIMEOUT = 60 * 60 * 24 * 2
+
+# Quantidade de linhas (shards) do contador de vagas de cada curso com limite de vagas.
+# Mais shards = menos disputa entre inscrições simultâneas pela mesma linha
+SEAT_SHARDS = 8
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -132,6 +201,19 @@ STATIC_URL = '/public/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/images/'
 
+# Versões reduzidas (WebP) das imagens enviadas: larguras geradas (em pixels) e qualidade
+IMAGE_RENDITION_WIDTHS = [320, 640, 960]
+IMAGE_RENDITION_QUALITY = 80
+
+# Arquivos protegidos (materiais das aulas). Ficam fora do MEDIA_ROOT, para nunca serem servidos junto com as imagens.
+# Com o cabeçalho configurado, o Django só verifica a permissão e o servidor web envia o arquivo.
+# Exemplo para nginx (PROTECTED_MEDIA_HEADER = 'X-Accel-Redirect'):
+#     location /protected/ { internal; alias <PROTECTED_MEDIA_ROOT>/; }
+# Sem cabeçalho (None), o próprio Django envia o arquivo
+PROTECTED_MEDIA_ROOT = os.path.join(BASE_DIR, 'protected')
+PROTECTED_MEDIA_HEADER = None
+PROTECTED_MEDIA_PREFIX = '/protected/'
+
 # Configuração de Email
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Desenvolvimento. Comente para enviar por SMTP
 DEFAULT_FROM_EMAIL = 'Daniel Bispo <szagot@gmail.com>'
@@ -141,6 +223,22 @@ EMAIL_HOST_USER = 'szagot@gmail.com'
 EMAIL_HOST_PASSWORD = 'zrtdkwqmchtnchqn'  # https://security.google.com/settings/security/apppasswords
 EMAIL_PORT = 465
 
+# Quantidade de emails enviados por lote, usando a mesma conexão SMTP
+MAIL_BATCH_SIZE = 500
+# Envia os emails de anúncios fora da requisição (numa thread separada)
+ANNOUNCEMENT_MAIL_ASYNC = True
+
+# Fila de emails (outbox). Os emails são gravados no BD e enviados pelo comando: python manage.py send_queued_mail
+MAIL_OUTBOX_ENABLED = True
+# Número máximo de tentativas antes de marcar o email como falha
+MAIL_OUTBOX_MAX_ATTEMPTS = 5
+# Espera (segundos) antes da primeira nova tentativa. Dobra a cada falha
+MAIL_OUTBOX_RETRY_DELAY = 60
+# Tempo (segundos) que um worker tem para enviar as mensagens que reservou
+MAIL_OUTBOX_LEASE_SECONDS = 300
+# Janela (segundos) em que mensagens idênticas não são enfileiradas de novo
+MAIL_OUTBOX_DEDUPE_SECONDS = 600
+
 # Email para o formulário de contato
 CONTACT_EMAIL = 'danielbispo.sp64@gmail.com'
 
@@ -150,3 +248,42 @@ LOGIN_REDIRECT_URL = 'core:home'
 LOGOUT_URL = 'accounts:logout'
 # Qual é o model padrão para usuários? Comente para usar o model do Django
 AUTH_USER_MODEL = 'accounts.User'
+
+# Limite de requisições por cliente, pelo nome da url (ver simplemooc/core/ratelimit.py).
+# rate: requisições/período (s, m, h ou d). key: 'ip' (padrão) ou 'user' (anônimos continuam pelo IP)
+RATELIMITS = {
+    # Formulário de contato do curso (envia email)
+    'courses:details': {'rate': '5/m', 'methods': ['POST']},
+    # Cadastro (hash da senha)
+    'accounts:register': {'rate': '10/h', 'methods': ['POST']},
+    # Pedido de nova senha (envia email)
+    'accounts:reset': {'rate': '5/h', 'methods': ['POST']},
+    # Comentários nos anúncios
+    'courses:announcement': {'rate': '10/m', 'methods': ['POST'], 'key': 'user'},
+}
+
+# Métricas por view (tempo de resposta, consultas SQL e templates), em /metrics no formato do Prometheus
+METRICS_ENABLED = True
+# Token para o Prometheus ler as métricas (Authorization: Bearer <token>). Sem token, só a equipe (staff) vê
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Limites (segundos) dos baldes do histograma de tempo de resposta
+METRICS_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+# De quanto em quanto tempo (segundos) cada processo grava as suas métricas no cache, para serem somadas
+METRICS_FLUSH_SECONDS = 10
+# Processos que não gravam as métricas há mais que isso (segundos) deixam de ser somados
+METRICS_WORKER_TIMEOUT = 300
+
+# Aquecimento do worker na inicialização (simplemooc/warmup.py): urls, templates, BD e caches.
+# Pode ser desligado com a variável de ambiente SIMPLEMOOC_WARMUP=0
+WARMUP_ON_START = os.environ.get('SIMPLEMOOC_WARMUP', '1') == '1'
+# Quantos cursos (os mais recentes) têm o calendário de liberação carregado no cache no aquecimento
+WARMUP_CALENDARS = 100
+# Fecha as conexões com o BD abertas no aquecimento. Necessário com o gunicorn --preload, senão os workers herdam
+# os mesmos sockets. Sem o --preload pode ser desligado (SIMPLEMOOC_WARMUP_CLOSE_CONNECTIONS=0): o worker já começa conectado
+WARMUP_CLOSE_CONNECTIONS = os.environ.get('SIMPLEMOOC_WARMUP_CLOSE_CONNECTIONS', '1') == '1'
+
+# Nova senha: links assinados (não gravam nada no BD e deixam de valer quando a senha muda).
+# Desligado, volta a gravar uma chave na tabela PasswordReset para cada pedido
+PASSWORD_RESET_SIGNED_TOKENS = True
+# Validade (dias) dos links de nova senha, assinados ou não
+PASSWORD_RESET_TIMEOUT_DAYS = 1
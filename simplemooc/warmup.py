@@ -0,0 +1,116 @@
+"""
+Aquecimento do processo (worker) na inicialização, chamado pelo wsgi.py.
+
+Sem ele, as primeiras requisições de cada worker novo pagam pela montagem das urls, pela leitura e compilação
+dos templates (template.html -> accounts/dashboard.html -> courses/dashboard.html ...), pela primeira conexão
+com o BD e pelos caches vazios. Aqui tudo isso é feito antes do worker receber a primeira requisição.
+
+Os templates compilados só ficam guardados com o loader em cache, que o Django usa automaticamente com DEBUG = False.
+Com o gunicorn --preload o aquecimento roda uma vez só, no processo principal, e os workers herdam tudo.
+Nesse caso as conexões com o BD não devem ser herdadas: o wsgi.py e o asgi.py as fecham ao final
+(settings.WARMUP_CLOSE_CONNECTIONS, ligado por padrão).
+"""
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_urls():
+    """
+    Monta as tabelas de urls (inclusive as do admin) de todos os namespaces
+    :return: Total de rotas nomeadas
+    """
+    resolver = get_resolver()
+    total = len([name for name in resolver.reverse_dict if isinstance(name, str)])
+    for prefix, namespace_resolver in resolver.namespace_dict.values():
+        total += len([name for name in namespace_resolver.reverse_dict if isinstance(name, str)])
+
+    return total
+
+
+def compile_templates():
+    """
+    Compila todos os templates das pastas de TEMPLATES['DIRS']
+    :return: Tupla (compilados, com erro)
+    """
+    compiled = failed = 0
+    for engine in engines.all():
+        for directory in engine.dirs:
+            for root, dirs, files in os.walk(directory):
+                for file in files:
+                    name = os.path.relpath(os.path.join(root, file), directory)
+                    try:
+                        engine.get_template(name.replace(os.sep, '/'))
+                        compiled += 1
+                    except Exception:
+                        logger.warning('Não foi possível compilar o template %s', name, exc_info=True)
+                        failed += 1
+
+    return compiled, failed
+
+
+def check_databases():
+    """
+    Abre e testa a conexão com cada BD
+    """
+    for alias in connections:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    return len(connections.databases)
+
+
+def prime_caches():
+    """
+    Deixa no cache as versões das tags mais usadas e os calendários de liberação dos cursos mais recentes
+    :return: Total de calendários
+    """
+    from simplemooc.core.cache import get_tag_versions
+    from simplemooc.courses.access import GENERATION_TAG
+    from simplemooc.courses.models import Course
+    from simplemooc.courses.releases import get_calendar
+
+    get_tag_versions(['catalog', 'search', GENERATION_TAG])
+    course_ids = Course.objects.order_by('-pk').values_list('pk', flat=True)[:settings.WARMUP_CALENDARS]
+    for course_id in course_ids:
+        get_calendar(course_id)
+
+    return len(course_ids)
+
+
+def warm_up(close_connections=False):
+    """
+    Executa todas as etapas, registrando no log o tempo de cada uma. Uma etapa com erro não impede as demais
+    :return: Dicionário etapa -> {'seconds': tempo, 'result': retorno da etapa ou 'error': mensagem}
+    """
+    report = {}
+    start = time.perf_counter()
+    for name, step in (
+        ('urls', resolve_urls),
+        ('templates', compile_templates),
+        ('databases', check_databases),
+        ('caches', prime_caches),
+    ):
+        step_start = time.perf_counter()
+        try:
+            report[name] = {'result': step()}
+        except Exception as e:
+            logger.exception('Falha no aquecimento: %s', name)
+            report[name] = {'error': repr(e)}
+        report[name]['seconds'] = time.perf_counter() - step_start
+
+    if close_connections:
+        connections.close_all()
+
+    logger.info(
+        'Aquecimento em %.3fs: %s', time.perf_counter() - start,
+        ', '.join(f"{name} {step['seconds']:.3f}s" for name, step in report.items())
+    )
+    return report
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simplemooc.settings')
 
 application = get_wsgi_application()
+
+# Aquece o worker antes da primeira requisição (ver simplemooc/warmup.py)
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_START:
+    from simplemooc.warmup import warm_up
+
+    warm_up(close_connections=settings.WARMUP_CLOSE_CONNECTIONS)